@@ -14,21 +14,120 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- Trigger to keep only 5 versions of each section for a proposal
+-- Creates the monthly RANGE partition <table>_yYYYYmMM covering p_month (no-op if it exists).
+-- Rows for that month already sitting in <table>_default are moved into the new partition,
+-- since the default partition's constraint would otherwise block its creation.
+CREATE OR REPLACE FUNCTION public.add_monthly_partition(p_table TEXT, p_month DATE)
+RETURNS VOID AS $$
+DECLARE
+    v_start DATE := date_trunc('month', p_month)::DATE;
+    v_end DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::DATE;
+    v_partition TEXT := p_table || to_char(date_trunc('month', p_month), '"_y"YYYY"m"MM');
+    v_default TEXT := p_table || '_default';
+    v_key TEXT;
+    v_spilled BIGINT := 0;
+BEGIN
+    IF to_regclass(v_partition) IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    IF to_regclass(v_default) IS NOT NULL THEN
+        SELECT a.attname INTO v_key
+        FROM pg_partitioned_table pt
+        JOIN pg_attribute a ON a.attrelid = pt.partrelid AND a.attnum = pt.partattrs[0]
+        WHERE pt.partrelid = p_table::regclass;
+
+        DROP TABLE IF EXISTS partition_spill;
+        EXECUTE format('CREATE TEMP TABLE partition_spill (LIKE %I) ON COMMIT DROP', p_table);
+        EXECUTE format('WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *)
+                        INSERT INTO partition_spill SELECT * FROM moved',
+                       v_default, v_key, v_start, v_key, v_end);
+        GET DIAGNOSTICS v_spilled = ROW_COUNT;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', v_partition, p_table, v_start, v_end);
+
+    IF v_spilled > 0 THEN
+        EXECUTE format('INSERT INTO %I SELECT * FROM partition_spill', v_partition);
+    END IF;
+    DROP TABLE IF EXISTS partition_spill;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Creates partitions of a monthly-partitioned table through p_months_ahead and detaches those wholly
+-- older than p_retain_months (NULL keeps everything). Detached months stay as standalone tables for
+-- archiving (pg_dump, then DROP). Returns the detached table names. Run monthly for every such table.
+CREATE OR REPLACE FUNCTION public.maintain_monthly_partitions(
+    p_table TEXT,
+    p_months_ahead INTEGER DEFAULT 3,
+    p_retain_months INTEGER DEFAULT NULL
+) RETURNS TEXT[] AS $$
+DECLARE
+    v_partition RECORD;
+    v_detached TEXT[] := '{}';
+BEGIN
+    PERFORM add_monthly_partition(p_table, m::DATE)
+    FROM generate_series(date_trunc('month', CURRENT_TIMESTAMP),
+                         date_trunc('month', CURRENT_TIMESTAMP) + make_interval(months => p_months_ahead),
+                         INTERVAL '1 month') m;
+
+    IF p_retain_months IS NOT NULL THEN
+        FOR v_partition IN
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = p_table::regclass
+              AND c.relname = p_table || substring(c.relname FROM '_y[0-9]{4}m[0-9]{2}$')
+              AND to_date(substring(c.relname FROM '[0-9]{4}m[0-9]{2}$'), 'YYYY"m"MM') + INTERVAL '1 month'
+                  <= date_trunc('month', CURRENT_TIMESTAMP) - make_interval(months => p_retain_months)
+            ORDER BY c.relname
+        LOOP
+            EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', p_table, v_partition.relname);
+            v_detached := v_detached || v_partition.relname::TEXT;
+        END LOOP;
+    END IF;
+    RETURN v_detached;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keeps the newest N versions of each section (N = proposal_blueprints.section_retention,
+-- 5 for proposals without a blueprint, all when NULL). Active versions are never pruned.
+-- p_proposal_ids NULL prunes every proposal (e.g. after a backfill).
+CREATE OR REPLACE FUNCTION public.prune_section_versions(p_proposal_ids UUID[] DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    DELETE FROM proposal_sections ps
+    USING (
+        SELECT ranked.id
+        FROM (
+            SELECT s.id, s.is_active,
+                   ROW_NUMBER() OVER (PARTITION BY s.proposal_id, s.section_code ORDER BY s.version DESC, s.id DESC) AS rn,
+                   CASE WHEN pm.blueprint_id IS NULL THEN 5 ELSE pb.section_retention END AS keep
+            FROM proposal_sections s
+            JOIN proposal_master pm ON pm.proposal_id = s.proposal_id
+            LEFT JOIN proposal_blueprints pb ON pb.id = pm.blueprint_id
+            WHERE p_proposal_ids IS NULL OR s.proposal_id = ANY(p_proposal_ids)
+        ) ranked
+        WHERE ranked.keep IS NOT NULL AND ranked.rn > ranked.keep AND NOT COALESCE(ranked.is_active, FALSE)
+    ) doomed
+    WHERE ps.id = doomed.id;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level trigger: one prune per INSERT statement for the proposals it touched.
+-- Bulk loaders can SET LOCAL prakalpa.defer_version_pruning = 'on' and call prune_section_versions() once at the end.
 CREATE OR REPLACE FUNCTION public.cleanup_old_versions()
 RETURNS TRIGGER AS $$
 BEGIN
-    DELETE FROM proposal_sections
-    WHERE proposal_id = NEW.proposal_id
-      AND section_code = NEW.section_code
-      AND id NOT IN (
-          SELECT id FROM proposal_sections
-          WHERE proposal_id = NEW.proposal_id
-            AND section_code = NEW.section_code
-          ORDER BY version DESC
-          LIMIT 5
-      );
-    RETURN NEW;
+    IF current_setting('prakalpa.defer_version_pruning', TRUE) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    PERFORM prune_section_versions(ARRAY(SELECT DISTINCT proposal_id FROM new_rows));
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -503,6 +602,41 @@ CREATE TABLE IF NOT EXISTS village_amenities_raw (
     total_land_area_irrigated_by_other_water_sources_specify_uom TEXT
 );
 
+-- Lenient TEXT -> NUMERIC cast for NDAP extracts (blank or non-numeric -> NULL)
+CREATE OR REPLACE FUNCTION safe_numeric(val TEXT) RETURNS NUMERIC AS $$
+    SELECT CASE WHEN val ~ '^\s*[-+]?[0-9]*\.?[0-9]+\s*$' THEN trim(val)::NUMERIC END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- safe_numeric() for INTEGER columns: NULL (not an overflow error) when the value does not fit
+CREATE OR REPLACE FUNCTION safe_integer(val TEXT) RETURNS INTEGER AS $$
+    SELECT CASE WHEN round(n) BETWEEN -2147483648 AND 2147483647 THEN round(n)::INTEGER END
+    FROM (SELECT safe_numeric(val) AS n) v;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Village Amenities (Typed): one row per village/year, rebuilt from village_amenities_raw by ingest_ndap_7121.py
+CREATE TABLE IF NOT EXISTS village_amenities (
+    composite_key TEXT NOT NULL, -- state-district-sub_district-village
+    year TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL,
+    district TEXT NOT NULL,
+    sub_district TEXT NOT NULL,
+    village TEXT NOT NULL,
+    area_ha NUMERIC,
+    households INTEGER,
+    rural_population INTEGER,
+    sc_rural_population INTEGER,
+    st_rural_population INTEGER,
+    nearest_town_name TEXT,
+    distance_to_nearest_town_km NUMERIC,
+    district_hq_name TEXT,
+    distance_to_district_hq_km NUMERIC,
+    taluk_hq_name TEXT,
+    distance_to_taluk_hq_km NUMERIC,
+    PRIMARY KEY (composite_key, year)
+);
+
+CREATE INDEX IF NOT EXISTS idx_village_amenities_district ON village_amenities(state, district, sub_district);
+
 -- ==========================================
 -- 3. APPLICATION DOMAIN & PROPOSALS
 -- ==========================================
@@ -623,6 +757,10 @@ CREATE TABLE IF NOT EXISTS proposal_blueprints (
 
 CREATE UNIQUE INDEX IF NOT EXISTS idx_single_default ON proposal_blueprints (is_default) WHERE (is_default = TRUE);
 
+-- Section versions kept per (proposal, section); NULL keeps every version
+ALTER TABLE proposal_blueprints ADD COLUMN IF NOT EXISTS section_retention INTEGER DEFAULT 5
+    CHECK (section_retention IS NULL OR section_retention >= 1);
+
 -- Proposal Master (Consolidated Header)
 CREATE TABLE IF NOT EXISTS proposal_master (
     proposal_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -694,9 +832,14 @@ CREATE TABLE IF NOT EXISTS proposal_sections (
 -- Ensure only one active version per section per proposal
 ALTER TABLE proposal_sections ADD CONSTRAINT unique_active_section UNIQUE (proposal_id, section_code) WHERE (is_active = TRUE);
 
+-- Version history lookups and pruning walk this index newest-first
+CREATE INDEX IF NOT EXISTS idx_proposal_sections_versions ON proposal_sections (proposal_id, section_code, version DESC);
+
+DROP TRIGGER IF EXISTS trigger_cleanup_versions ON proposal_sections;
 CREATE TRIGGER trigger_cleanup_versions
     AFTER INSERT ON proposal_sections
-    FOR EACH ROW
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
     EXECUTE FUNCTION cleanup_old_versions();
 
 -- ==========================================
@@ -761,30 +904,76 @@ CREATE INDEX IF NOT EXISTS idx_schools_cluster ON schools(cluster_id);
 CREATE INDEX IF NOT EXISTS idx_schools_udise ON schools(udise_code);
 
 -- UDISE+ Comprehensive School Data
+-- Narrow registry + summary row, partitioned by year_id (a new year is a new partition).
+-- Raw API blobs live in school_fragments; schools_udise_data_full restores the wide shape.
 CREATE TABLE IF NOT EXISTS schools_udise_data (
-    id SERIAL PRIMARY KEY,
-    udise_code VARCHAR(20) NOT NULL,
-    school_id INTEGER, -- UDISE internal school ID
-    year_id INTEGER NOT NULL, -- 11=2024-25, 12=2025-26
+    -- Identity
+    school_id INTEGER NOT NULL, -- UDISE internal school ID
+    year_id INTEGER NOT NULL DEFAULT 12, -- 11=2024-25, 12=2025-26
     effective_year INTEGER,
-    
-    -- Scraping Metadata
-    last_scraped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    scrape_status VARCHAR(20) DEFAULT 'success', -- success, failed, partial
-    retry_count INTEGER DEFAULT 0,
-    error_message TEXT,
-    
-    -- Store complete API responses as JSONB for flexibility
-    basic_info JSONB, -- /school/by-year
-    report_card JSONB, -- /school/report-card
-    facility_data JSONB, -- /school/facility
-    profile_data JSONB, -- /school/profile
-    enrollment_social JSONB, -- /getSocialData?flag=1 (caste)
-    enrollment_religion JSONB, -- /getSocialData?flag=2 (religion, BPL, CWSN)
-    enrollment_mainstreamed JSONB, -- /getSocialData?flag=3
-    enrollment_ews JSONB, -- /getSocialData?flag=4
-    enrollment_rte JSONB, -- /getSocialData?flag=5
-    
+    udise_code VARCHAR(20) NOT NULL,
+    school_name VARCHAR,
+    school_status INTEGER,
+    status_name VARCHAR,
+    last_modified TIMESTAMP,
+
+    -- Geographic & LGD Hierarchy
+    state_id INTEGER,
+    state_cd VARCHAR,
+    state_name VARCHAR,
+    district_id INTEGER,
+    district_cd VARCHAR,
+    district_name VARCHAR,
+    block_id INTEGER,
+    block_cd VARCHAR,
+    block_name VARCHAR,
+    cluster_id INTEGER,
+    cluster_cd VARCHAR,
+    cluster_name VARCHAR,
+    village_id INTEGER,
+    vill_ward_cd VARCHAR,
+    village_name VARCHAR,
+    pincode INTEGER,
+    address TEXT,
+    email VARCHAR,
+
+    -- LGD Codes
+    lgd_state_id INTEGER,
+    lgd_district_id INTEGER,
+    lgd_block_id INTEGER,
+    lgd_village_id VARCHAR,
+    lgd_vill_name VARCHAR,
+    lgd_panchayat_id VARCHAR,
+    lgd_vill_panchayat_name VARCHAR,
+    lgd_urban_local_body_id VARCHAR,
+    lgd_urban_local_body_name VARCHAR,
+    lgd_ward_id VARCHAR,
+    lgd_ward_name VARCHAR,
+
+    -- Urban/Rural Metadata
+    sch_loc_rural_urban INTEGER,
+    sch_loc_desc VARCHAR,
+
+    -- Categories & Management
+    sch_category_id INTEGER,
+    sch_cat_desc VARCHAR,
+    sch_type INTEGER,
+    sch_type_desc VARCHAR,
+    sch_mgmt_id INTEGER,
+    sch_mgmt_desc VARCHAR,
+    sch_mgmt_parent_id INTEGER,
+    sch_mgmt_desc_st VARCHAR,
+    sch_broad_mgmt_id INTEGER,
+    class_frm INTEGER,
+    class_to INTEGER,
+
+    -- Operational History
+    is_operational_2018_to_19 INTEGER,
+    is_operational_2019_to_20 INTEGER,
+    is_operational_2020_to_21 INTEGER,
+    is_operational_2021_to_22 INTEGER,
+    is_operational_2022_to_23 INTEGER,
+
     -- Extracted Summary Fields (for easy querying)
     total_students INTEGER,
     total_boys INTEGER,
@@ -794,13 +983,253 @@ CREATE TABLE IF NOT EXISTS schools_udise_data (
     has_library BOOLEAN,
     has_playground BOOLEAN,
     has_electricity BOOLEAN,
-    
-    UNIQUE(udise_code, year_id)
+
+    -- Scraping Metadata
+    scrape_status VARCHAR(20) DEFAULT 'pending', -- pending, success, partial, missing_on_server, closed_registry
+    retry_count INTEGER DEFAULT 0,
+    error_message TEXT,
+    enrichment_manifest JSONB, -- Fragment key -> last HTTP status
+    last_scraped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    PRIMARY KEY (school_id, year_id),
+    UNIQUE (udise_code, year_id) -- Facility facts, crosswalk and village context key schools by code
+) PARTITION BY LIST (year_id);
+
+CREATE INDEX IF NOT EXISTS idx_schools_udise_data_udise_code ON schools_udise_data(udise_code);
+CREATE INDEX IF NOT EXISTS idx_schools_udise_data_state_status ON schools_udise_data(state_name, scrape_status);
+CREATE INDEX IF NOT EXISTS idx_schools_udise_data_lgd_village_id ON schools_udise_data(lgd_village_id);
+CREATE INDEX IF NOT EXISTS idx_schools_udise_data_pincode ON schools_udise_data(pincode);
+CREATE INDEX IF NOT EXISTS idx_schools_udise_data_cluster_id ON schools_udise_data(cluster_id);
+
+-- Creates the partition for an academic year (e.g. SELECT add_school_year_partition(13);)
+CREATE OR REPLACE FUNCTION add_school_year_partition(p_year_id INTEGER) RETURNS VOID AS $$
+BEGIN
+    EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF schools_udise_data FOR VALUES IN (%s)',
+                   'schools_udise_data_y' || p_year_id, p_year_id);
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT add_school_year_partition(11);
+SELECT add_school_year_partition(12);
+CREATE TABLE IF NOT EXISTS schools_udise_data_default PARTITION OF schools_udise_data DEFAULT;
+
+-- Raw UDISE+ API responses, one row per (school, year, fragment); partitioned per fragment
+-- so a reader of one blob kind never touches the others.
+CREATE TABLE IF NOT EXISTS school_fragments (
+    school_id INTEGER NOT NULL,
+    year_id INTEGER NOT NULL, -- Year the fragment was fetched for (effective_year)
+    fragment VARCHAR(30) NOT NULL, -- basic_info, report_card, facility_data, ..., enrollment_rte
+    payload JSONB NOT NULL,
+    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (school_id, year_id, fragment)
+) PARTITION BY LIST (fragment);
+
+DO $$
+DECLARE
+    v_fragment TEXT;
+BEGIN
+    FOREACH v_fragment IN ARRAY ARRAY['basic_info', 'report_card', 'facility_data', 'profile_data',
+                                      'enrollment_social', 'enrollment_religion', 'enrollment_mainstreamed',
+                                      'enrollment_ews', 'enrollment_rte']
+    LOOP
+        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF school_fragments FOR VALUES IN (%L)',
+                       'school_fragments_' || v_fragment, v_fragment);
+    END LOOP;
+END $$;
+
+-- Compatibility View: the pre-partitioning wide row (registry + summary + the nine blobs).
+-- Blob columns are per-row index lookups, evaluated only when a query selects them.
+CREATE OR REPLACE VIEW schools_udise_data_full AS
+SELECT s.*,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'basic_info') AS basic_info,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'report_card') AS report_card,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'facility_data') AS facility_data,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'profile_data') AS profile_data,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'enrollment_social') AS enrollment_social,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'enrollment_religion') AS enrollment_religion,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'enrollment_mainstreamed') AS enrollment_mainstreamed,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'enrollment_ews') AS enrollment_ews,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'enrollment_rte') AS enrollment_rte
+FROM schools_udise_data s;
+
+-- Facility Facts: facility_data extracted once per write instead of on every view read.
+-- school_facility_extract is the single extraction definition; the triggers below
+-- re-extract only schools whose facility_data fragment (or name/state) changed.
+CREATE OR REPLACE VIEW school_facility_extract AS
+SELECT s.udise_code, s.year_id, s.school_name, s.state_name,
+       f.payload->'data'->>'bldStatus' as building_status,
+       safe_numeric(f.payload->'data'->>'bldBlkTot')::INTEGER as building_blocks,
+       f.payload->'data'->>'bndrywallType' as boundary_wall_type,
+       safe_numeric(f.payload->'data'->>'playgroundYn') = 1 as has_playground,
+       safe_numeric(f.payload->'data'->>'rampsYn') = 1 as has_ramps,
+       safe_numeric(f.payload->'data'->>'handrailsYn') = 1 as has_handrails,
+       safe_numeric(f.payload->'data'->>'solarpanelYn') = 1 as has_solar_power,
+       safe_numeric(f.payload->'data'->>'rainHarvestYn') = 1 as has_rain_harvesting,
+       safe_numeric(f.payload->'data'->>'clsrmsInst')::INTEGER as total_classrooms,
+       safe_numeric(f.payload->'data'->>'clsrmsGd')::INTEGER as rooms_good,
+       safe_numeric(f.payload->'data'->>'clsrmsMin')::INTEGER as rooms_minor_repair,
+       safe_numeric(f.payload->'data'->>'clsrmsMaj')::INTEGER as rooms_major_repair,
+       safe_numeric(f.payload->'data'->>'clsrmsGdPpu')::INTEGER as rooms_pucca_good,
+       safe_numeric(f.payload->'data'->>'stusHvFurnt') = 1 as has_furniture,
+       safe_numeric(f.payload->'data'->>'internetYn') = 1 as has_internet,
+       safe_numeric(f.payload->'data'->>'ictLabYn') = 1 as has_ict_lab,
+       safe_numeric(f.payload->'data'->>'laptopTot')::INTEGER as laptop_count,
+       safe_numeric(f.payload->'data'->>'desktopFun')::INTEGER as desktop_count,
+       safe_numeric(f.payload->'data'->>'projectorTot')::INTEGER as projector_count,
+       safe_numeric(f.payload->'data'->>'printerTot')::INTEGER as printer_count,
+       safe_numeric(f.payload->'data'->>'hmRoomYn') = 1 as has_principal_room,
+       safe_numeric(f.payload->'data'->>'libraryYn') = 1 as has_library,
+       safe_numeric(f.payload->'data'->>'tinkeringLabYn') = 1 as has_atal_tinkering_lab,
+       safe_numeric(f.payload->'data'->>'othrooms')::INTEGER as staff_and_store_rooms_count,
+       CURRENT_TIMESTAMP as refreshed_at
+FROM schools_udise_data s
+LEFT JOIN school_fragments f
+       ON f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'facility_data';
+
+CREATE TABLE IF NOT EXISTS school_facility_facts (
+    udise_code VARCHAR(20) NOT NULL,
+    year_id INTEGER NOT NULL,
+    school_name VARCHAR,
+    state_name VARCHAR,
+    building_status TEXT,
+    building_blocks INTEGER,
+    boundary_wall_type TEXT,
+    has_playground BOOLEAN,
+    has_ramps BOOLEAN,
+    has_handrails BOOLEAN,
+    has_solar_power BOOLEAN,
+    has_rain_harvesting BOOLEAN,
+    total_classrooms INTEGER,
+    rooms_good INTEGER,
+    rooms_minor_repair INTEGER,
+    rooms_major_repair INTEGER,
+    rooms_pucca_good INTEGER,
+    has_furniture BOOLEAN,
+    has_internet BOOLEAN,
+    has_ict_lab BOOLEAN,
+    laptop_count INTEGER,
+    desktop_count INTEGER,
+    projector_count INTEGER,
+    printer_count INTEGER,
+    has_principal_room BOOLEAN,
+    has_library BOOLEAN,
+    has_atal_tinkering_lab BOOLEAN,
+    staff_and_store_rooms_count INTEGER,
+    refreshed_at TIMESTAMP,
+    PRIMARY KEY (udise_code, year_id)
 );
 
-CREATE INDEX idx_schools_udise_udise_code ON schools_udise_data(udise_code);
-CREATE INDEX idx_schools_udise_year_id ON schools_udise_data(year_id);
-CREATE INDEX idx_schools_udise_scrape_status ON schools_udise_data(scrape_status);
+CREATE INDEX IF NOT EXISTS idx_school_facility_facts_state ON school_facility_facts(state_name);
+CREATE INDEX IF NOT EXISTS idx_school_facility_facts_year ON school_facility_facts(year_id);
+
+-- Upserts facts for the given schools (NULL = every school; used for backfill)
+CREATE OR REPLACE FUNCTION refresh_school_facility_facts(p_udise_codes TEXT[] DEFAULT NULL) RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    -- Facts for school-years that no longer exist (e.g. year_id moved to the effective year)
+    DELETE FROM school_facility_facts f
+    WHERE p_udise_codes IS NOT NULL AND f.udise_code = ANY(p_udise_codes)
+      AND NOT EXISTS (SELECT 1 FROM schools_udise_data s WHERE s.udise_code = f.udise_code AND s.year_id = f.year_id);
+
+    INSERT INTO school_facility_facts
+    SELECT * FROM school_facility_extract e
+    WHERE p_udise_codes IS NULL OR e.udise_code = ANY(p_udise_codes)
+    ON CONFLICT (udise_code, year_id) DO UPDATE SET
+        school_name = EXCLUDED.school_name, state_name = EXCLUDED.state_name,
+        building_status = EXCLUDED.building_status, building_blocks = EXCLUDED.building_blocks,
+        boundary_wall_type = EXCLUDED.boundary_wall_type, has_playground = EXCLUDED.has_playground,
+        has_ramps = EXCLUDED.has_ramps, has_handrails = EXCLUDED.has_handrails,
+        has_solar_power = EXCLUDED.has_solar_power, has_rain_harvesting = EXCLUDED.has_rain_harvesting,
+        total_classrooms = EXCLUDED.total_classrooms, rooms_good = EXCLUDED.rooms_good,
+        rooms_minor_repair = EXCLUDED.rooms_minor_repair, rooms_major_repair = EXCLUDED.rooms_major_repair,
+        rooms_pucca_good = EXCLUDED.rooms_pucca_good, has_furniture = EXCLUDED.has_furniture,
+        has_internet = EXCLUDED.has_internet, has_ict_lab = EXCLUDED.has_ict_lab,
+        laptop_count = EXCLUDED.laptop_count, desktop_count = EXCLUDED.desktop_count,
+        projector_count = EXCLUDED.projector_count, printer_count = EXCLUDED.printer_count,
+        has_principal_room = EXCLUDED.has_principal_room, has_library = EXCLUDED.has_library,
+        has_atal_tinkering_lab = EXCLUDED.has_atal_tinkering_lab,
+        staff_and_store_rooms_count = EXCLUDED.staff_and_store_rooms_count,
+        refreshed_at = EXCLUDED.refreshed_at;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level triggers: one set-based refresh per batch write, only for changed schools
+CREATE OR REPLACE FUNCTION school_facility_facts_on_insert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_school_facility_facts(ARRAY(SELECT DISTINCT udise_code FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION school_facility_facts_on_update() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_school_facility_facts(ARRAY(
+        SELECT DISTINCT n.udise_code
+        FROM new_rows n
+        LEFT JOIN old_rows o ON o.udise_code = n.udise_code AND o.year_id = n.year_id
+        WHERE o.udise_code IS NULL
+           OR n.school_name IS DISTINCT FROM o.school_name
+           OR n.state_name IS DISTINCT FROM o.state_name
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION school_facility_facts_on_delete() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM school_facility_facts f USING old_rows o
+    WHERE f.udise_code = o.udise_code AND f.year_id = o.year_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION school_facility_facts_on_fragment() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_school_facility_facts(ARRAY(
+        SELECT DISTINCT s.udise_code
+        FROM new_rows n
+        JOIN schools_udise_data s ON s.school_id = n.school_id AND s.year_id = n.year_id
+        WHERE n.fragment = 'facility_data'
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_school_facility_facts_insert ON schools_udise_data;
+CREATE TRIGGER trg_school_facility_facts_insert
+AFTER INSERT ON schools_udise_data
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION school_facility_facts_on_insert();
+
+DROP TRIGGER IF EXISTS trg_school_facility_facts_update ON schools_udise_data;
+CREATE TRIGGER trg_school_facility_facts_update
+AFTER UPDATE ON schools_udise_data
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION school_facility_facts_on_update();
+
+DROP TRIGGER IF EXISTS trg_school_facility_facts_delete ON schools_udise_data;
+CREATE TRIGGER trg_school_facility_facts_delete
+AFTER DELETE ON schools_udise_data
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION school_facility_facts_on_delete();
+
+DROP TRIGGER IF EXISTS trg_school_facility_facts_fragment_insert ON school_fragments;
+CREATE TRIGGER trg_school_facility_facts_fragment_insert
+AFTER INSERT ON school_fragments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION school_facility_facts_on_fragment();
+
+DROP TRIGGER IF EXISTS trg_school_facility_facts_fragment_update ON school_fragments;
+CREATE TRIGGER trg_school_facility_facts_fragment_update
+AFTER UPDATE ON school_fragments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION school_facility_facts_on_fragment();
+
+-- One-time backfill on first install
+SELECT refresh_school_facility_facts() WHERE NOT EXISTS (SELECT 1 FROM school_facility_facts);
 
 -- View: Student Population (Thin/Basic Overview)
 CREATE OR REPLACE VIEW school_student_population_view AS
@@ -813,46 +1242,27 @@ WHERE state_name IS NOT NULL;
 -- View: Campus Assets & Security (Security & Physical Compound)
 CREATE OR REPLACE VIEW school_campus_assets_view AS
 SELECT udise_code, school_name, state_name,
-       facility_data->'data'->>'bldStatus' as building_status,
-       (facility_data->'data'->>'bldBlkTot')::INTEGER as building_blocks,
-       facility_data->'data'->>'bndrywallType' as boundary_wall_type,
-       (facility_data->'data'->>'playgroundYn')::INTEGER = 1 as has_playground,
-       (facility_data->'data'->>'rampsYn')::INTEGER = 1 as has_ramps,
-       (facility_data->'data'->>'handrailsYn')::INTEGER = 1 as has_handrails,
-       (facility_data->'data'->>'solarpanelYn')::INTEGER = 1 as has_solar_power,
-       (facility_data->'data'->>'rainHarvestYn')::INTEGER = 1 as has_rain_harvesting
-FROM schools_udise_data WHERE state_name IS NOT NULL;
+       building_status, building_blocks, boundary_wall_type,
+       has_playground, has_ramps, has_handrails, has_solar_power, has_rain_harvesting
+FROM school_facility_facts WHERE state_name IS NOT NULL;
 
 -- View: Classroom Quality (Granular condition mapping)
 CREATE OR REPLACE VIEW school_classroom_condition_view AS
 SELECT udise_code, school_name,
-       (facility_data->'data'->>'clsrmsInst')::INTEGER as total_classrooms,
-       (facility_data->'data'->>'clsrmsGd')::INTEGER as rooms_good,
-       (facility_data->'data'->>'clsrmsMin')::INTEGER as rooms_minor_repair,
-       (facility_data->'data'->>'clsrmsMaj')::INTEGER as rooms_major_repair,
-       (facility_data->'data'->>'clsrmsGdPpu')::INTEGER as rooms_pucca_good,
-       (facility_data->'data'->>'stusHvFurnt')::INTEGER = 1 as has_furniture
-FROM schools_udise_data WHERE state_name IS NOT NULL;
+       total_classrooms, rooms_good, rooms_minor_repair, rooms_major_repair, rooms_pucca_good, has_furniture
+FROM school_facility_facts WHERE state_name IS NOT NULL;
 
 -- View: Digital Infrastructure (The Tech Stack)
 CREATE OR REPLACE VIEW school_digital_infrastructure_view AS
 SELECT udise_code, school_name,
-       (facility_data->'data'->>'internetYn')::INTEGER = 1 as has_internet,
-       (facility_data->'data'->>'ictLabYn')::INTEGER = 1 as has_ict_lab,
-       (facility_data->'data'->>'laptopTot')::INTEGER as laptop_count,
-       (facility_data->'data'->>'desktopFun')::INTEGER as desktop_count,
-       (facility_data->'data'->>'projectorTot')::INTEGER as projector_count,
-       (facility_data->'data'->>'printerTot')::INTEGER as printer_count
-FROM schools_udise_data WHERE state_name IS NOT NULL;
+       has_internet, has_ict_lab, laptop_count, desktop_count, projector_count, printer_count
+FROM school_facility_facts WHERE state_name IS NOT NULL;
 
 -- View: Specialized Support Spaces (Staff & Resource rooms)
 CREATE OR REPLACE VIEW school_specialized_spaces_view AS
 SELECT udise_code, school_name,
-       (facility_data->'data'->>'hmRoomYn')::INTEGER = 1 as has_principal_room,
-       (facility_data->'data'->>'libraryYn')::INTEGER = 1 as has_library,
-       (facility_data->'data'->>'tinkeringLabYn')::INTEGER = 1 as has_atal_tinkering_lab,
-       (facility_data->'data'->>'othrooms')::INTEGER as staff_and_store_rooms_count
-FROM schools_udise_data WHERE state_name IS NOT NULL;
+       has_principal_room, has_library, has_atal_tinkering_lab, staff_and_store_rooms_count
+FROM school_facility_facts WHERE state_name IS NOT NULL;
 
 -- Mark Legacy Tables
 COMMENT ON TABLE schools IS 'DEPRECATED: SSOT IS schools_udise_data. DO NOT JOIN.';
@@ -862,30 +1272,16 @@ COMMENT ON TABLE districts IS 'DEPRECATED: SSOT IS schools_udise_data. DO NOT JO
 COMMENT ON TABLE states IS 'DEPRECATED: SSOT IS schools_udise_data. DO NOT JOIN.';
 
 -- View: Village Discovery (LGD Master + Demographics)
--- Used by LGDDatabaseProvider for village search and lookup.
--- Source of truth for geography is lgd_master (LGD CSV 9307).
--- Population data is enriched from village_demographics (JJM scraper).
-CREATE OR REPLACE VIEW village_discovery_view AS
-SELECT DISTINCT ON (lm.village_code)
-    lm.village_code AS lgd_code,
-    lm.village_name AS village,
-    lm.subdistrict_name AS taluk,
-    lm.district_name AS district,
-    lm.state_name AS state,
-    lm.pincode,
-    vd.total_population AS population,
-    vd.households
-FROM lgd_master lm
-LEFT JOIN village_demographics vd ON lm.village_code = vd.lgd_code
-ORDER BY lm.village_code, vd.total_population DESC NULLS LAST;
+-- Served from the village_search table; see section 11.
 
 -- ==========================================
 -- 5. AUDIT & ACTIVITY LOGS
 -- ==========================================
 
 -- Universal Proposal Activity Log (Forensic Snapshot Model)
+-- Partitioned by month (existing single-heap installs: scripts/partition_activity_logs.sql)
 CREATE TABLE IF NOT EXISTS proposal_activity_logs (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     proposal_id UUID,          -- Reference only (no FK/Cascade to preserve history)
     event_type VARCHAR(50),    -- 'EXPORTED', 'CREATED', 'EDITED', etc.
     actor_id INTEGER REFERENCES users(id), -- Reference to users.id
@@ -896,11 +1292,27 @@ CREATE TABLE IF NOT EXISTS proposal_activity_logs (
     proposal_snapshot JSONB,   -- { "title": "...", "domain": "...", "ngo": "..." }
     actor_snapshot JSONB,      -- { "userid": "ravi", "name": "Ravi Murthy", "role": "ADMIN" }
     
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
-CREATE INDEX IF NOT EXISTS idx_proposal_activity_proposal_id ON proposal_activity_logs(proposal_id);
+CREATE TABLE IF NOT EXISTS proposal_activity_logs_default PARTITION OF proposal_activity_logs DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_proposal_activity_proposal_id ON proposal_activity_logs(proposal_id, created_at);
 CREATE INDEX IF NOT EXISTS idx_proposal_activity_event_type ON proposal_activity_logs(event_type);
+-- Rows arrive in time order, so a BRIN range map is tiny and prunes time-range audit scans
+CREATE INDEX IF NOT EXISTS idx_proposal_activity_created_brin ON proposal_activity_logs USING BRIN (created_at);
+
+-- Monthly upkeep (see maintain_monthly_partitions), e.g. from cron:
+--   SELECT maintain_activity_log_partitions(3, 24);
+CREATE OR REPLACE FUNCTION maintain_activity_log_partitions(
+    p_months_ahead INTEGER DEFAULT 3,
+    p_retain_months INTEGER DEFAULT NULL
+) RETURNS TEXT[] AS $$
+    SELECT maintain_monthly_partitions('proposal_activity_logs', p_months_ahead, p_retain_months);
+$$ LANGUAGE sql;
+
+SELECT maintain_activity_log_partitions();
 
 -- ==========================================
 -- 6. SEED DATA & TRIGGERS
@@ -1020,22 +1432,24 @@ ON CONFLICT (id) DO NOTHING;
 -- 7. VILLAGE AMENITIES VIEWS (2026-03-19)
 -- ==========================================
 
-CREATE OR REPLACE VIEW village_amenities_view AS
+-- Reads the typed table; columns became numeric, so the old TEXT view must be dropped first
+DROP VIEW IF EXISTS village_amenities_view;
+CREATE VIEW village_amenities_view AS
 SELECT 
     state,
     district,
     sub_district,
-    ulb_rlb_village AS village,
-    (state || '-' || district || '-' || sub_district || '-' || ulb_rlb_village) AS composite_key,
-    total_geographical_area_covered_by_village AS area_ha,
-    number_of_village_households AS households,
-    name_of_the_nearest_statutory_town AS nearest_town_name,
-    distance_between_village_and_nearest_statutory_town AS distance_to_nearest_town_km,
-    name_of_the_district_head_quarter_of_village AS district_hq_name,
-    distance_between_the_village_and_district_head_quarter AS distance_to_district_hq_km,
-    name_of_the_subdistrict_head_quarter_of_village AS taluk_hq_name,
-    distance_between_village_and_sub_district_head_quarter AS distance_to_taluk_hq_km
-FROM village_amenities_raw;
+    village,
+    composite_key,
+    area_ha,
+    households,
+    nearest_town_name,
+    distance_to_nearest_town_km,
+    district_hq_name,
+    distance_to_district_hq_km,
+    taluk_hq_name,
+    distance_to_taluk_hq_km
+FROM village_amenities;
 
 -- ==========================================
 -- 8. PROPOSAL WORKFLOW RUN TRACKING
@@ -1061,3 +1475,1558 @@ CREATE TABLE IF NOT EXISTS proposal_workflow_runs (
     initiated_by INTEGER REFERENCES users(id),
     section_execution_state JSONB NOT NULL DEFAULT '{}'::jsonb
 );
+
+-- ==========================================
+-- 9. ENRICHMENT WORK QUEUE
+-- ==========================================
+
+-- Leased job queue drained by enrich_registry.py --worker (FOR UPDATE SKIP LOCKED)
+CREATE TABLE IF NOT EXISTS enrichment_queue (
+    school_id INTEGER PRIMARY KEY,
+    udise_code VARCHAR(20) NOT NULL,
+    state_name VARCHAR,
+    priority INTEGER NOT NULL DEFAULT 100, -- Higher runs first
+    status VARCHAR(20) NOT NULL DEFAULT 'queued', -- queued, leased, done, failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    lease_owner TEXT, -- host:pid of the claiming worker
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
+    last_error TEXT,
+    enqueued_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_enrichment_queue_claim ON enrichment_queue (priority DESC, enqueued_at, school_id) WHERE status IN ('queued', 'leased');
+CREATE INDEX IF NOT EXISTS idx_enrichment_queue_owner ON enrichment_queue (lease_owner) WHERE status = 'leased';
+
+-- Discovery Checkpoints (discover_registry.py resume / freshness skip)
+-- A district/block/cluster is recorded once its whole subtree was scanned.
+CREATE TABLE IF NOT EXISTS discovery_checkpoints (
+    state_id INTEGER NOT NULL,
+    node_level VARCHAR(10) NOT NULL, -- district, block, cluster
+    node_id INTEGER NOT NULL,
+    parent_id INTEGER,
+    school_count INTEGER,
+    completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (node_level, node_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_discovery_checkpoints_state ON discovery_checkpoints(state_id, completed_at);
+
+-- ==========================================
+-- 10. LGD INCREMENTAL SYNC (Change Detection)
+-- ==========================================
+
+-- Fingerprint of the source record; unchanged villages are never rewritten
+ALTER TABLE lgd_master ADD COLUMN IF NOT EXISTS record_hash TEXT;
+-- Set when a complete incremental run no longer sees the village
+ALTER TABLE lgd_master ADD COLUMN IF NOT EXISTS removed_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_lgd_master_district_code ON lgd_master(district_code);
+
+-- One row per incremental sync pass (fetch_lgd_master.py --incremental)
+CREATE TABLE IF NOT EXISTS lgd_sync_runs (
+    id SERIAL PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'running', -- running, completed
+    inserted_count INTEGER DEFAULT 0,
+    updated_count INTEGER DEFAULT 0,
+    removed_count INTEGER DEFAULT 0,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP
+);
+
+-- Village codes seen by a running pass (removal detection); cleared when the run completes
+CREATE TABLE IF NOT EXISTS lgd_sync_seen (
+    run_id INTEGER NOT NULL REFERENCES lgd_sync_runs(id) ON DELETE CASCADE,
+    village_code VARCHAR(50) NOT NULL,
+    PRIMARY KEY (run_id, village_code)
+);
+
+-- Change Log: what each run inserted, changed or removed (drives per-district downstream refreshes)
+CREATE TABLE IF NOT EXISTS lgd_master_changes (
+    id BIGSERIAL PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES lgd_sync_runs(id) ON DELETE CASCADE,
+    village_code VARCHAR(50) NOT NULL,
+    district_code TEXT,
+    state_code TEXT,
+    change_type VARCHAR(10) NOT NULL, -- inserted, updated, removed
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_lgd_master_changes_run ON lgd_master_changes(run_id, district_code);
+CREATE INDEX IF NOT EXISTS idx_lgd_master_changes_changed_at ON lgd_master_changes(changed_at);
+
+-- ==========================================
+-- 11. VILLAGE SEARCH (Materialized Discovery)
+-- ==========================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Canonical form for place-name matching: lower-case, punctuation -> space, single spaces
+CREATE OR REPLACE FUNCTION normalize_place_name(val TEXT) RETURNS TEXT AS $$
+    SELECT NULLIF(trim(regexp_replace(lower(val), '[^a-z0-9]+', ' ', 'g')), '');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- One row per active LGD village with its demographics; kept in sync by the triggers below
+CREATE TABLE IF NOT EXISTS village_search (
+    lgd_code VARCHAR(50) PRIMARY KEY,
+    village TEXT,
+    taluk TEXT,
+    district TEXT,
+    state TEXT,
+    pincode TEXT,
+    population INTEGER,
+    households INTEGER,
+    village_norm TEXT,
+    taluk_norm TEXT,
+    district_norm TEXT,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_village_search_village_trgm ON village_search USING GIN (village_norm gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_village_search_taluk_trgm ON village_search USING GIN (taluk_norm gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_village_search_district_trgm ON village_search USING GIN (district_norm gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_village_search_village_prefix ON village_search (village_norm text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_village_search_pincode ON village_search (pincode);
+CREATE INDEX IF NOT EXISTS idx_village_search_state_district ON village_search (state, district);
+
+-- Re-derives search rows for the given villages (NULL = all); unchanged rows are not rewritten
+CREATE OR REPLACE FUNCTION refresh_village_search(p_codes TEXT[] DEFAULT NULL) RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    DELETE FROM village_search vs
+    WHERE (p_codes IS NULL OR vs.lgd_code = ANY(p_codes))
+      AND NOT EXISTS (
+          SELECT 1 FROM lgd_master lm
+          WHERE lm.village_code = vs.lgd_code AND lm.removed_at IS NULL
+      );
+
+    INSERT INTO village_search (lgd_code, village, taluk, district, state, pincode, population, households,
+                                village_norm, taluk_norm, district_norm)
+    SELECT lm.village_code, lm.village_name, lm.subdistrict_name, lm.district_name, lm.state_name, lm.pincode,
+           vd.total_population, vd.households,
+           normalize_place_name(lm.village_name), normalize_place_name(lm.subdistrict_name),
+           normalize_place_name(lm.district_name)
+    FROM lgd_master lm
+    LEFT JOIN village_demographics vd ON vd.lgd_code = lm.village_code
+    WHERE lm.removed_at IS NULL
+      AND (p_codes IS NULL OR lm.village_code = ANY(p_codes))
+    ON CONFLICT (lgd_code) DO UPDATE SET
+        village = EXCLUDED.village, taluk = EXCLUDED.taluk, district = EXCLUDED.district,
+        state = EXCLUDED.state, pincode = EXCLUDED.pincode,
+        population = EXCLUDED.population, households = EXCLUDED.households,
+        village_norm = EXCLUDED.village_norm, taluk_norm = EXCLUDED.taluk_norm,
+        district_norm = EXCLUDED.district_norm, refreshed_at = CURRENT_TIMESTAMP
+    WHERE (village_search.village, village_search.taluk, village_search.district, village_search.state,
+           village_search.pincode, village_search.population, village_search.households)
+          IS DISTINCT FROM
+          (EXCLUDED.village, EXCLUDED.taluk, EXCLUDED.district, EXCLUDED.state,
+           EXCLUDED.pincode, EXCLUDED.population, EXCLUDED.households);
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level triggers: each LGD page merge / demographics batch refreshes only its villages
+CREATE OR REPLACE FUNCTION village_search_on_lgd_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM refresh_village_search(ARRAY(SELECT village_code FROM old_rows));
+    ELSE
+        PERFORM refresh_village_search(ARRAY(SELECT village_code FROM new_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION village_search_on_demographics_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM refresh_village_search(ARRAY(SELECT lgd_code FROM old_rows WHERE lgd_code IS NOT NULL));
+    ELSE
+        PERFORM refresh_village_search(ARRAY(SELECT lgd_code FROM new_rows WHERE lgd_code IS NOT NULL));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_village_search_lgd_insert ON lgd_master;
+CREATE TRIGGER trg_village_search_lgd_insert AFTER INSERT ON lgd_master
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_search_on_lgd_change();
+DROP TRIGGER IF EXISTS trg_village_search_lgd_update ON lgd_master;
+CREATE TRIGGER trg_village_search_lgd_update AFTER UPDATE ON lgd_master
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_search_on_lgd_change();
+DROP TRIGGER IF EXISTS trg_village_search_lgd_delete ON lgd_master;
+CREATE TRIGGER trg_village_search_lgd_delete AFTER DELETE ON lgd_master
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION village_search_on_lgd_change();
+
+DROP TRIGGER IF EXISTS trg_village_search_demographics_insert ON village_demographics;
+CREATE TRIGGER trg_village_search_demographics_insert AFTER INSERT ON village_demographics
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_search_on_demographics_change();
+DROP TRIGGER IF EXISTS trg_village_search_demographics_update ON village_demographics;
+CREATE TRIGGER trg_village_search_demographics_update AFTER UPDATE ON village_demographics
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_search_on_demographics_change();
+DROP TRIGGER IF EXISTS trg_village_search_demographics_delete ON village_demographics;
+CREATE TRIGGER trg_village_search_demographics_delete AFTER DELETE ON village_demographics
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION village_search_on_demographics_change();
+
+-- One-time backfill on first install
+SELECT refresh_village_search() WHERE NOT EXISTS (SELECT 1 FROM village_search);
+
+-- View: Village Discovery (LGD Master + Demographics)
+-- Used by LGDDatabaseProvider for village search and lookup.
+-- Source of truth for geography is lgd_master (LGD CSV 9307).
+-- Population data is enriched from village_demographics (JJM scraper).
+CREATE OR REPLACE VIEW village_discovery_view AS
+SELECT lgd_code, village, taluk, district, state, pincode, population, households
+FROM village_search;
+
+-- Ranked type-ahead search: exact > prefix > fuzzy village name, then taluk/district matches;
+-- ties go to the larger village. Optional state/district filters narrow the candidate set.
+CREATE OR REPLACE FUNCTION search_villages(
+    p_query TEXT,
+    p_state TEXT DEFAULT NULL,
+    p_district TEXT DEFAULT NULL,
+    p_limit INTEGER DEFAULT 20
+) RETURNS TABLE (
+    lgd_code VARCHAR(50), village TEXT, taluk TEXT, district TEXT, state TEXT,
+    pincode TEXT, population INTEGER, households INTEGER, score REAL
+) AS $$
+    SELECT vs.lgd_code, vs.village, vs.taluk, vs.district, vs.state,
+           vs.pincode, vs.population, vs.households,
+           (CASE
+                WHEN vs.village_norm = normalize_place_name(p_query) THEN 1.0
+                WHEN vs.village_norm LIKE normalize_place_name(p_query) || '%' THEN 0.9
+                ELSE GREATEST(similarity(vs.village_norm, normalize_place_name(p_query)) * 0.8,
+                              similarity(vs.taluk_norm, normalize_place_name(p_query)) * 0.5,
+                              similarity(vs.district_norm, normalize_place_name(p_query)) * 0.4)
+            END)::REAL AS score
+    FROM village_search vs
+    WHERE normalize_place_name(p_query) IS NOT NULL
+      AND (vs.village_norm LIKE normalize_place_name(p_query) || '%'
+           OR vs.village_norm % normalize_place_name(p_query)
+           OR vs.taluk_norm % normalize_place_name(p_query)
+           OR vs.district_norm % normalize_place_name(p_query))
+      AND (p_state IS NULL OR vs.state = p_state)
+      AND (p_district IS NULL OR vs.district = p_district)
+    ORDER BY score DESC, vs.population DESC NULLS LAST, vs.village
+    LIMIT p_limit;
+$$ LANGUAGE sql STABLE;
+
+-- ==========================================
+-- 12. LGD CROSSWALK (Source Keys -> LGD Codes)
+-- ==========================================
+
+-- Maps each source's own key to the LGD village/district code once, so joins become index lookups.
+-- source_key formats:
+--   udise_school          udise_code:year_id
+--   village_amenities     composite_key (state-district-sub_district-village)
+--   village_pincode       pincode|state|district|village
+--   district_demographics state|district
+CREATE TABLE IF NOT EXISTS lgd_crosswalk (
+    source VARCHAR(30) NOT NULL,
+    source_key TEXT NOT NULL,
+    source_ref TEXT, -- LGD village code supplied by the source itself (schools), if any
+    village_code VARCHAR(50),
+    district_code TEXT,
+    state_code TEXT,
+    match_method VARCHAR(20) NOT NULL, -- code, name, name_loose, name_pincode, district, ambiguous, unmatched
+    matched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source, source_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_lgd_crosswalk_village ON lgd_crosswalk(village_code);
+CREATE INDEX IF NOT EXISTS idx_lgd_crosswalk_district ON lgd_crosswalk(district_code);
+CREATE INDEX IF NOT EXISTS idx_lgd_crosswalk_method ON lgd_crosswalk(source, match_method);
+
+-- Normalized-name lookup path into lgd_master (state, district, village[, sub-district])
+CREATE INDEX IF NOT EXISTS idx_lgd_master_norm_names ON lgd_master (
+    normalize_place_name(state_name), normalize_place_name(district_name),
+    normalize_place_name(village_name), normalize_place_name(subdistrict_name)
+);
+
+-- Source rows that could not be pinned to a single LGD village (or district, for district-level sources)
+CREATE OR REPLACE VIEW lgd_crosswalk_unmatched AS
+SELECT source, source_key, source_ref, district_code, match_method, matched_at
+FROM lgd_crosswalk
+WHERE match_method IN ('unmatched', 'ambiguous', 'district');
+
+-- Resolves new, changed and previously unmatched source rows (p_full re-resolves everything).
+-- Run after each source reload; p_source NULL covers every source (e.g. after an LGD sync).
+CREATE OR REPLACE FUNCTION refresh_lgd_crosswalk(p_source TEXT DEFAULT NULL, p_full BOOLEAN DEFAULT FALSE) RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    -- Matches to villages LGD no longer lists must be re-resolved
+    UPDATE lgd_crosswalk cw SET village_code = NULL, match_method = 'unmatched'
+    WHERE cw.village_code IS NOT NULL
+      AND (p_source IS NULL OR cw.source = p_source)
+      AND NOT EXISTS (SELECT 1 FROM lgd_master lm WHERE lm.village_code = cw.village_code AND lm.removed_at IS NULL);
+
+    DROP TABLE IF EXISTS crosswalk_pending;
+    CREATE TEMP TABLE crosswalk_pending (
+        source VARCHAR(30),
+        source_key TEXT,
+        source_ref TEXT,
+        district_ref TEXT,
+        pincode TEXT,
+        st TEXT, d TEXT, sd TEXT, v TEXT,
+        village_level BOOLEAN,
+        village_code VARCHAR(50),
+        district_code TEXT,
+        state_code TEXT,
+        match_method VARCHAR(20)
+    ) ON COMMIT DROP;
+
+    IF p_source IS NULL OR p_source = 'udise_school' THEN
+        DELETE FROM lgd_crosswalk cw WHERE cw.source = 'udise_school'
+          AND NOT EXISTS (SELECT 1 FROM schools_udise_data s WHERE s.udise_code || ':' || s.year_id = cw.source_key);
+        INSERT INTO crosswalk_pending (source, source_key, source_ref, district_ref, pincode, st, d, sd, v, village_level)
+        SELECT 'udise_school', s.udise_code || ':' || s.year_id, s.lgd_village_id, s.lgd_district_id::TEXT, s.pincode::TEXT,
+               normalize_place_name(s.state_name), normalize_place_name(s.district_name), NULL,
+               normalize_place_name(COALESCE(s.lgd_vill_name, s.village_name)), TRUE
+        FROM schools_udise_data s
+        LEFT JOIN lgd_crosswalk cw ON cw.source = 'udise_school' AND cw.source_key = s.udise_code || ':' || s.year_id
+        WHERE p_full OR cw.source_key IS NULL
+           OR cw.match_method IN ('unmatched', 'ambiguous', 'district')
+           OR cw.source_ref IS DISTINCT FROM s.lgd_village_id;
+    END IF;
+
+    IF p_source IS NULL OR p_source = 'village_amenities' THEN
+        DELETE FROM lgd_crosswalk cw WHERE cw.source = 'village_amenities'
+          AND NOT EXISTS (SELECT 1 FROM village_amenities va WHERE va.composite_key = cw.source_key);
+        INSERT INTO crosswalk_pending (source, source_key, st, d, sd, v, village_level)
+        SELECT DISTINCT ON (va.composite_key) 'village_amenities', va.composite_key,
+               normalize_place_name(va.state), normalize_place_name(va.district),
+               normalize_place_name(va.sub_district), normalize_place_name(va.village), TRUE
+        FROM village_amenities va
+        LEFT JOIN lgd_crosswalk cw ON cw.source = 'village_amenities' AND cw.source_key = va.composite_key
+        WHERE p_full OR cw.source_key IS NULL OR cw.match_method IN ('unmatched', 'ambiguous', 'district');
+    END IF;
+
+    IF p_source IS NULL OR p_source = 'village_pincode' THEN
+        DELETE FROM lgd_crosswalk cw WHERE cw.source = 'village_pincode'
+          AND NOT EXISTS (SELECT 1 FROM village_pincode_mapping m
+                          WHERE m.pincode || '|' || m.state_name || '|' || m.district_name || '|' || m.village_name = cw.source_key);
+        INSERT INTO crosswalk_pending (source, source_key, pincode, st, d, sd, v, village_level)
+        SELECT 'village_pincode', m.pincode || '|' || m.state_name || '|' || m.district_name || '|' || m.village_name,
+               m.pincode, normalize_place_name(m.state_name), normalize_place_name(m.district_name), NULL,
+               normalize_place_name(m.village_name), TRUE
+        FROM village_pincode_mapping m
+        LEFT JOIN lgd_crosswalk cw ON cw.source = 'village_pincode'
+             AND cw.source_key = m.pincode || '|' || m.state_name || '|' || m.district_name || '|' || m.village_name
+        WHERE p_full OR cw.source_key IS NULL OR cw.match_method IN ('unmatched', 'ambiguous', 'district');
+    END IF;
+
+    IF p_source IS NULL OR p_source = 'district_demographics' THEN
+        DELETE FROM lgd_crosswalk cw WHERE cw.source = 'district_demographics'
+          AND NOT EXISTS (SELECT 1 FROM district_demographics dd WHERE dd.state_name || '|' || dd.district_name = cw.source_key);
+        INSERT INTO crosswalk_pending (source, source_key, st, d, village_level)
+        SELECT DISTINCT 'district_demographics', dd.state_name || '|' || dd.district_name,
+               normalize_place_name(dd.state_name), normalize_place_name(dd.district_name), FALSE
+        FROM district_demographics dd
+        LEFT JOIN lgd_crosswalk cw ON cw.source = 'district_demographics' AND cw.source_key = dd.state_name || '|' || dd.district_name
+        WHERE p_full OR cw.source_key IS NULL OR cw.match_method = 'unmatched';
+    END IF;
+
+    -- 1. Source-supplied LGD village code
+    UPDATE crosswalk_pending p
+    SET village_code = lm.village_code, district_code = lm.district_code, state_code = lm.state_code, match_method = 'code'
+    FROM lgd_master lm
+    WHERE p.source_ref IS NOT NULL AND lm.village_code = p.source_ref AND lm.removed_at IS NULL;
+
+    -- 2. Full name path (state, district, sub-district, village), only when unique
+    UPDATE crosswalk_pending p
+    SET village_code = m.village_code, district_code = m.district_code, state_code = m.state_code, match_method = 'name'
+    FROM (
+        SELECT p2.source, p2.source_key, MIN(lm.village_code) AS village_code,
+               MIN(lm.district_code) AS district_code, MIN(lm.state_code) AS state_code, COUNT(*) AS n
+        FROM crosswalk_pending p2
+        JOIN lgd_master lm
+          ON normalize_place_name(lm.state_name) = p2.st AND normalize_place_name(lm.district_name) = p2.d
+         AND normalize_place_name(lm.village_name) = p2.v AND normalize_place_name(lm.subdistrict_name) = p2.sd
+         AND lm.removed_at IS NULL
+        WHERE p2.match_method IS NULL AND p2.village_level AND p2.sd IS NOT NULL
+        GROUP BY p2.source, p2.source_key
+    ) m
+    WHERE p.source = m.source AND p.source_key = m.source_key AND m.n = 1;
+
+    -- 3. (state, district, village), with pincode as the tie-breaker
+    UPDATE crosswalk_pending p
+    SET village_code = CASE WHEN m.n = 1 THEN m.village_code WHEN m.n_pin = 1 THEN m.pin_village_code END,
+        district_code = CASE WHEN m.n = 1 THEN m.district_code WHEN m.n_pin = 1 THEN m.pin_district_code END,
+        state_code = CASE WHEN m.n = 1 OR m.n_pin = 1 THEN m.state_code END,
+        match_method = CASE WHEN m.n = 1 THEN 'name_loose' WHEN m.n_pin = 1 THEN 'name_pincode' ELSE 'ambiguous' END
+    FROM (
+        SELECT p2.source, p2.source_key, COUNT(*) AS n,
+               COUNT(*) FILTER (WHERE lm.pincode = p2.pincode) AS n_pin,
+               MIN(lm.village_code) AS village_code, MIN(lm.district_code) AS district_code,
+               MIN(lm.village_code) FILTER (WHERE lm.pincode = p2.pincode) AS pin_village_code,
+               MIN(lm.district_code) FILTER (WHERE lm.pincode = p2.pincode) AS pin_district_code,
+               MIN(lm.state_code) AS state_code
+        FROM crosswalk_pending p2
+        JOIN lgd_master lm
+          ON normalize_place_name(lm.state_name) = p2.st AND normalize_place_name(lm.district_name) = p2.d
+         AND normalize_place_name(lm.village_name) = p2.v AND lm.removed_at IS NULL
+        WHERE p2.match_method IS NULL AND p2.village_level
+        GROUP BY p2.source, p2.source_key
+    ) m
+    WHERE p.source = m.source AND p.source_key = m.source_key;
+
+    -- 4. District only: source-supplied district code, else unique (state, district) name
+    UPDATE crosswalk_pending p
+    SET district_code = dc.district_code, state_code = dc.state_code,
+        match_method = COALESCE(p.match_method, CASE WHEN p.village_level THEN 'district' ELSE 'code' END)
+    FROM (
+        -- One row per district, so each pending row is updated once
+        SELECT DISTINCT ON (district_code) district_code, state_code
+        FROM lgd_master
+        WHERE removed_at IS NULL AND district_code IS NOT NULL
+        ORDER BY district_code, state_code
+    ) dc
+    WHERE p.village_code IS NULL AND p.district_ref IS NOT NULL
+      AND dc.district_code = p.district_ref;
+
+    UPDATE crosswalk_pending p
+    SET district_code = dn.district_code, state_code = dn.state_code,
+        match_method = COALESCE(p.match_method, CASE WHEN p.village_level THEN 'district' ELSE 'name' END)
+    FROM (
+        SELECT normalize_place_name(state_name) AS st, normalize_place_name(district_name) AS d,
+               MIN(district_code) AS district_code, MIN(state_code) AS state_code
+        FROM lgd_master
+        WHERE removed_at IS NULL
+        GROUP BY 1, 2
+        HAVING COUNT(DISTINCT district_code) = 1
+    ) dn
+    WHERE p.village_code IS NULL AND p.district_code IS NULL AND dn.st = p.st AND dn.d = p.d;
+
+    INSERT INTO lgd_crosswalk (source, source_key, source_ref, village_code, district_code, state_code, match_method, matched_at)
+    SELECT source, source_key, source_ref, village_code, district_code, state_code,
+           COALESCE(match_method, 'unmatched'), CURRENT_TIMESTAMP
+    FROM crosswalk_pending
+    ON CONFLICT (source, source_key) DO UPDATE SET
+        source_ref = EXCLUDED.source_ref,
+        village_code = EXCLUDED.village_code,
+        district_code = EXCLUDED.district_code,
+        state_code = EXCLUDED.state_code,
+        match_method = EXCLUDED.match_method,
+        matched_at = EXCLUDED.matched_at;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+
+    DROP TABLE crosswalk_pending;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==========================================
+-- 13. SECTION EXECUTION STATE (Normalized)
+-- ==========================================
+
+-- One row per (workflow run, section). Section workers update only their own row, so parallel
+-- generation never contends on proposal_workflow_runs; section_execution_state is a derived snapshot.
+CREATE TABLE IF NOT EXISTS proposal_section_executions (
+    run_id UUID NOT NULL REFERENCES proposal_workflow_runs(id) ON DELETE CASCADE,
+    section_code VARCHAR(100) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, running, completed, failed, skipped
+    depends_on VARCHAR(100)[] NOT NULL DEFAULT '{}', -- Upstream sections (blueprint dependencies + math_dependencies)
+    attempts INTEGER NOT NULL DEFAULT 0,
+    section_id BIGINT REFERENCES proposal_sections(id) ON DELETE SET NULL, -- Version produced by this run
+    input_tokens INTEGER DEFAULT 0,
+    output_tokens INTEGER DEFAULT 0,
+    total_tokens INTEGER DEFAULT 0,
+    error_message TEXT,
+    lease_token UUID, -- Issued by claim_section_execution; only its holder can finish the row
+    lease_expires_at TIMESTAMP WITH TIME ZONE, -- A running row past this is reclaimable (crashed worker)
+    started_at TIMESTAMP WITH TIME ZONE,
+    completed_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (run_id, section_code)
+);
+
+-- "What's runnable now" only ever scans a run's pending rows; lease sweeps scan in-flight ones
+CREATE INDEX IF NOT EXISTS idx_section_executions_pending ON proposal_section_executions(run_id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_section_executions_lease ON proposal_section_executions(lease_expires_at) WHERE status = 'running';
+
+DROP TRIGGER IF EXISTS update_section_executions_updated_at ON proposal_section_executions;
+CREATE TRIGGER update_section_executions_updated_at
+    BEFORE UPDATE ON proposal_section_executions
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Pending sections whose upstream sections have all completed (or were skipped)
+CREATE OR REPLACE VIEW runnable_section_executions AS
+SELECT e.*
+FROM proposal_section_executions e
+WHERE e.status = 'pending'
+  AND NOT EXISTS (
+      SELECT 1 FROM proposal_section_executions d
+      WHERE d.run_id = e.run_id
+        AND d.section_code = ANY(e.depends_on)
+        AND d.status NOT IN ('completed', 'skipped')
+  );
+
+-- Live progress per run (cheap aggregate over at most one row per blueprint section)
+CREATE OR REPLACE VIEW workflow_run_progress AS
+SELECT run_id,
+       COUNT(*) AS sections,
+       COUNT(*) FILTER (WHERE status = 'completed') AS completed,
+       COUNT(*) FILTER (WHERE status = 'running') AS running,
+       COUNT(*) FILTER (WHERE status = 'failed') AS failed,
+       COUNT(*) FILTER (WHERE status = 'pending') AS pending,
+       SUM(total_tokens) AS total_tokens,
+       MIN(started_at) AS first_started_at,
+       MAX(completed_at) AS last_completed_at
+FROM proposal_section_executions
+GROUP BY run_id;
+
+-- Section rows come from the run's pinned topology, so dependencies match the plan the run started with
+CREATE OR REPLACE FUNCTION init_section_executions(p_run_id UUID) RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    INSERT INTO proposal_section_executions (run_id, section_code, depends_on)
+    SELECT r.id, d.key, ARRAY(SELECT jsonb_array_elements_text(d.value))
+    FROM proposal_workflow_runs r
+    JOIN blueprint_topology bt ON bt.id = r.topology_id
+    CROSS JOIN LATERAL jsonb_each(bt.topology_data->'dependencies') d
+    WHERE r.id = p_run_id
+    ON CONFLICT (run_id, section_code) DO NOTHING;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Atomically moves a runnable (or failed, for retries) section to running under a lease, like
+-- enrichment_queue: a running row whose lease expired (crashed worker) can be claimed again.
+-- Returns the lease token finish_section_execution requires; NULL if another worker holds a live
+-- lease or an upstream section has not completed (same test as runnable_section_executions).
+DROP FUNCTION IF EXISTS claim_section_execution(UUID, VARCHAR);
+CREATE OR REPLACE FUNCTION claim_section_execution(
+    p_run_id UUID,
+    p_section_code VARCHAR,
+    p_lease_minutes INTEGER DEFAULT 15
+) RETURNS UUID AS $$
+DECLARE
+    v_token UUID := gen_random_uuid();
+BEGIN
+    UPDATE proposal_section_executions e
+    SET status = 'running', attempts = attempts + 1, started_at = CURRENT_TIMESTAMP,
+        completed_at = NULL, error_message = NULL,
+        lease_token = v_token, lease_expires_at = CURRENT_TIMESTAMP + make_interval(mins => p_lease_minutes)
+    WHERE e.run_id = p_run_id AND e.section_code = p_section_code
+      AND (e.status IN ('pending', 'failed') OR (e.status = 'running' AND e.lease_expires_at < CURRENT_TIMESTAMP))
+      AND NOT EXISTS (
+          SELECT 1 FROM proposal_section_executions d
+          WHERE d.run_id = e.run_id
+            AND d.section_code = ANY(e.depends_on)
+            AND d.status NOT IN ('completed', 'skipped')
+      );
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    RETURN v_token;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Heartbeat for long generations; FALSE if the lease was lost (expired and reclaimed, or finished)
+CREATE OR REPLACE FUNCTION extend_section_lease(
+    p_run_id UUID,
+    p_section_code VARCHAR,
+    p_lease_token UUID,
+    p_lease_minutes INTEGER DEFAULT 15
+) RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE proposal_section_executions
+    SET lease_expires_at = CURRENT_TIMESTAMP + make_interval(mins => p_lease_minutes)
+    WHERE run_id = p_run_id AND section_code = p_section_code AND status = 'running' AND lease_token = p_lease_token;
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Returns running rows with expired leases to pending so they show up as runnable again
+-- (p_run_id NULL sweeps every run)
+CREATE OR REPLACE FUNCTION release_expired_section_leases(p_run_id UUID DEFAULT NULL) RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    UPDATE proposal_section_executions
+    SET status = 'pending', lease_token = NULL, lease_expires_at = NULL, started_at = NULL,
+        error_message = 'lease expired'
+    WHERE status = 'running' AND lease_expires_at < CURRENT_TIMESTAMP
+      AND (p_run_id IS NULL OR run_id = p_run_id);
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Records the outcome of a claimed (running) section; FALSE if p_lease_token no longer holds it
+DROP FUNCTION IF EXISTS finish_section_execution(UUID, VARCHAR, VARCHAR, BIGINT, INTEGER, INTEGER, TEXT);
+CREATE OR REPLACE FUNCTION finish_section_execution(
+    p_run_id UUID,
+    p_section_code VARCHAR,
+    p_lease_token UUID,
+    p_status VARCHAR, -- completed, failed, skipped
+    p_section_id BIGINT DEFAULT NULL,
+    p_input_tokens INTEGER DEFAULT 0,
+    p_output_tokens INTEGER DEFAULT 0,
+    p_error TEXT DEFAULT NULL
+) RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE proposal_section_executions
+    SET status = p_status,
+        section_id = COALESCE(p_section_id, section_id),
+        input_tokens = input_tokens + COALESCE(p_input_tokens, 0),
+        output_tokens = output_tokens + COALESCE(p_output_tokens, 0),
+        total_tokens = total_tokens + COALESCE(p_input_tokens, 0) + COALESCE(p_output_tokens, 0),
+        error_message = p_error,
+        lease_token = NULL,
+        lease_expires_at = NULL,
+        completed_at = CURRENT_TIMESTAMP
+    WHERE run_id = p_run_id AND section_code = p_section_code AND status = 'running' AND lease_token = p_lease_token;
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rebuilds the derived section_execution_state snapshot (call when a run finishes, or on demand)
+CREATE OR REPLACE FUNCTION snapshot_section_execution_state(p_run_id UUID) RETURNS JSONB AS $$
+DECLARE
+    v_state JSONB;
+BEGIN
+    SELECT COALESCE(jsonb_object_agg(section_code, jsonb_build_object(
+               'status', status,
+               'attempts', attempts,
+               'section_id', section_id,
+               'input_tokens', input_tokens,
+               'output_tokens', output_tokens,
+               'total_tokens', total_tokens,
+               'error', error_message,
+               'started_at', started_at,
+               'completed_at', completed_at
+           )), '{}'::jsonb)
+    INTO v_state
+    FROM proposal_section_executions
+    WHERE run_id = p_run_id;
+
+    UPDATE proposal_workflow_runs SET section_execution_state = v_state WHERE id = p_run_id;
+    RETURN v_state;
+END;
+$$ LANGUAGE plpgsql;
+
+-- One-time backfill from existing JSONB snapshots ({"SECTION": "status"} or {"SECTION": {"status": ...}})
+INSERT INTO proposal_section_executions (run_id, section_code, status, attempts, error_message, started_at, completed_at)
+SELECT r.id, st.key,
+       COALESCE(CASE WHEN jsonb_typeof(st.value) = 'object' THEN st.value->>'status' ELSE st.value #>> '{}' END, 'pending'),
+       COALESCE(CASE WHEN jsonb_typeof(st.value) = 'object' THEN safe_numeric(st.value->>'attempts')::INTEGER END, 0),
+       CASE WHEN jsonb_typeof(st.value) = 'object' THEN st.value->>'error' END,
+       CASE WHEN jsonb_typeof(st.value) = 'object' AND st.value->>'started_at' ~ '^\d{4}-\d{2}-\d{2}' THEN (st.value->>'started_at')::TIMESTAMPTZ END,
+       CASE WHEN jsonb_typeof(st.value) = 'object' AND st.value->>'completed_at' ~ '^\d{4}-\d{2}-\d{2}' THEN (st.value->>'completed_at')::TIMESTAMPTZ END
+FROM proposal_workflow_runs r
+CROSS JOIN LATERAL jsonb_each(r.section_execution_state) st
+WHERE jsonb_typeof(r.section_execution_state) = 'object'
+ON CONFLICT (run_id, section_code) DO NOTHING;
+
+-- ==========================================
+-- 14. BLUEPRINT TOPOLOGY COMPILER
+-- ==========================================
+
+-- One compiled DAG per distinct sections_config; runs pin the topology they started with
+ALTER TABLE blueprint_topology ADD COLUMN IF NOT EXISTS config_hash TEXT;
+ALTER TABLE blueprint_topology ADD COLUMN IF NOT EXISTS is_valid BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE blueprint_topology ADD COLUMN IF NOT EXISTS compile_errors JSONB NOT NULL DEFAULT '[]'::jsonb;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_blueprint_topology_config ON blueprint_topology(blueprint_id, config_hash);
+
+-- Validates dependencies + math_dependencies and stores the execution plan in topology_data:
+--   order          topological order (wave by wave, alphabetical within a wave)
+--   waves          sections that can run concurrently; wave N only depends on waves < N
+--   critical_path  longest dependency chain, i.e. the minimum number of sequential steps
+--   dependencies / dependents  adjacency in both directions
+-- Missing dependencies and cycles are recorded in compile_errors and mark the topology invalid.
+CREATE OR REPLACE FUNCTION compile_blueprint_topology(p_blueprint_id UUID) RETURNS UUID AS $$
+DECLARE
+    v_config JSONB;
+    v_hash TEXT;
+    v_id UUID;
+    v_level INTEGER := 0;
+    v_errors JSONB := '[]'::jsonb;
+    v_cycle TEXT[];
+    v_data JSONB;
+BEGIN
+    SELECT sections_config INTO v_config FROM proposal_blueprints WHERE id = p_blueprint_id;
+    IF v_config IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    -- jsonb text is normalized (key order and whitespace are not preserved), so equal configs hash equal
+    v_hash := md5(v_config::text);
+    SELECT id INTO v_id FROM blueprint_topology WHERE blueprint_id = p_blueprint_id AND config_hash = v_hash;
+    IF FOUND THEN
+        RETURN v_id;
+    END IF;
+
+    DROP TABLE IF EXISTS blueprint_nodes;
+    CREATE TEMP TABLE blueprint_nodes (
+        section TEXT PRIMARY KEY,
+        level INTEGER,
+        via TEXT -- Deepest upstream section, for walking the critical path
+    ) ON COMMIT DROP;
+    DROP TABLE IF EXISTS blueprint_edges;
+    CREATE TEMP TABLE blueprint_edges (
+        section TEXT,
+        dep TEXT,
+        PRIMARY KEY (section, dep)
+    ) ON COMMIT DROP;
+
+    INSERT INTO blueprint_nodes (section) SELECT jsonb_object_keys(v_config);
+    INSERT INTO blueprint_edges (section, dep)
+    SELECT DISTINCT sc.key, d.dep
+    FROM jsonb_each(v_config) sc
+    CROSS JOIN LATERAL (
+        SELECT jsonb_array_elements_text(CASE WHEN jsonb_typeof(sc.value->'dependencies') = 'array' THEN sc.value->'dependencies' ELSE '[]'::jsonb END)
+        UNION
+        SELECT jsonb_array_elements_text(CASE WHEN jsonb_typeof(sc.value->'math_dependencies') = 'array' THEN sc.value->'math_dependencies' ELSE '[]'::jsonb END)
+    ) d(dep);
+
+    -- Missing dependencies are reported, then dropped so the rest of the graph still compiles
+    SELECT v_errors || COALESCE(jsonb_agg(jsonb_build_object('type', 'missing_dependency', 'section', e.section, 'dependency', e.dep)
+                                          ORDER BY e.section, e.dep), '[]'::jsonb)
+    INTO v_errors
+    FROM blueprint_edges e
+    WHERE NOT EXISTS (SELECT 1 FROM blueprint_nodes n WHERE n.section = e.dep);
+    DELETE FROM blueprint_edges e WHERE NOT EXISTS (SELECT 1 FROM blueprint_nodes n WHERE n.section = e.dep);
+
+    -- Kahn's algorithm one wave at a time: a section joins the first wave after all its dependencies
+    LOOP
+        UPDATE blueprint_nodes n
+        SET level = v_level,
+            via = (SELECT d.section FROM blueprint_edges e JOIN blueprint_nodes d ON d.section = e.dep
+                   WHERE e.section = n.section ORDER BY d.level DESC, d.section LIMIT 1)
+        WHERE n.level IS NULL
+          AND NOT EXISTS (SELECT 1 FROM blueprint_edges e JOIN blueprint_nodes d ON d.section = e.dep
+                          WHERE e.section = n.section AND d.level IS NULL);
+        EXIT WHEN NOT FOUND;
+        v_level := v_level + 1;
+    END LOOP;
+
+    -- Whatever never became ready is on (or downstream of) a cycle
+    SELECT array_agg(section ORDER BY section) INTO v_cycle FROM blueprint_nodes WHERE level IS NULL;
+    IF v_cycle IS NOT NULL THEN
+        v_errors := v_errors || jsonb_build_array(jsonb_build_object('type', 'cycle', 'sections', to_jsonb(v_cycle)));
+    END IF;
+
+    SELECT jsonb_build_object(
+        'config_hash', v_hash,
+        'section_count', (SELECT COUNT(*) FROM blueprint_nodes),
+        'order', COALESCE((SELECT jsonb_agg(section ORDER BY level, section) FROM blueprint_nodes WHERE level IS NOT NULL), '[]'::jsonb),
+        'waves', COALESCE((SELECT jsonb_agg(w.sections ORDER BY w.level)
+                           FROM (SELECT level, jsonb_agg(section ORDER BY section) AS sections
+                                 FROM blueprint_nodes WHERE level IS NOT NULL GROUP BY level) w), '[]'::jsonb),
+        'critical_path', COALESCE((
+            WITH RECURSIVE chain AS (
+                SELECT section, via, 1 AS step
+                FROM (SELECT section, via FROM blueprint_nodes WHERE level IS NOT NULL ORDER BY level DESC, section LIMIT 1) tail
+                UNION ALL
+                SELECT n.section, n.via, c.step + 1
+                FROM chain c JOIN blueprint_nodes n ON n.section = c.via
+            )
+            SELECT jsonb_agg(section ORDER BY step DESC) FROM chain), '[]'::jsonb),
+        'dependencies', COALESCE((SELECT jsonb_object_agg(n.section, COALESCE(
+                              (SELECT jsonb_agg(e.dep ORDER BY e.dep) FROM blueprint_edges e WHERE e.section = n.section), '[]'::jsonb))
+                          FROM blueprint_nodes n), '{}'::jsonb),
+        'dependents', COALESCE((SELECT jsonb_object_agg(n.section, COALESCE(
+                            (SELECT jsonb_agg(e.section ORDER BY e.section) FROM blueprint_edges e WHERE e.dep = n.section), '[]'::jsonb))
+                        FROM blueprint_nodes n), '{}'::jsonb)
+    ) INTO v_data;
+
+    INSERT INTO blueprint_topology (blueprint_id, topology_data, config_hash, is_valid, compile_errors)
+    VALUES (p_blueprint_id, v_data, v_hash, jsonb_array_length(v_errors) = 0, v_errors)
+    ON CONFLICT (blueprint_id, config_hash) DO UPDATE SET topology_data = EXCLUDED.topology_data
+    RETURNING id INTO v_id;
+
+    DROP TABLE IF EXISTS blueprint_nodes;
+    DROP TABLE IF EXISTS blueprint_edges;
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Topology for the blueprint's current config (compiled on demand); refuses to plan a run on a broken graph
+CREATE OR REPLACE FUNCTION current_blueprint_topology(p_blueprint_id UUID) RETURNS UUID AS $$
+DECLARE
+    v_id UUID;
+    v_valid BOOLEAN;
+    v_errors JSONB;
+BEGIN
+    v_id := compile_blueprint_topology(p_blueprint_id);
+    SELECT is_valid, compile_errors INTO v_valid, v_errors FROM blueprint_topology WHERE id = v_id;
+    IF v_id IS NULL THEN
+        RAISE EXCEPTION 'Blueprint % not found', p_blueprint_id;
+    ELSIF NOT v_valid THEN
+        RAISE EXCEPTION 'Blueprint % has an invalid section graph: %', p_blueprint_id, v_errors;
+    END IF;
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recompile whenever sections_config changes (e.g. migrate_blueprint.py); invalid graphs are kept with their errors
+CREATE OR REPLACE FUNCTION trigger_compile_blueprint_topology() RETURNS TRIGGER AS $$
+DECLARE
+    v_id UUID;
+BEGIN
+    v_id := compile_blueprint_topology(NEW.id);
+    IF EXISTS (SELECT 1 FROM blueprint_topology WHERE id = v_id AND NOT is_valid) THEN
+        RAISE WARNING 'Blueprint % (%) compiled with errors: %', NEW.version_label, NEW.id,
+            (SELECT compile_errors FROM blueprint_topology WHERE id = v_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_blueprint_topology_insert ON proposal_blueprints;
+CREATE TRIGGER trigger_blueprint_topology_insert
+    AFTER INSERT ON proposal_blueprints
+    FOR EACH ROW EXECUTE FUNCTION trigger_compile_blueprint_topology();
+
+DROP TRIGGER IF EXISTS trigger_blueprint_topology_update ON proposal_blueprints;
+CREATE TRIGGER trigger_blueprint_topology_update
+    AFTER UPDATE OF sections_config ON proposal_blueprints
+    FOR EACH ROW WHEN (OLD.sections_config IS DISTINCT FROM NEW.sections_config)
+    EXECUTE FUNCTION trigger_compile_blueprint_topology();
+
+-- Compile existing blueprints (no-op for configs already compiled)
+SELECT compile_blueprint_topology(id) FROM proposal_blueprints;
+
+-- ==========================================
+-- 15. SECTION GENERATION CACHE (Content-Addressed)
+-- ==========================================
+
+-- Fingerprint of the inputs a version was generated from (NULL for manual edits and legacy rows)
+ALTER TABLE proposal_sections ADD COLUMN IF NOT EXISTS input_fingerprint TEXT;
+CREATE INDEX IF NOT EXISTS idx_proposal_sections_fingerprint ON proposal_sections(input_fingerprint) WHERE input_fingerprint IS NOT NULL;
+
+-- Generated output keyed by input fingerprint; survives version pruning and is shared by any
+-- proposal whose inputs hash the same
+CREATE TABLE IF NOT EXISTS section_generation_cache (
+    fingerprint TEXT PRIMARY KEY,
+    section_code VARCHAR(100) NOT NULL,
+    openai_model VARCHAR(100),
+    content TEXT NOT NULL,
+    structured_data JSONB,
+    source_section_id BIGINT REFERENCES proposal_sections(id) ON DELETE SET NULL,
+    input_tokens INTEGER DEFAULT 0, -- Spent once, saved on every hit
+    output_tokens INTEGER DEFAULT 0,
+    hit_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_section_generation_cache_last_used ON section_generation_cache(COALESCE(last_hit_at, created_at));
+
+-- Hash of everything a section's prompt is built from: the section's blueprint config (prompt method,
+-- model, temperature, top_p, dependencies), proposal location and domain, user hints, an optional
+-- prompt code version, and the content of each active upstream section. Editing or regenerating an
+-- upstream section changes its content hash, which changes every downstream fingerprint.
+-- requires_raw_data sections also hash the village context (section 17; plpgsql so it resolves at call
+-- time), so a source reload that changes the village's data invalidates them. The topology is read,
+-- never compiled: the latest row for the blueprint, preferring the one for its current config.
+CREATE OR REPLACE FUNCTION section_input_fingerprint(
+    p_proposal_id UUID,
+    p_section_code VARCHAR,
+    p_user_hints TEXT DEFAULT NULL,
+    p_prompt_version TEXT DEFAULT NULL
+) RETURNS TEXT AS $$
+BEGIN
+    RETURN (
+        SELECT md5((jsonb_build_object(
+            'section', p_section_code,
+            'config', pb.sections_config->p_section_code,
+            'prompt_version', p_prompt_version,
+            'hints', NULLIF(btrim(p_user_hints), ''),
+            'proposal', jsonb_build_object(
+                'ngo_id', pm.ngo_id,
+                'domain', pm.domain,
+                'sub_domain', pm.sub_domain,
+                'village', pm.location_village,
+                'district', pm.location_district,
+                'state', pm.location_state,
+                'lgd_code', pm.location_lgd_code,
+                'pincode', pm.location_pincode
+            ),
+            'upstream', COALESCE((
+                SELECT jsonb_object_agg(dep.code, md5(COALESCE(ps.content, '')) || ':' || md5(COALESCE(ps.structured_data::text, '')))
+                FROM jsonb_array_elements_text(bt.topology_data->'dependencies'->p_section_code) dep(code)
+                LEFT JOIN proposal_sections ps
+                       ON ps.proposal_id = p_proposal_id AND ps.section_code = dep.code AND ps.is_active = TRUE
+            ), '{}'::jsonb)
+        ) || CASE WHEN (pb.sections_config->p_section_code->>'requires_raw_data')::BOOLEAN AND pm.location_lgd_code IS NOT NULL
+                  THEN jsonb_build_object('location_context', md5(get_village_context(pm.location_lgd_code)::text))
+                  ELSE '{}'::jsonb END -- Added only when used, so other sections keep their fingerprints
+        )::text)
+        FROM proposal_master pm
+        JOIN proposal_blueprints pb ON pb.id = pm.blueprint_id
+        CROSS JOIN LATERAL (
+            SELECT t.topology_data FROM blueprint_topology t
+            WHERE t.blueprint_id = pm.blueprint_id
+            ORDER BY t.config_hash IS NOT DISTINCT FROM md5(pb.sections_config::text) DESC, t.created_at DESC
+            LIMIT 1
+        ) bt
+        WHERE pm.proposal_id = p_proposal_id
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Makes the cached output for p_fingerprint the active version of the section without an LLM call.
+-- Returns the active section id, or NULL on a cache miss (the caller generates as usual).
+CREATE OR REPLACE FUNCTION apply_cached_section(
+    p_proposal_id UUID,
+    p_section_code VARCHAR,
+    p_fingerprint TEXT
+) RETURNS BIGINT AS $$
+DECLARE
+    v_active_id BIGINT;
+    v_active_fingerprint TEXT;
+    v_cache section_generation_cache%ROWTYPE;
+    v_id BIGINT;
+BEGIN
+    SELECT id, input_fingerprint INTO v_active_id, v_active_fingerprint
+    FROM proposal_sections
+    WHERE proposal_id = p_proposal_id AND section_code = p_section_code AND is_active = TRUE;
+
+    -- Already current: nothing to do
+    IF v_active_fingerprint = p_fingerprint THEN
+        RETURN v_active_id;
+    END IF;
+
+    UPDATE section_generation_cache
+    SET hit_count = hit_count + 1, last_hit_at = CURRENT_TIMESTAMP
+    WHERE fingerprint = p_fingerprint
+    RETURNING * INTO v_cache;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE proposal_sections SET is_active = FALSE WHERE id = v_active_id;
+    INSERT INTO proposal_sections (
+        proposal_id, section_code, version, content, is_active, openai_model, status,
+        input_tokens, output_tokens, total_tokens, source, generation_time_ms, structured_data, input_fingerprint
+    )
+    SELECT p_proposal_id, p_section_code, COALESCE(MAX(version), 0) + 1, v_cache.content, TRUE, v_cache.openai_model, 'completed',
+           0, 0, 0, 'CACHE', 0, v_cache.structured_data, p_fingerprint
+    FROM proposal_sections
+    WHERE proposal_id = p_proposal_id AND section_code = p_section_code
+    RETURNING id INTO v_id;
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Active sections whose inputs changed since they were generated, in execution order.
+-- Sections without a fingerprint (manual edits, legacy rows) are never reported stale.
+CREATE OR REPLACE FUNCTION stale_proposal_sections(p_proposal_id UUID)
+RETURNS TABLE(section_code VARCHAR, section_id BIGINT, stored_fingerprint TEXT, current_fingerprint TEXT) AS $$
+    SELECT ps.section_code, ps.id, ps.input_fingerprint, cur.fp
+    FROM proposal_master pm
+    JOIN proposal_blueprints pb ON pb.id = pm.blueprint_id
+    CROSS JOIN LATERAL (
+        SELECT t.topology_data FROM blueprint_topology t
+        WHERE t.blueprint_id = pm.blueprint_id
+        ORDER BY t.config_hash IS NOT DISTINCT FROM md5(pb.sections_config::text) DESC, t.created_at DESC
+        LIMIT 1
+    ) bt
+    CROSS JOIN LATERAL jsonb_array_elements_text(bt.topology_data->'order') WITH ORDINALITY o(code, pos)
+    JOIN proposal_sections ps ON ps.proposal_id = pm.proposal_id AND ps.section_code = o.code AND ps.is_active = TRUE
+    CROSS JOIN LATERAL (SELECT section_input_fingerprint(pm.proposal_id, ps.section_code, ps.user_hints) AS fp) cur
+    WHERE pm.proposal_id = p_proposal_id
+      AND ps.input_fingerprint IS NOT NULL
+      AND ps.input_fingerprint IS DISTINCT FROM cur.fp
+    ORDER BY o.pos;
+$$ LANGUAGE sql;
+
+-- Walks a run in topological order and settles every pending section whose upstream is done and whose
+-- inputs are unchanged (skipped, existing version kept) or cached (completed from cache, 0 tokens).
+-- Workers call it at run start and after each section finishes; what remains pending needs the LLM.
+CREATE OR REPLACE FUNCTION resolve_cached_sections(p_run_id UUID) RETURNS INTEGER AS $$
+DECLARE
+    v_proposal_id UUID;
+    v_section RECORD;
+    v_fingerprint TEXT;
+    v_active_id BIGINT;
+    v_section_id BIGINT;
+    v_token UUID;
+    v_count INTEGER := 0;
+BEGIN
+    SELECT proposal_id INTO v_proposal_id FROM proposal_workflow_runs WHERE id = p_run_id;
+    PERFORM release_expired_section_leases(p_run_id); -- Sections a crashed worker held become pending again
+
+    FOR v_section IN
+        SELECT e.section_code, ps.id AS active_id, ps.input_fingerprint AS active_fingerprint, ps.user_hints
+        FROM proposal_workflow_runs r
+        JOIN blueprint_topology bt ON bt.id = r.topology_id
+        CROSS JOIN LATERAL jsonb_array_elements_text(bt.topology_data->'order') WITH ORDINALITY o(code, pos)
+        JOIN proposal_section_executions e ON e.run_id = r.id AND e.section_code = o.code
+        LEFT JOIN proposal_sections ps ON ps.proposal_id = r.proposal_id AND ps.section_code = o.code AND ps.is_active = TRUE
+        WHERE r.id = p_run_id AND e.status = 'pending'
+        ORDER BY o.pos
+    LOOP
+        -- Upstream rows settled earlier in this loop are visible here
+        CONTINUE WHEN NOT EXISTS (SELECT 1 FROM runnable_section_executions
+                                  WHERE run_id = p_run_id AND section_code = v_section.section_code);
+
+        v_fingerprint := section_input_fingerprint(v_proposal_id, v_section.section_code, v_section.user_hints);
+        IF v_section.active_fingerprint IS DISTINCT FROM v_fingerprint
+           AND NOT EXISTS (SELECT 1 FROM section_generation_cache WHERE fingerprint = v_fingerprint) THEN
+            CONTINUE; -- Needs the LLM; leave it pending for a worker
+        END IF;
+        -- Claim like any worker would, so finishing it cannot race a worker that got there first
+        v_token := claim_section_execution(p_run_id, v_section.section_code);
+        CONTINUE WHEN v_token IS NULL;
+
+        IF v_section.active_fingerprint = v_fingerprint THEN
+            PERFORM finish_section_execution(p_run_id, v_section.section_code, v_token, 'skipped', v_section.active_id);
+            v_count := v_count + 1;
+        ELSE
+            v_section_id := apply_cached_section(v_proposal_id, v_section.section_code, v_fingerprint);
+            IF v_section_id IS NOT NULL THEN
+                PERFORM finish_section_execution(p_run_id, v_section.section_code, v_token, 'completed', v_section_id);
+                v_count := v_count + 1;
+            ELSE
+                -- Cache entry pruned since the check above: hand the section back to the workers
+                UPDATE proposal_section_executions
+                SET status = 'pending', attempts = attempts - 1, started_at = NULL,
+                    lease_token = NULL, lease_expires_at = NULL
+                WHERE run_id = p_run_id AND section_code = v_section.section_code AND lease_token = v_token;
+            END IF;
+        END IF;
+    END LOOP;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Fill the cache from successfully generated versions that carry a fingerprint
+CREATE OR REPLACE FUNCTION trigger_fill_section_cache() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO section_generation_cache (fingerprint, section_code, openai_model, content, structured_data,
+                                          source_section_id, input_tokens, output_tokens)
+    SELECT DISTINCT ON (n.input_fingerprint)
+           n.input_fingerprint, n.section_code, n.openai_model, n.content, n.structured_data,
+           n.id, COALESCE(n.input_tokens, 0), COALESCE(n.output_tokens, 0)
+    FROM new_rows n
+    WHERE n.input_fingerprint IS NOT NULL
+      AND n.source = 'AI_GENERATED'
+      AND lower(COALESCE(n.status, 'completed')) = 'completed'
+      AND n.error_message IS NULL
+      AND btrim(n.content) <> ''
+    ORDER BY n.input_fingerprint, n.id DESC
+    ON CONFLICT (fingerprint) DO UPDATE SET
+        content = EXCLUDED.content,
+        structured_data = EXCLUDED.structured_data,
+        openai_model = EXCLUDED.openai_model,
+        source_section_id = EXCLUDED.source_section_id,
+        input_tokens = EXCLUDED.input_tokens,
+        output_tokens = EXCLUDED.output_tokens
+    WHERE section_generation_cache.source_section_id IS DISTINCT FROM EXCLUDED.source_section_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_section_cache_insert ON proposal_sections;
+CREATE TRIGGER trigger_section_cache_insert
+    AFTER INSERT ON proposal_sections
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trigger_fill_section_cache();
+
+-- Versions created as placeholders and completed later
+DROP TRIGGER IF EXISTS trigger_section_cache_update ON proposal_sections;
+CREATE TRIGGER trigger_section_cache_update
+    AFTER UPDATE ON proposal_sections
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trigger_fill_section_cache();
+
+-- Drops entries not produced or reused within p_max_age
+CREATE OR REPLACE FUNCTION prune_section_generation_cache(p_max_age INTERVAL DEFAULT INTERVAL '90 days') RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    DELETE FROM section_generation_cache
+    WHERE COALESCE(last_hit_at, created_at) < CURRENT_TIMESTAMP - p_max_age;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==========================================
+-- 16. TOKEN USAGE LEDGER & DAILY ROLLUPS
+-- ==========================================
+
+-- Append-only record of every metered LLM call. No foreign keys: cost history outlives version
+-- pruning and proposal deletion. Org and domain are copied in at write time so reports never join back.
+CREATE TABLE IF NOT EXISTS token_usage_ledger (
+    id BIGSERIAL,
+    occurred_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    usage_kind VARCHAR(30) NOT NULL, -- section, title_inference, tag_inference
+    proposal_id UUID,
+    org_id INTEGER,
+    domain VARCHAR(50),
+    section_code VARCHAR(100),
+    section_id BIGINT,
+    model VARCHAR(100),
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (id, occurred_at)
+) PARTITION BY RANGE (occurred_at);
+
+CREATE TABLE IF NOT EXISTS token_usage_ledger_default PARTITION OF token_usage_ledger DEFAULT;
+CREATE INDEX IF NOT EXISTS idx_token_usage_ledger_proposal ON token_usage_ledger(proposal_id);
+CREATE INDEX IF NOT EXISTS idx_token_usage_ledger_org ON token_usage_ledger(org_id, occurred_at);
+
+-- Months holding existing section versions, then the rolling window kept by the monthly job
+SELECT add_monthly_partition('token_usage_ledger', m::DATE)
+FROM generate_series(
+    date_trunc('month', LEAST(CURRENT_TIMESTAMP, (SELECT MIN(created_at) FROM proposal_sections))),
+    date_trunc('month', CURRENT_TIMESTAMP),
+    INTERVAL '1 month'
+) m;
+
+-- Monthly upkeep alongside maintain_activity_log_partitions(), e.g. from cron:
+--   SELECT maintain_token_usage_partitions(3);
+-- Cost history is kept by default; pass p_retain_months to detach old months for archiving
+-- (token_usage_daily keeps their rollups).
+CREATE OR REPLACE FUNCTION maintain_token_usage_partitions(
+    p_months_ahead INTEGER DEFAULT 3,
+    p_retain_months INTEGER DEFAULT NULL
+) RETURNS TEXT[] AS $$
+    SELECT maintain_monthly_partitions('token_usage_ledger', p_months_ahead, p_retain_months);
+$$ LANGUAGE sql;
+
+SELECT maintain_token_usage_partitions(12);
+
+-- Incrementally maintained; '' stands for "not applicable" so every dimension can sit in the key
+CREATE TABLE IF NOT EXISTS token_usage_daily (
+    usage_date DATE NOT NULL,
+    org_id INTEGER NOT NULL DEFAULT 0,
+    domain VARCHAR(50) NOT NULL DEFAULT '',
+    section_code VARCHAR(100) NOT NULL DEFAULT '',
+    model VARCHAR(100) NOT NULL DEFAULT '',
+    usage_kind VARCHAR(30) NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    input_tokens BIGINT NOT NULL DEFAULT 0,
+    output_tokens BIGINT NOT NULL DEFAULT 0,
+    total_tokens BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (usage_date, org_id, domain, section_code, model, usage_kind)
+);
+
+CREATE INDEX IF NOT EXISTS idx_token_usage_daily_org ON token_usage_daily(org_id, usage_date);
+
+CREATE OR REPLACE VIEW token_usage_monthly AS
+SELECT date_trunc('month', usage_date)::DATE AS usage_month,
+       org_id, domain, section_code, model, usage_kind,
+       SUM(calls) AS calls,
+       SUM(input_tokens) AS input_tokens,
+       SUM(output_tokens) AS output_tokens,
+       SUM(total_tokens) AS total_tokens
+FROM token_usage_daily
+GROUP BY 1, 2, 3, 4, 5, 6;
+
+-- One grouped upsert per INSERT statement on the ledger
+CREATE OR REPLACE FUNCTION trigger_rollup_token_usage() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO token_usage_daily AS d (usage_date, org_id, domain, section_code, model, usage_kind,
+                                        calls, input_tokens, output_tokens, total_tokens)
+    SELECT occurred_at::DATE, COALESCE(org_id, 0), COALESCE(domain, ''), COALESCE(section_code, ''),
+           COALESCE(model, ''), usage_kind,
+           COUNT(*), SUM(input_tokens), SUM(output_tokens), SUM(total_tokens)
+    FROM new_rows
+    GROUP BY 1, 2, 3, 4, 5, 6
+    ON CONFLICT (usage_date, org_id, domain, section_code, model, usage_kind) DO UPDATE SET
+        calls = d.calls + EXCLUDED.calls,
+        input_tokens = d.input_tokens + EXCLUDED.input_tokens,
+        output_tokens = d.output_tokens + EXCLUDED.output_tokens,
+        total_tokens = d.total_tokens + EXCLUDED.total_tokens;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_token_usage_rollup ON token_usage_ledger;
+CREATE TRIGGER trigger_token_usage_rollup
+    AFTER INSERT ON token_usage_ledger
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trigger_rollup_token_usage();
+
+-- Title/tag inference and other proposal-level calls; also keeps the running totals in token_metadata
+CREATE OR REPLACE FUNCTION record_token_usage(
+    p_proposal_id UUID,
+    p_usage_kind VARCHAR,
+    p_model VARCHAR,
+    p_input_tokens INTEGER,
+    p_output_tokens INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO token_usage_ledger (usage_kind, proposal_id, org_id, domain, model, input_tokens, output_tokens, total_tokens)
+    SELECT p_usage_kind, pm.proposal_id, pm.ngo_id, pm.domain, p_model,
+           COALESCE(p_input_tokens, 0), COALESCE(p_output_tokens, 0), COALESCE(p_input_tokens, 0) + COALESCE(p_output_tokens, 0)
+    FROM proposal_master pm WHERE pm.proposal_id = p_proposal_id;
+
+    UPDATE proposal_master
+    SET token_metadata = jsonb_set(COALESCE(token_metadata, '{}'::jsonb), ARRAY[p_usage_kind], jsonb_build_object(
+            'history', '[]'::jsonb,
+            'input', COALESCE((token_metadata->p_usage_kind->>'input')::BIGINT, 0) + COALESCE(p_input_tokens, 0),
+            'output', COALESCE((token_metadata->p_usage_kind->>'output')::BIGINT, 0) + COALESCE(p_output_tokens, 0),
+            'total', COALESCE((token_metadata->p_usage_kind->>'total')::BIGINT, 0) + COALESCE(p_input_tokens, 0) + COALESCE(p_output_tokens, 0)))
+    WHERE proposal_id = p_proposal_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Writers that still append to token_metadata.<kind>.history: entries move to the ledger and the
+-- array is emptied, so the master row stops growing. Totals are left as the writer set them.
+CREATE OR REPLACE FUNCTION trigger_drain_token_history() RETURNS TRIGGER AS $$
+DECLARE
+    v_kind TEXT;
+BEGIN
+    FOR v_kind IN
+        SELECT key FROM jsonb_each(NEW.token_metadata)
+        WHERE jsonb_typeof(value) = 'object' AND jsonb_typeof(value->'history') = 'array'
+          AND jsonb_array_length(value->'history') > 0
+    LOOP
+        INSERT INTO token_usage_ledger (occurred_at, usage_kind, proposal_id, org_id, domain, model,
+                                        input_tokens, output_tokens, total_tokens)
+        SELECT COALESCE(CASE WHEN COALESCE(h->>'timestamp', h->>'created_at') ~ '^\d{4}-\d{2}-\d{2}'
+                             THEN COALESCE(h->>'timestamp', h->>'created_at')::TIMESTAMPTZ END, CURRENT_TIMESTAMP),
+               v_kind, NEW.proposal_id, NEW.ngo_id, NEW.domain, h->>'model',
+               t.input_tokens, t.output_tokens,
+               COALESCE(t.total_tokens, safe_integer((t.input_tokens::BIGINT + t.output_tokens)::TEXT), 0)
+        FROM jsonb_array_elements(NEW.token_metadata->v_kind->'history') h
+        -- Out-of-range counts become 0 rather than failing the proposal_master write
+        CROSS JOIN LATERAL (
+            SELECT COALESCE(safe_integer(COALESCE(h->>'input', h->>'input_tokens')), 0) AS input_tokens,
+                   COALESCE(safe_integer(COALESCE(h->>'output', h->>'output_tokens')), 0) AS output_tokens,
+                   safe_integer(COALESCE(h->>'total', h->>'total_tokens')) AS total_tokens
+        ) t
+        WHERE jsonb_typeof(h) = 'object';
+
+        NEW.token_metadata := jsonb_set(NEW.token_metadata, ARRAY[v_kind, 'history'], '[]'::jsonb);
+    END LOOP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_proposal_token_history ON proposal_master;
+CREATE TRIGGER trigger_proposal_token_history
+    BEFORE INSERT OR UPDATE OF token_metadata ON proposal_master
+    FOR EACH ROW EXECUTE FUNCTION trigger_drain_token_history();
+
+-- Section generations are metered from proposal_sections itself: new versions, plus token deltas
+-- on versions inserted as placeholders and completed by a later UPDATE
+CREATE OR REPLACE FUNCTION trigger_meter_section_tokens() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO token_usage_ledger (occurred_at, usage_kind, proposal_id, org_id, domain, section_code, section_id, model,
+                                        input_tokens, output_tokens, total_tokens)
+        SELECT COALESCE(n.created_at, CURRENT_TIMESTAMP), 'section', n.proposal_id, pm.ngo_id, pm.domain, n.section_code, n.id, n.openai_model,
+               COALESCE(n.input_tokens, 0), COALESCE(n.output_tokens, 0),
+               COALESCE(n.total_tokens, COALESCE(n.input_tokens, 0) + COALESCE(n.output_tokens, 0))
+        FROM new_rows n
+        JOIN proposal_master pm ON pm.proposal_id = n.proposal_id
+        WHERE COALESCE(n.total_tokens, COALESCE(n.input_tokens, 0) + COALESCE(n.output_tokens, 0)) > 0;
+    ELSE
+        INSERT INTO token_usage_ledger (usage_kind, proposal_id, org_id, domain, section_code, section_id, model,
+                                        input_tokens, output_tokens, total_tokens)
+        SELECT 'section', n.proposal_id, pm.ngo_id, pm.domain, n.section_code, n.id, n.openai_model,
+               COALESCE(n.input_tokens, 0) - COALESCE(o.input_tokens, 0),
+               COALESCE(n.output_tokens, 0) - COALESCE(o.output_tokens, 0),
+               COALESCE(n.total_tokens, 0) - COALESCE(o.total_tokens, 0)
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        JOIN proposal_master pm ON pm.proposal_id = n.proposal_id
+        WHERE (n.input_tokens, n.output_tokens, n.total_tokens) IS DISTINCT FROM (o.input_tokens, o.output_tokens, o.total_tokens);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_section_tokens_insert ON proposal_sections;
+CREATE TRIGGER trigger_section_tokens_insert
+    AFTER INSERT ON proposal_sections
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trigger_meter_section_tokens();
+
+DROP TRIGGER IF EXISTS trigger_section_tokens_update ON proposal_sections;
+CREATE TRIGGER trigger_section_tokens_update
+    AFTER UPDATE ON proposal_sections
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trigger_meter_section_tokens();
+
+-- One-time backfill: surviving section versions, then any history arrays (drained by the trigger above)
+INSERT INTO token_usage_ledger (occurred_at, usage_kind, proposal_id, org_id, domain, section_code, section_id, model,
+                                input_tokens, output_tokens, total_tokens)
+SELECT COALESCE(ps.created_at, CURRENT_TIMESTAMP), 'section', ps.proposal_id, pm.ngo_id, pm.domain, ps.section_code, ps.id, ps.openai_model,
+       COALESCE(ps.input_tokens, 0), COALESCE(ps.output_tokens, 0),
+       COALESCE(ps.total_tokens, COALESCE(ps.input_tokens, 0) + COALESCE(ps.output_tokens, 0))
+FROM proposal_sections ps
+JOIN proposal_master pm ON pm.proposal_id = ps.proposal_id
+WHERE COALESCE(ps.total_tokens, COALESCE(ps.input_tokens, 0) + COALESCE(ps.output_tokens, 0)) > 0
+  AND NOT EXISTS (SELECT 1 FROM token_usage_ledger WHERE usage_kind = 'section');
+
+UPDATE proposal_master SET token_metadata = token_metadata
+WHERE jsonb_path_exists(token_metadata, '$.*.history[0]');
+
+-- ==========================================
+-- 17. VILLAGE CONTEXT SNAPSHOT (Raw Data for Proposals)
+-- ==========================================
+
+-- Everything the requires_raw_data sections read about a location, pre-joined into one row:
+-- geography + demographics (village_search), latest NDAP 7121 amenities and distances, the school
+-- roster with facility aggregates, and district demographics, all linked through lgd_crosswalk.
+-- Source reloads only flag rows stale; get_village_context() rebuilds a stale row on read and
+-- refresh_stale_village_context() rebuilds them in bulk.
+CREATE TABLE IF NOT EXISTS village_context (
+    lgd_code VARCHAR(50) PRIMARY KEY,
+    district_code TEXT,
+    context JSONB NOT NULL,
+    is_stale BOOLEAN NOT NULL DEFAULT FALSE,
+    built_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_village_context_district ON village_context(district_code);
+CREATE INDEX IF NOT EXISTS idx_village_context_stale ON village_context(lgd_code) WHERE is_stale;
+
+-- Set-based build for the given villages (NULL = every active LGD village)
+CREATE OR REPLACE FUNCTION refresh_village_context(p_codes TEXT[] DEFAULT NULL) RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    DELETE FROM village_context vc
+    WHERE (p_codes IS NULL OR vc.lgd_code = ANY(p_codes))
+      AND NOT EXISTS (SELECT 1 FROM village_search vs WHERE vs.lgd_code = vc.lgd_code);
+
+    INSERT INTO village_context (lgd_code, district_code, context, is_stale, built_at)
+    SELECT vs.lgd_code, lm.district_code,
+           jsonb_build_object(
+               'location', jsonb_build_object(
+                   'lgd_code', vs.lgd_code, 'village', vs.village, 'taluk', vs.taluk,
+                   'district', vs.district, 'district_code', lm.district_code,
+                   'state', vs.state, 'state_code', lm.state_code, 'pincode', vs.pincode
+               ),
+               'demographics', (
+                   SELECT jsonb_build_object(
+                       'total_population', vd.total_population, 'households', vd.households,
+                       'sc_population', vd.sc_population, 'st_population', vd.st_population,
+                       'general_population', vd.general_population,
+                       'source', vd.source, 'as_of', vd.source_as_of_date)
+                   FROM village_demographics vd WHERE vd.lgd_code = vs.lgd_code
+               ),
+               'amenities', (
+                   SELECT to_jsonb(va) - 'composite_key'
+                   FROM lgd_crosswalk cw
+                   JOIN village_amenities va ON va.composite_key = cw.source_key
+                   WHERE cw.source = 'village_amenities' AND cw.village_code = vs.lgd_code
+                   ORDER BY va.year DESC
+                   LIMIT 1
+               ),
+               'schools', COALESCE(sch.summary, jsonb_build_object('school_count', 0)),
+               'school_roster', COALESCE(sch.roster, '[]'::jsonb),
+               'district', (
+                   SELECT jsonb_build_object(
+                       'year', dd.year_code, 'total_population', dd.total_population,
+                       'sc_population', dd.sc_population, 'st_population', dd.st_population,
+                       'general_population', dd.general_population)
+                   FROM lgd_crosswalk cw
+                   JOIN district_demographics dd ON dd.state_name || '|' || dd.district_name = cw.source_key
+                   WHERE cw.source = 'district_demographics' AND cw.district_code = lm.district_code
+                   ORDER BY dd.year_code DESC
+                   LIMIT 1
+               )
+           ),
+           FALSE, CURRENT_TIMESTAMP
+    FROM village_search vs
+    JOIN lgd_master lm ON lm.village_code = vs.lgd_code
+    LEFT JOIN LATERAL (
+        SELECT jsonb_build_object(
+                   'school_count', COUNT(*),
+                   'total_students', SUM(s.total_students),
+                   'total_girls', SUM(s.total_girls),
+                   'total_boys', SUM(s.total_boys),
+                   'total_teachers', SUM(s.total_teachers),
+                   'total_classrooms', SUM(f.total_classrooms),
+                   'rooms_needing_major_repair', SUM(f.rooms_major_repair),
+                   'with_internet', COUNT(*) FILTER (WHERE COALESCE(f.has_internet, s.has_internet)),
+                   'with_library', COUNT(*) FILTER (WHERE COALESCE(f.has_library, s.has_library)),
+                   'with_playground', COUNT(*) FILTER (WHERE COALESCE(f.has_playground, s.has_playground)),
+                   'with_electricity', COUNT(*) FILTER (WHERE s.has_electricity),
+                   'with_ict_lab', COUNT(*) FILTER (WHERE f.has_ict_lab),
+                   'with_ramps', COUNT(*) FILTER (WHERE f.has_ramps),
+                   'without_boundary_wall', COUNT(*) FILTER (WHERE f.boundary_wall_type ILIKE 'no%')
+               ) AS summary,
+               jsonb_agg(jsonb_build_object(
+                   'udise_code', s.udise_code, 'school_name', s.school_name, 'year_id', s.year_id,
+                   'category', s.sch_cat_desc, 'management', s.sch_mgmt_desc, 'location_type', s.sch_loc_desc,
+                   'classes', s.class_frm || '-' || s.class_to,
+                   'total_students', s.total_students, 'total_girls', s.total_girls, 'total_boys', s.total_boys,
+                   'total_teachers', s.total_teachers, 'total_classrooms', f.total_classrooms,
+                   'has_internet', COALESCE(f.has_internet, s.has_internet),
+                   'has_library', COALESCE(f.has_library, s.has_library)
+               ) ORDER BY s.total_students DESC NULLS LAST, s.udise_code) AS roster
+        FROM (
+            -- Latest year per school matched to this village
+            SELECT DISTINCT ON (s.udise_code) s.*
+            FROM lgd_crosswalk cw
+            JOIN schools_udise_data s
+              ON s.udise_code = split_part(cw.source_key, ':', 1)
+             AND s.year_id = split_part(cw.source_key, ':', 2)::INTEGER
+            WHERE cw.source = 'udise_school' AND cw.village_code = vs.lgd_code
+            ORDER BY s.udise_code, s.year_id DESC
+        ) s
+        LEFT JOIN school_facility_facts f ON f.udise_code = s.udise_code AND f.year_id = s.year_id
+    ) sch ON TRUE
+    WHERE p_codes IS NULL OR vs.lgd_code = ANY(p_codes)
+    ON CONFLICT (lgd_code) DO UPDATE SET
+        district_code = EXCLUDED.district_code,
+        context = EXCLUDED.context,
+        is_stale = FALSE,
+        built_at = CURRENT_TIMESTAMP;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Bulk rebuild of flagged rows, oldest batch first (p_limit NULL = all)
+CREATE OR REPLACE FUNCTION refresh_stale_village_context(p_limit INTEGER DEFAULT NULL) RETURNS INTEGER AS $$
+    SELECT refresh_village_context(ARRAY(
+        SELECT lgd_code FROM village_context WHERE is_stale ORDER BY lgd_code LIMIT p_limit
+    ));
+$$ LANGUAGE sql;
+
+-- The single read sections use: built on first request, rebuilt if a source reload flagged it
+CREATE OR REPLACE FUNCTION get_village_context(p_lgd_code TEXT) RETURNS JSONB AS $$
+DECLARE
+    v_context JSONB;
+BEGIN
+    SELECT context INTO v_context FROM village_context WHERE lgd_code = p_lgd_code AND NOT is_stale;
+    IF FOUND THEN
+        RETURN v_context;
+    END IF;
+    PERFORM refresh_village_context(ARRAY[p_lgd_code]);
+    SELECT context INTO v_context FROM village_context WHERE lgd_code = p_lgd_code;
+    RETURN v_context;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Invalidation: flag only rows that exist and are not already stale
+CREATE OR REPLACE FUNCTION mark_village_context_stale(p_codes TEXT[] DEFAULT NULL, p_district_codes TEXT[] DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    UPDATE village_context SET is_stale = TRUE
+    WHERE NOT is_stale
+      AND (lgd_code = ANY(p_codes) OR district_code = ANY(p_district_codes));
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- village_search already tracks lgd_master + village_demographics changes
+CREATE OR REPLACE FUNCTION village_context_on_search_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM mark_village_context_stale(ARRAY(SELECT lgd_code FROM old_rows));
+    ELSE
+        PERFORM mark_village_context_stale(ARRAY(SELECT lgd_code FROM new_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Every source reload ends in refresh_lgd_crosswalk(), so crosswalk changes cover amenities,
+-- schools and district demographics that gained, lost or changed a match
+CREATE OR REPLACE FUNCTION village_context_on_crosswalk_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM mark_village_context_stale(
+            ARRAY(SELECT village_code FROM old_rows WHERE village_code IS NOT NULL),
+            ARRAY(SELECT district_code FROM old_rows WHERE source = 'district_demographics' AND district_code IS NOT NULL));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM mark_village_context_stale(
+            ARRAY(SELECT village_code FROM new_rows WHERE village_code IS NOT NULL
+                  UNION SELECT village_code FROM old_rows WHERE village_code IS NOT NULL),
+            ARRAY(SELECT district_code FROM new_rows WHERE source = 'district_demographics' AND district_code IS NOT NULL
+                  UNION SELECT district_code FROM old_rows WHERE source = 'district_demographics' AND district_code IS NOT NULL));
+    ELSE
+        PERFORM mark_village_context_stale(
+            ARRAY(SELECT village_code FROM new_rows WHERE village_code IS NOT NULL),
+            ARRAY(SELECT district_code FROM new_rows WHERE source = 'district_demographics' AND district_code IS NOT NULL));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reloads that rewrite source rows without changing their match (same keys, new values)
+CREATE OR REPLACE FUNCTION village_context_on_source_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'village_amenities' THEN
+        PERFORM mark_village_context_stale(ARRAY(
+            SELECT cw.village_code FROM lgd_crosswalk cw JOIN new_rows n ON cw.source_key = n.composite_key
+            WHERE cw.source = 'village_amenities' AND cw.village_code IS NOT NULL));
+    ELSIF TG_TABLE_NAME = 'district_demographics' THEN
+        PERFORM mark_village_context_stale(NULL, ARRAY(
+            SELECT cw.district_code FROM lgd_crosswalk cw JOIN new_rows n ON cw.source_key = n.state_name || '|' || n.district_name
+            WHERE cw.source = 'district_demographics' AND cw.district_code IS NOT NULL));
+    ELSE -- schools_udise_data, school_facility_facts
+        PERFORM mark_village_context_stale(ARRAY(
+            SELECT cw.village_code FROM lgd_crosswalk cw JOIN new_rows n ON cw.source_key = n.udise_code || ':' || n.year_id
+            WHERE cw.source = 'udise_school' AND cw.village_code IS NOT NULL));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_village_context_search_insert ON village_search;
+CREATE TRIGGER trg_village_context_search_insert AFTER INSERT ON village_search
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_search_change();
+DROP TRIGGER IF EXISTS trg_village_context_search_update ON village_search;
+CREATE TRIGGER trg_village_context_search_update AFTER UPDATE ON village_search
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_search_change();
+DROP TRIGGER IF EXISTS trg_village_context_search_delete ON village_search;
+CREATE TRIGGER trg_village_context_search_delete AFTER DELETE ON village_search
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_search_change();
+
+DROP TRIGGER IF EXISTS trg_village_context_crosswalk_insert ON lgd_crosswalk;
+CREATE TRIGGER trg_village_context_crosswalk_insert AFTER INSERT ON lgd_crosswalk
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_crosswalk_change();
+DROP TRIGGER IF EXISTS trg_village_context_crosswalk_update ON lgd_crosswalk;
+CREATE TRIGGER trg_village_context_crosswalk_update AFTER UPDATE ON lgd_crosswalk
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_crosswalk_change();
+DROP TRIGGER IF EXISTS trg_village_context_crosswalk_delete ON lgd_crosswalk;
+CREATE TRIGGER trg_village_context_crosswalk_delete AFTER DELETE ON lgd_crosswalk
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_crosswalk_change();
+
+DROP TRIGGER IF EXISTS trg_village_context_amenities_insert ON village_amenities;
+CREATE TRIGGER trg_village_context_amenities_insert AFTER INSERT ON village_amenities
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_source_change();
+DROP TRIGGER IF EXISTS trg_village_context_amenities_update ON village_amenities;
+CREATE TRIGGER trg_village_context_amenities_update AFTER UPDATE ON village_amenities
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_source_change();
+
+DROP TRIGGER IF EXISTS trg_village_context_district_insert ON district_demographics;
+CREATE TRIGGER trg_village_context_district_insert AFTER INSERT ON district_demographics
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_source_change();
+DROP TRIGGER IF EXISTS trg_village_context_district_update ON district_demographics;
+CREATE TRIGGER trg_village_context_district_update AFTER UPDATE ON district_demographics
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_source_change();
+
+DROP TRIGGER IF EXISTS trg_village_context_schools_insert ON schools_udise_data;
+CREATE TRIGGER trg_village_context_schools_insert AFTER INSERT ON schools_udise_data
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_source_change();
+DROP TRIGGER IF EXISTS trg_village_context_schools_update ON schools_udise_data;
+CREATE TRIGGER trg_village_context_schools_update AFTER UPDATE ON schools_udise_data
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_source_change();
+
+-- Fragment-driven facility changes (no schools_udise_data write) surface here
+DROP TRIGGER IF EXISTS trg_village_context_facility_insert ON school_facility_facts;
+CREATE TRIGGER trg_village_context_facility_insert AFTER INSERT ON school_facility_facts
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_source_change();
+DROP TRIGGER IF EXISTS trg_village_context_facility_update ON school_facility_facts;
+CREATE TRIGGER trg_village_context_facility_update AFTER UPDATE ON school_facility_facts
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION village_context_on_source_change();
+
+-- One-time backfill for villages proposals already point at; others are built on first read
+SELECT refresh_village_context(ARRAY(
+    SELECT DISTINCT location_lgd_code::TEXT FROM proposal_master WHERE location_lgd_code IS NOT NULL
+)) WHERE NOT EXISTS (SELECT 1 FROM village_context);
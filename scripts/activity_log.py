@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Buffered Activity Log Writer
+Moves proposal_activity_logs inserts off the request path.
+- log() only enqueues; a background thread writes batches as multi-row INSERTs.
+- A batch is flushed when it reaches `batch_size` events or `flush_interval` seconds after its first event.
+- created_at is stamped at log() time, so batching never reorders the audit trail.
+- If the queue is full (database down or slow), log() falls back to a synchronous insert rather than dropping events.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2.extras import execute_values, Json
+from dotenv import load_dotenv
+
+env_path = os.path.join(os.path.dirname(__file__), '..', '.env')
+load_dotenv(dotenv_path=env_path)
+
+logger = logging.getLogger("ActivityLog")
+
+COLUMNS = ('proposal_id', 'event_type', 'actor_id', 'event_metadata', 'display_text',
+           'proposal_snapshot', 'actor_snapshot', 'created_at')
+INSERT_SQL = f"INSERT INTO proposal_activity_logs ({', '.join(COLUMNS)}) VALUES %s"
+JSON_COLUMNS = {'event_metadata', 'proposal_snapshot', 'actor_snapshot'}
+
+_STOP = object()
+
+class ActivityLogWriter:
+    def __init__(self, dsn=None, batch_size=200, flush_interval=1.0, max_queue=10000):
+        self.dsn = dsn or os.getenv("DATABASE_URL")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.conn = None
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def log(self, proposal_id, event_type, actor_id=None, event_metadata=None, display_text=None,
+            proposal_snapshot=None, actor_snapshot=None):
+        """Queues one event and returns immediately."""
+        row = (str(proposal_id) if proposal_id else None, event_type, actor_id,
+               event_metadata, display_text, proposal_snapshot, actor_snapshot,
+               datetime.now(timezone.utc))
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            logger.warning("Activity log queue full; writing event synchronously")
+            self._write_direct([row])
+
+    def flush(self, timeout=None):
+        """Blocks until every event queued so far has been written (False on timeout)."""
+        if not self.thread.is_alive():
+            self._drain_direct()
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Poll so a writer that stops after the put (close() racing us) cannot leave us waiting forever
+        while not done.wait(0.5 if deadline is None else max(0.0, min(0.5, deadline - time.monotonic()))):
+            if not self.thread.is_alive():
+                self._drain_direct()
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+        return True
+
+    def close(self, timeout=10.0):
+        if self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+        if not self.thread.is_alive():
+            self._drain_direct() # Events logged after the writer stopped
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _write_direct(self, rows):
+        conn = psycopg2.connect(self.dsn) # Own connection; the writer thread's is not shared
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, INSERT_SQL, self._adapt(rows), page_size=len(rows))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _drain_direct(self):
+        """Writes whatever is still queued from the calling thread (writer thread stopped)."""
+        rows, waiters = [], []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, tuple):
+                rows.append(item)
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+        try:
+            if rows:
+                self._write_direct(rows)
+        finally:
+            for waiter in waiters:
+                waiter.set()
+
+    def _run(self):
+        batch, waiters = [], []
+        deadline = None # flush_interval after the batch's first event
+        while True:
+            try:
+                item = self.queue.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None # Flush interval elapsed
+            if isinstance(item, tuple):
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                if len(batch) < self.batch_size and time.monotonic() < deadline:
+                    continue
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            if batch:
+                self._write(batch)
+                batch, deadline = [], None
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+            if item is _STOP:
+                return
+
+    def _connection(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(self.dsn)
+        return self.conn
+
+    @staticmethod
+    def _adapt(rows):
+        return [tuple(Json(v) if c in JSON_COLUMNS and v is not None else v for c, v in zip(COLUMNS, row)) for row in rows]
+
+    def _write(self, rows):
+        rows = self._adapt(rows)
+        for attempt in range(2): # One reconnect on a dropped connection
+            try:
+                conn = self._connection()
+                with conn.cursor() as cur:
+                    execute_values(cur, INSERT_SQL, rows, page_size=len(rows))
+                conn.commit()
+                self.written += len(rows)
+                return
+            except psycopg2.OperationalError as e:
+                logger.warning(f"Activity log write failed ({e}); reconnecting")
+                if self.conn is not None and not self.conn.closed:
+                    self.conn.close()
+                self.conn = None
+            except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+                self.conn.rollback()
+                logger.warning(f"Activity log batch of {len(rows)} failed ({e}); isolating bad events")
+                self._write_rows(rows)
+                return
+            except Exception as e:
+                if self.conn is not None and not self.conn.closed:
+                    self.conn.rollback()
+                logger.error(f"Dropping {len(rows)} activity log events ({', '.join(sorted({str(r[1]) for r in rows}))}): {e}")
+                return
+        logger.error(f"Dropping {len(rows)} activity log events after reconnect failed")
+
+    def _write_rows(self, rows):
+        """Replays a rejected batch row by row under savepoints; only the bad events are dropped."""
+        conn = self.conn
+        written = 0
+        try:
+            with conn.cursor() as cur:
+                for row in rows:
+                    cur.execute("SAVEPOINT activity_row")
+                    try:
+                        execute_values(cur, INSERT_SQL, [row])
+                        cur.execute("RELEASE SAVEPOINT activity_row")
+                        written += 1
+                    except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+                        cur.execute("ROLLBACK TO SAVEPOINT activity_row")
+                        logger.error(f"Dropping activity log event {row[1]} for proposal {row[0]}: {e}")
+            conn.commit()
+            self.written += written
+        except Exception as e:
+            if not conn.closed:
+                conn.rollback()
+            logger.error(f"Dropping {len(rows)} activity log events, row recovery failed: {e}")
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """Process-wide writer, started on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ActivityLogWriter()
+        return _writer
+
+def log_event(proposal_id, event_type, actor_id=None, **fields):
+    get_writer().log(proposal_id, event_type, actor_id, **fields)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Shared Keep-Alive HTTP Client
+One process-wide requests.Session for the UDISE+ (kys.udiseplus.gov.in) and
+data.gov.in fetchers, so TCP/TLS connections are reused across schools and pages.
+"""
+import time
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+import raw_store
+from rate_control import AIMDController
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "application/json",
+}
+
+# Per-endpoint timeouts (seconds), keyed by host
+ENDPOINT_TIMEOUTS = {
+    "kys.udiseplus.gov.in": 15,
+    "api.data.gov.in": 30,
+}
+DEFAULT_TIMEOUT = 15
+DEFAULT_POOL_SIZE = 10
+
+# Adaptive per-host pacing: (starting req/s, max req/s). Shared by every caller in the process.
+ENDPOINT_RATES = {
+    "kys.udiseplus.gov.in": (4.0, 20.0),
+    "api.data.gov.in": (2.0, 10.0),
+}
+DEFAULT_RATE = (2.0, 10.0)
+
+_session = None
+_pool_size = 0
+_lock = threading.Lock()
+_controllers = {}
+
+# Raw-response store mode: None (off), "record" (save 200s) or "replay" (offline, no network)
+_store_mode = None
+_replay_as_of = None
+
+def set_store_mode(mode, as_of=None):
+    global _store_mode, _replay_as_of
+    _store_mode, _replay_as_of = mode, as_of
+
+def is_replay():
+    return _store_mode == "replay"
+
+def configure(pool_size):
+    """Sizes the keep-alive pool to the caller's worker count (grows, never shrinks)."""
+    global _session, _pool_size
+    with _lock:
+        if _session is not None and pool_size <= _pool_size:
+            return _session
+        session = _session or requests.Session()
+        session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=len(ENDPOINT_TIMEOUTS), pool_maxsize=pool_size, pool_block=True)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _session, _pool_size = session, pool_size
+        return session
+
+def get_session():
+    return _session or configure(DEFAULT_POOL_SIZE)
+
+def get_controller(host):
+    """Returns the shared AIMD controller for a host, creating it on first use."""
+    with _lock:
+        if host not in _controllers:
+            rate, max_rate = ENDPOINT_RATES.get(host, DEFAULT_RATE)
+            _controllers[host] = AIMDController(host, rate, max_rate=max_rate)
+        return _controllers[host]
+
+def configure_rate(url, rate, max_rate=None):
+    """Overrides the starting (and max) request rate for the host serving `url`."""
+    get_controller(urlparse(url).hostname).set_rate(rate, max_rate)
+
+def get(url, params=None, timeout=None, **kwargs):
+    """GET through the shared session with the endpoint's default timeout (or from the raw store)."""
+    if _store_mode == "replay":
+        return raw_store.replay(url, params, _replay_as_of)
+    host = urlparse(url).hostname
+    if timeout is None:
+        timeout = ENDPOINT_TIMEOUTS.get(host, DEFAULT_TIMEOUT)
+    controller = get_controller(host)
+    controller.acquire()
+    started = time.monotonic()
+    try:
+        resp = get_session().get(url, params=params, timeout=timeout, **kwargs)
+    except requests.Timeout:
+        controller.record_timeout()
+        raise
+    if resp.status_code == 503:
+        controller.record_overload()
+    elif resp.status_code == 200:
+        controller.record_success(time.monotonic() - started)
+    if _store_mode == "record" and resp.status_code == 200:
+        raw_store.save(url, params, resp.status_code, resp.text)
+    return resp
@@ -2,11 +2,14 @@
 import os
 import json
 import time
-import requests
+import asyncio
 import psycopg2
 import logging
+from psycopg2.extras import execute_values
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
+import api_session
 
 # Path Configuration
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -30,6 +33,11 @@ STATES = {
 }
 CURRENT_YEAR_ID = 12
 
+# Async Crawl Defaults (--async mode)
+DEFAULT_CONCURRENCY = 16   # Max in-flight API requests
+DEFAULT_RPS = 5.0          # Starting requests/sec shared by all crawl tasks (AIMD-adjusted)
+DEFAULT_MAX_RPS = 20.0     # Ceiling the adaptive controller may climb to
+
 # Logger Setup
 logging.basicConfig(
     level=logging.INFO,
@@ -55,124 +63,197 @@ def fetch_json(url, params=None, retries=3):
     """Robust JSON fetcher with retries."""
     for i in range(retries):
         try:
-            resp = requests.get(url, params=params, timeout=15)
+            resp = api_session.get(url, params=params)
             if resp.status_code == 200:
                 return resp.json().get("data")
+            if api_session.is_replay(): return None # Not in the raw store; retrying won't help
             logger.warning(f"  ! API Error {resp.status_code} at {url} (Retry {i+1})")
         except Exception as e:
             logger.warning(f"  ! Request failed: {e} (Retry {i+1})")
         time.sleep(1)
     return None
 
-def upsert_school(conn, s, d, b, c):
-    """Inserts or updates school record in the flattened schema."""
-    cursor = conn.cursor()
-    
+SCHOOL_COLUMNS = (
+    "school_id", "year_id", "effective_year", "udise_code", "school_name", "school_status", "status_name", "last_modified",
+    "state_id", "state_cd", "state_name",
+    "district_id", "district_cd", "district_name",
+    "block_id", "block_cd", "block_name",
+    "cluster_id", "cluster_cd", "cluster_name",
+    "village_id", "vill_ward_cd", "village_name",
+    "pincode", "address", "email",
+    "lgd_state_id", "lgd_district_id", "lgd_block_id", "lgd_village_id", "lgd_vill_name",
+    "lgd_panchayat_id", "lgd_vill_panchayat_name",
+    "sch_loc_rural_urban", "sch_loc_desc",
+    "sch_category_id", "sch_cat_desc",
+    "sch_type", "sch_type_desc",
+    "sch_mgmt_id", "sch_mgmt_desc",
+    "sch_mgmt_parent_id", "sch_mgmt_desc_st",
+    "sch_broad_mgmt_id", "class_frm", "class_to",
+    "is_operational_2018_to_19", "is_operational_2019_to_20", "is_operational_2020_to_21", "is_operational_2021_to_22", "is_operational_2022_to_23",
+    "scrape_status",
+)
+
+# Multi-row VALUES upsert. Preserves an existing effective_year and never downgrades 'success'.
+UPSERT_SCHOOLS_SQL = f"""
+    INSERT INTO schools_udise_data ({", ".join(SCHOOL_COLUMNS)})
+    VALUES %s
+    ON CONFLICT (school_id, year_id) DO UPDATE SET
+        effective_year = CASE 
+            WHEN schools_udise_data.effective_year IS NULL THEN EXCLUDED.effective_year 
+            ELSE schools_udise_data.effective_year 
+        END,
+        udise_code = EXCLUDED.udise_code,
+        school_name = EXCLUDED.school_name,
+        school_status = EXCLUDED.school_status,
+        status_name = EXCLUDED.status_name,
+        last_modified = EXCLUDED.last_modified,
+        is_operational_2018_to_19 = EXCLUDED.is_operational_2018_to_19,
+        is_operational_2019_to_20 = EXCLUDED.is_operational_2019_to_20,
+        is_operational_2020_to_21 = EXCLUDED.is_operational_2020_to_21,
+        is_operational_2021_to_22 = EXCLUDED.is_operational_2021_to_22,
+        is_operational_2022_to_23 = EXCLUDED.is_operational_2022_to_23,
+        scrape_status = CASE 
+            WHEN schools_udise_data.scrape_status = 'success' THEN 'success' 
+            ELSE EXCLUDED.scrape_status 
+        END;
+"""
+BATCH_PAGE_SIZE = 500
+
+def build_school_row(s, b, c):
+    """Maps a by-region API record to a SCHOOL_COLUMNS tuple (None if UDISE can't be unmasked)."""
     # 1. Unmask UDISE
     raw_code = s.get("udiseschCode")
     block_cd = s.get("blockCd")
     udise_code = unmask_code(raw_code, block_cd)
     
     if not udise_code:
-        return
+        return None
         
     # 2. Determine initial status
     school_status = s.get("schoolStatus", 0)
     status_name = s.get("schoolStatusName", "Unknown")
     scrape_status = 'pending' if school_status == 0 else 'closed_registry'
     
+    return (
+        s.get("schoolId"), CURRENT_YEAR_ID, None, udise_code, s.get("schoolName"), school_status, status_name, s.get("lastmodifiedTime"),
+        s.get("stateId"), s.get("stateCd"), s.get("stateName"),
+        s.get("districtId"), s.get("districtCd"), s.get("districtName"),
+        s.get("blockId"), s.get("blockCd"), b['blockName'],  # Use blockName from hierarchy loop
+        s.get("clusterId"), s.get("clusterCd"), c['clusterName'], # Use clusterName from hierarchy loop
+        s.get("villageId"), s.get("villWardCd"), s.get("villageName"),
+        s.get("pincode"), s.get("address"), s.get("email"),
+        s.get("lgdStateId"), s.get("lgdDistrictCd"), s.get("lgdBlockId"), s.get("lgdvillageId"), s.get("lgdvillName"),
+        s.get("lgdpanchayatId"), s.get("lgdvillpanchayatName"),
+        s.get("schLocRuralUrban"), s.get("schLocDesc"),
+        s.get("schCategoryId"), s.get("schCatDesc"),
+        s.get("schType"), s.get("schTypeDesc"),
+        s.get("schMgmtId"), s.get("schMgmtDesc"),
+        s.get("schmgmtParentId"), s.get("schMgmtDescSt"),
+        s.get("schBroadMgmtId"), s.get("classFrm"), s.get("classTo"),
+        s.get("isOperational2018To19"), s.get("isOperational2019To20"), s.get("isOperational2020To21"), s.get("isOperational2021To22"), s.get("isOperational2022To23"),
+        scrape_status
+    )
+
+def unique_school_count(rows):
+    """Rows flush_school_batch will attempt (one per (school_id, year_id) key)."""
+    return len({(r[0], r[1]) for r in rows})
+
+def flush_school_batch(conn, rows):
+    """
+    Set-based upsert of a buffered batch in one transaction.
+    If the batch fails, it is replayed row-by-row under savepoints so a bad
+    row is rejected on its own and the rest of the batch still commits.
+    Returns the number of rows written.
+    """
+    if not rows: return 0
+    # One row per key: a multi-row ON CONFLICT cannot touch the same row twice
+    rows = list({(r[0], r[1]): r for r in rows}.values())
+    cursor = conn.cursor()
+    try:
+        execute_values(cursor, UPSERT_SCHOOLS_SQL, rows, page_size=BATCH_PAGE_SIZE)
+        conn.commit()
+        return len(rows)
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"  ! Batch upsert of {len(rows)} rows failed: {e}. Isolating bad rows...")
+
+    written = 0
+    try:
+        for r in rows:
+            cursor.execute("SAVEPOINT school_row")
+            try:
+                execute_values(cursor, UPSERT_SCHOOLS_SQL, [r])
+                cursor.execute("RELEASE SAVEPOINT school_row")
+                written += 1
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT school_row")
+                logger.error(f"  ! SQL Error for {r[3]}: {e}")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"  ! Batch recovery failed: {e}")
+        written = 0
+    finally:
+        cursor.close()
+    return written
+
+def upsert_school(conn, s, d, b, c):
+    """Inserts or updates a single school record in the flattened schema."""
+    row = build_school_row(s, b, c)
+    if row:
+        flush_school_batch(conn, [row])
+
+# Hierarchical Checkpoints (discovery_checkpoints)
+# -------------------------------------------------------------------------
+# A node (district/block/cluster) is checkpointed only once all of its children
+# were fetched successfully. Nodes checkpointed within the freshness window are
+# skipped, so a restart resumes where it stopped and a periodic refresh only
+# re-walks the stale part of the tree.
+DEFAULT_FRESH_HOURS = 24
+
+def load_checkpoints(conn, state_id, fresh_hours):
+    """Returns {(node_level, node_id)} completed within the last `fresh_hours`."""
+    if not fresh_hours: return set()
+    cursor = conn.cursor()
     try:
         cursor.execute("""
-            INSERT INTO schools_udise_data (
-                school_id, year_id, effective_year, udise_code, school_name, school_status, status_name, last_modified,
-                state_id, state_cd, state_name,
-                district_id, district_cd, district_name,
-                block_id, block_cd, block_name,
-                cluster_id, cluster_cd, cluster_name,
-                village_id, vill_ward_cd, village_name,
-                pincode, address, email,
-                lgd_state_id, lgd_district_id, lgd_block_id, lgd_village_id, lgd_vill_name,
-                lgd_panchayat_id, lgd_vill_panchayat_name,
-                sch_loc_rural_urban, sch_loc_desc,
-                sch_category_id, sch_cat_desc,
-                sch_type, sch_type_desc,
-                sch_mgmt_id, sch_mgmt_desc,
-                sch_mgmt_parent_id, sch_mgmt_desc_st,
-                sch_broad_mgmt_id, class_frm, class_to,
-                is_operational_2018_to_19, is_operational_2019_to_20, is_operational_2020_to_21, is_operational_2021_to_22, is_operational_2022_to_23,
-                scrape_status
-            ) VALUES (
-                %s, %s, NULL, %s, %s, %s, %s, %s,
-                %s, %s, %s,
-                %s, %s, %s,
-                %s, %s, %s,
-                %s, %s, %s,
-                %s, %s, %s,
-                %s, %s, %s,
-                %s, %s, %s, %s, %s,
-                %s, %s,
-                %s, %s,
-                %s, %s,
-                %s, %s,
-                %s, %s,
-                %s, %s,
-                %s, %s, %s,
-                %s, %s, %s, %s, %s,
-                %s
-            )
-            ON CONFLICT (school_id, year_id) DO UPDATE SET
-                effective_year = CASE 
-                    WHEN schools_udise_data.effective_year IS NULL THEN EXCLUDED.effective_year 
-                    ELSE schools_udise_data.effective_year 
-                END,
-                udise_code = EXCLUDED.udise_code,
-                school_name = EXCLUDED.school_name,
-                school_status = EXCLUDED.school_status,
-                status_name = EXCLUDED.status_name,
-                last_modified = EXCLUDED.last_modified,
-                is_operational_2018_to_19 = EXCLUDED.is_operational_2018_to_19,
-                is_operational_2019_to_20 = EXCLUDED.is_operational_2019_to_20,
-                is_operational_2020_to_21 = EXCLUDED.is_operational_2020_to_21,
-                is_operational_2021_to_22 = EXCLUDED.is_operational_2021_to_22,
-                is_operational_2022_to_23 = EXCLUDED.is_operational_2022_to_23,
-                scrape_status = CASE 
-                    WHEN schools_udise_data.scrape_status = 'success' THEN 'success' 
-                    ELSE EXCLUDED.scrape_status 
-                END;
-        """, (
-            s.get("schoolId"), CURRENT_YEAR_ID, udise_code, s.get("schoolName"), school_status, status_name, s.get("lastmodifiedTime"),
-            s.get("stateId"), s.get("stateCd"), s.get("stateName"),
-            s.get("districtId"), s.get("districtCd"), s.get("districtName"),
-            s.get("blockId"), s.get("blockCd"), b['blockName'],  # Use blockName from hierarchy loop
-            s.get("clusterId"), s.get("clusterCd"), c['clusterName'], # Use clusterName from hierarchy loop
-            s.get("villageId"), s.get("villWardCd"), s.get("villageName"),
-            s.get("pincode"), s.get("address"), s.get("email"),
-            s.get("lgdStateId"), s.get("lgdDistrictCd"), s.get("lgdBlockId"), s.get("lgdvillageId"), s.get("lgdvillName"),
-            s.get("lgdpanchayatId"), s.get("lgdvillpanchayatName"),
-            s.get("schLocRuralUrban"), s.get("schLocDesc"),
-            s.get("schCategoryId"), s.get("schCatDesc"),
-            s.get("schType"), s.get("schTypeDesc"),
-            s.get("schMgmtId"), s.get("schMgmtDesc"),
-            s.get("schmgmtParentId"), s.get("schMgmtDescSt"),
-            s.get("schBroadMgmtId"), s.get("classFrm"), s.get("classTo"),
-            s.get("isOperational2018To19"), s.get("isOperational2019To20"), s.get("isOperational2020To21"), s.get("isOperational2021To22"), s.get("isOperational2022To23"),
-            scrape_status
-        ))
+            SELECT node_level, node_id FROM discovery_checkpoints
+            WHERE state_id = %s AND completed_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+        """, (state_id, fresh_hours))
+        return set(cursor.fetchall())
+    finally:
+        cursor.close()
+
+def save_checkpoints(conn, state_id, nodes):
+    """Records completed nodes: [(node_level, node_id, parent_id, school_count)]."""
+    if not nodes: return
+    cursor = conn.cursor()
+    try:
+        execute_values(cursor, """
+            INSERT INTO discovery_checkpoints (state_id, node_level, node_id, parent_id, school_count)
+            VALUES %s
+            ON CONFLICT (node_level, node_id) DO UPDATE SET
+                parent_id = EXCLUDED.parent_id,
+                school_count = EXCLUDED.school_count,
+                completed_at = CURRENT_TIMESTAMP;
+        """, [(state_id,) + n for n in nodes])
         conn.commit()
     except Exception as e:
         conn.rollback()
-        logger.error(f"  ! SQL Error for {udise_code}: {e}")
+        logger.error(f"  ! Checkpoint write failed: {e}")
     finally:
         cursor.close()
 
-def scan_state(state_name):
+def scan_state(state_name, fresh_hours=DEFAULT_FRESH_HOURS):
     state_id = STATES.get(state_name.upper())
     if not state_id:
         logger.error(f"Invalid state: {state_name}")
         return
 
-    logger.info(f"--- BEGINNING DISCOVERY SCAN: {state_name} ---")
+    logger.info(f"--- BEGINNING DISCOVERY SCAN: {state_name} (Freshness: {fresh_hours}h) ---")
     conn = get_db_connection()
+    done = load_checkpoints(conn, state_id, fresh_hours)
+    if done: logger.info(f"  Resuming: {len(done)} nodes checkpointed within {fresh_hours}h will be skipped")
     
     # 1. Get Districts
     districts = fetch_json(DISTRICTS_API, {"stateId": state_id, "yearId": 0})
@@ -180,22 +261,29 @@ def scan_state(state_name):
 
     for d in districts:
         d_id = d['districtId']
+        if ("district", d_id) in done: continue
         logger.info(f"District: {d['districtName']} (ID: {d_id})")
         
         # 2. Get Blocks
         blocks = fetch_json(BLOCKS_API, {"districtId": d_id, "yearId": 0})
-        if not blocks: continue
+        if blocks is None: continue
+        district_complete = True
         
         for b in blocks:
             b_id = b['blockId']
+            if ("block", b_id) in done: continue
             logger.info(f"  Block: {b['blockName']} (ID: {b_id})")
             
             # 3. Get Clusters
             clusters = fetch_json(CLUSTERS_API, {"blockId": b_id, "yearId": 0})
-            if not clusters: continue
+            if clusters is None:
+                district_complete = False
+                continue
             
+            block_rows, completed, block_complete = [], [], True
             for c in clusters:
                 c_id = c['clusterId']
+                if ("cluster", c_id) in done: continue
                 # logger.info(f"    Cluster: {c['clusterName']} (ID: {c_id})")
                 
                 # 4. Get Schools by Region
@@ -204,22 +292,164 @@ def scan_state(state_name):
                     "villageId": "", "categoryId": "", "managementId": ""
                 }
                 data = fetch_json(REGIONAL_URL, params)
-                schools = data.get("content", []) if data else []
+                if data is None:
+                    block_complete = False
+                    continue
+                schools = data.get("content", [])
                 
                 if schools:
                     logger.info(f"      ✓ Cluster {c['clusterName']}: Found {len(schools)} schools")
-                    for s in schools:
-                        upsert_school(conn, s, d, b, c)
-                
-                time.sleep(0.05) # Polite delay
+                    block_rows.extend(r for r in (build_school_row(s, b, c) for s in schools) if r)
+                completed.append(("cluster", c_id, b_id, len(schools)))
+            
+            # 5. Flush the block's schools in one set-based upsert, then checkpoint
+            written = flush_school_batch(conn, block_rows)
+            expected = unique_school_count(block_rows)
+            if block_rows:
+                logger.info(f"  ✓ Block {b['blockName']}: Upserted {written}/{expected} schools")
+            if written < expected:
+                # Rejected rows: leave the block and its clusters unchecked so the next scan retries them
+                logger.warning(f"  ! Block {b['blockName']}: {expected - written} schools not written; not checkpointing")
+                completed, block_complete = [], False
+            if block_complete:
+                completed.append(("block", b_id, d_id, None))
+            else:
+                district_complete = False
+            save_checkpoints(conn, state_id, completed)
+        
+        if district_complete:
+            save_checkpoints(conn, state_id, [("district", d_id, state_id, None)])
     
     conn.close()
     logger.info(f"--- COMPLETED DISCOVERY SCAN: {state_name} ---")
 
+def refresh_crosswalk():
+    """Maps new or changed schools to LGD village/district codes (lgd_crosswalk)."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT refresh_lgd_crosswalk('udise_school')")
+            logger.info(f"  ✓ LGD crosswalk: {cur.fetchone()[0]} school rows resolved")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"  ! LGD crosswalk refresh failed: {e}")
+    finally:
+        conn.close()
+
+async def fetch_json_async(url, params, sem, retries=3):
+    """Async twin of fetch_json: same retries, gated by the concurrency cap (pacing is in api_session)."""
+    for i in range(retries):
+        async with sem:
+            try:
+                resp = await asyncio.to_thread(api_session.get, url, params=params)
+                if resp.status_code == 200:
+                    return resp.json().get("data")
+                if api_session.is_replay(): return None
+                logger.warning(f"  ! API Error {resp.status_code} at {url} (Retry {i+1})")
+            except Exception as e:
+                logger.warning(f"  ! Request failed: {e} (Retry {i+1})")
+        await asyncio.sleep(1)
+    return None
+
+async def db_call(db_lock, fn, conn, *args):
+    """Runs a blocking DB helper on a worker thread; the lock keeps one statement stream on the shared connection."""
+    async with db_lock:
+        return await asyncio.to_thread(fn, conn, *args)
+
+# Async scan_* coroutines return True when their subtree completed (and was checkpointed).
+async def scan_cluster_async(conn, db_lock, state_id, d, b, c, sem, done):
+    if ("cluster", c['clusterId']) in done: return True
+    params = {
+        "stateId": state_id, "districtId": d['districtId'], "blockId": b['blockId'], "clusterId": c['clusterId'],
+        "villageId": "", "categoryId": "", "managementId": ""
+    }
+    data = await fetch_json_async(REGIONAL_URL, params, sem)
+    if data is None: return False
+    schools = data.get("content", [])
+
+    if schools:
+        logger.info(f"      ✓ Cluster {c['clusterName']}: Found {len(schools)} schools")
+        # DB writes run off the event loop (fetches keep flowing), one at a time on the shared connection
+        rows = [r for r in (build_school_row(s, b, c) for s in schools) if r]
+        if await db_call(db_lock, flush_school_batch, conn, rows) < unique_school_count(rows):
+            logger.warning(f"  ! Cluster {c['clusterName']}: some schools not written; not checkpointing")
+            return False
+    await db_call(db_lock, save_checkpoints, conn, state_id, [("cluster", c['clusterId'], b['blockId'], len(schools))])
+    return True
+
+async def scan_block_async(conn, db_lock, state_id, d, b, sem, done):
+    if ("block", b['blockId']) in done: return True
+    logger.info(f"  Block: {b['blockName']} (ID: {b['blockId']})")
+    clusters = await fetch_json_async(CLUSTERS_API, {"blockId": b['blockId'], "yearId": 0}, sem)
+    if clusters is None: return False
+    results = await asyncio.gather(*(scan_cluster_async(conn, db_lock, state_id, d, b, c, sem, done) for c in clusters))
+    if all(results): await db_call(db_lock, save_checkpoints, conn, state_id, [("block", b['blockId'], d['districtId'], None)])
+    return all(results)
+
+async def scan_district_async(conn, db_lock, state_id, d, sem, done):
+    if ("district", d['districtId']) in done: return True
+    logger.info(f"District: {d['districtName']} (ID: {d['districtId']})")
+    blocks = await fetch_json_async(BLOCKS_API, {"districtId": d['districtId'], "yearId": 0}, sem)
+    if blocks is None: return False
+    results = await asyncio.gather(*(scan_block_async(conn, db_lock, state_id, d, b, sem, done) for b in blocks))
+    if all(results): await db_call(db_lock, save_checkpoints, conn, state_id, [("district", d['districtId'], state_id, None)])
+    return all(results)
+
+async def scan_state_async(state_name, concurrency=DEFAULT_CONCURRENCY, fresh_hours=DEFAULT_FRESH_HOURS):
+    """
+    Concurrent Discovery Crawl:
+    Fans out across districts, blocks and clusters. In-flight requests are capped
+    by `concurrency`; request rate is paced by the shared AIMD controller in api_session.
+    Subtrees checkpointed within `fresh_hours` are skipped.
+    """
+    state_id = STATES.get(state_name.upper())
+    if not state_id:
+        logger.error(f"Invalid state: {state_name}")
+        return
+
+    logger.info(f"--- BEGINNING ASYNC DISCOVERY SCAN: {state_name} (Concurrency: {concurrency}, Freshness: {fresh_hours}h) ---")
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    api_session.configure(concurrency)
+    sem = asyncio.Semaphore(concurrency)
+    db_lock = asyncio.Lock()
+    conn = get_db_connection()
+
+    try:
+        done = load_checkpoints(conn, state_id, fresh_hours)
+        if done: logger.info(f"  Resuming: {len(done)} nodes checkpointed within {fresh_hours}h will be skipped")
+        districts = await fetch_json_async(DISTRICTS_API, {"stateId": state_id, "yearId": 0}, sem)
+        if not districts: return
+        await asyncio.gather(*(scan_district_async(conn, db_lock, state_id, d, sem, done) for d in districts))
+    finally:
+        conn.close()
+    logger.info(f"--- COMPLETED ASYNC DISCOVERY SCAN: {state_name} ---")
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--state", required=True)
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="Concurrent crawl across blocks/clusters")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Max in-flight requests (--async)")
+    parser.add_argument("--rps", type=float, default=DEFAULT_RPS, help="Starting global requests/sec (adaptive)")
+    parser.add_argument("--max-rps", type=float, default=DEFAULT_MAX_RPS, help="Ceiling for the adaptive request rate")
+    parser.add_argument("--replay", action="store_true", help="Rebuild from the local raw-response store (no network)")
+    parser.add_argument("--replay-as-of", default=None, help="Replay responses fetched on/before this date (YYYY-MM-DD)")
+    parser.add_argument("--no-store", action="store_true", help="Do not record raw responses")
+    parser.add_argument("--fresh-hours", type=float, default=DEFAULT_FRESH_HOURS, help="Skip nodes checkpointed within this window")
+    parser.add_argument("--full", action="store_true", help="Ignore checkpoints and rescan the whole state")
     args = parser.parse_args()
     
-    scan_state(args.state)
+    if args.replay:
+        api_session.set_store_mode("replay", args.replay_as_of)
+    elif not args.no_store:
+        api_session.set_store_mode("record")
+    
+    api_session.configure_rate(UDISE_BASE, args.rps, args.max_rps)
+    fresh_hours = 0 if args.full else args.fresh_hours
+    if args.async_mode:
+        asyncio.run(scan_state_async(args.state, args.concurrency, fresh_hours))
+    else:
+        scan_state(args.state, fresh_hours)
+    refresh_crosswalk()
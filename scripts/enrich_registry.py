@@ -1,25 +1,34 @@
 #!/usr/bin/env python3
 import os
 import json
+import socket
 import time
-import requests
 import psycopg2
 import logging
-import random
+import threading
 import traceback
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
+import api_session
 from psycopg2 import pool
+from psycopg2.extras import execute_values
 
 # Path Configuration
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 load_dotenv(os.path.join(BASE_DIR, ".env"))
 DB_URL = os.getenv("DATABASE_URL")
-DB_POOL = pool.SimpleConnectionPool(1, 20, DB_URL)
+DB_POOL_MAX = 20
+DB_POOL = pool.ThreadedConnectionPool(1, DB_POOL_MAX, DB_URL)
 CURRENT_YEAR_ID = 12
 FALLBACK_YEAR_ID = 11
 
+# Worker Pool Defaults (mine_state)
+DEFAULT_WORKERS = 4    # Schools in flight at once
+DEFAULT_RPS = 4.0      # Starting API requests/sec shared by every worker and fragment thread (AIMD-adjusted)
+DEFAULT_MAX_RPS = 20.0 # Ceiling the adaptive controller may climb to
+FRAGMENT_THREADS = 8   # Parallel fragment fetches per school
+
 # API Endpoints
 UDISE_BASE = "https://kys.udiseplus.gov.in/webapp/api"
 ENDPOINTS = {
@@ -34,6 +43,16 @@ ENDPOINTS = {
     "social_5": f"{UDISE_BASE}/getSocialData",  # RTE
 }
 
+# Replay-only fetch result: the raw store has no copy. Not evidence about the server, so it
+# never produces missing_on_server/partial and never overwrites a stored manifest entry.
+NOT_IN_STORE = "not_in_store"
+
+# Fragment Key -> school_fragments.fragment (the blob's former schools_udise_data column name)
+BLOB_COLUMNS = {
+    "basic_info": "basic_info", "report_card": "report_card", "facility_data": "facility_data", "profile_data": "profile_data",
+    "social_1": "enrollment_social", "social_2": "enrollment_religion", "social_3": "enrollment_mainstreamed", "social_4": "enrollment_ews", "social_5": "enrollment_rte"
+}
+
 # Logger Setup
 logging.basicConfig(
     level=logging.INFO,
@@ -54,8 +73,8 @@ def put_db_connection(conn):
 def get_json(resp, url):
     """Refined JSON loader. strictly requires status: true."""
     if resp.status_code == 503:
-        logger.warning(f"  ! 503 Service Unavailable at {url}. Emergency Pause (60s)...")
-        time.sleep(60)
+        # The shared AIMD controller (api_session) has already slowed and paused every caller
+        logger.warning(f"  ! 503 Service Unavailable at {url}. Backing off globally...")
         return 'RETRY'
         
     if resp.status_code != 200: 
@@ -68,24 +87,24 @@ def get_json(resp, url):
     except:
         return None
 
-def fetch_9_blobs(school_id, udise_code):
+def fetch_9_blobs(school_id, udise_code, blobs=None):
     """
     Discovery-Driven Fetch:
     1. Calls 'by_year' first to find the Effective Year for this school.
     2. Fetches all other 8 fragments for that specific Year.
+    If `blobs` is a dict, fragments are collected into it (keyed by column)
+    instead of being written to the DB one UPDATE at a time.
     """
-    session = requests.Session()
-    session.headers.update({
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    })
-
     def try_fetch_internal(url, current_params):
         for attempt in range(2):
             try:
-                resp = session.get(url, params=current_params, timeout=15)
+                resp = api_session.get(url, params=current_params)
                 res = get_json(resp, url)
-                if res == 'RETRY': return 503, None
+                if res == 'RETRY':
+                    if attempt == 1: return 503, None
+                    continue # Next attempt waits out the global pause
                 if res: return 200, res
+                if api_session.is_replay(): return NOT_IN_STORE, None
             except:
                 pass
             time.sleep(1)
@@ -104,19 +123,23 @@ def fetch_9_blobs(school_id, udise_code):
         if code == 200:
             effective_year = FALLBACK_YEAR_ID
             logger.info(f"  ✓ Fallback Success: Using Year {FALLBACK_YEAR_ID} for {udise_code}")
+        elif code == NOT_IN_STORE:
+            logger.info(f"  - {udise_code} not in raw store; leaving it unchanged.")
+            return CURRENT_YEAR_ID, {NOT_IN_STORE: True}
         else:
             logger.warning(f"  ! MISSING_ON_SERVER: {udise_code} has no data sessions.")
             return CURRENT_YEAR_ID, {"basic_info": 404, "is_missing_on_server": True}
 
     logger.info(f"  > Target Effective Year for {udise_code}: {effective_year}")
     
-    # LOCK-IN: Stamp metadata early to ensure row integrity
-    conn = get_db_connection() ; cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE schools_udise_data SET effective_year = %s WHERE school_id = %s", (effective_year, school_id))
-        conn.commit()
-    finally:
-        cursor.close() ; put_db_connection(conn)
+    # LOCK-IN: Stamp metadata early to ensure row integrity (single-write mode stamps it with everything else)
+    if blobs is None:
+        conn = get_db_connection() ; cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE schools_udise_data SET effective_year = %s WHERE school_id = %s", (effective_year, school_id))
+            conn.commit()
+        finally:
+            cursor.close() ; put_db_connection(conn)
 
     # Initialize manifest and save primary blob
     manifest = {"basic_info": 200}
@@ -126,7 +149,12 @@ def fetch_9_blobs(school_id, udise_code):
          code, res = try_fetch_internal(ENDPOINTS["by_year"], {"schoolId": school_id, "action": 2}) # Refresh for year if needed (though by_year is year-less)
          # Actually basic_info in manifest usually maps to by_year result.
     
-    save_intermediate_blob(school_id, "basic_info", res if res else {}, manifest)
+    if code == NOT_IN_STORE:
+        manifest["basic_info"] = NOT_IN_STORE # Keep the stored basic_info rather than blanking it
+    elif blobs is None:
+        save_intermediate_blob(school_id, "basic_info", res if res else {}, manifest, effective_year)
+    else:
+        blobs["basic_info"] = res if res else {}
 
     # STEP 2: Fragment Extraction (Parallel)
     # -------------------------------------------------------------------------
@@ -142,44 +170,61 @@ def fetch_9_blobs(school_id, udise_code):
     ]
 
     def fetch_single_fragment(key, url, params):
-        # Micro-jitter to stagger requests
-        time.sleep(random.uniform(0.1, 0.5))
+        # Pacing is handled by the shared AIMD controller in api_session
         code, data = try_fetch_internal(url, params)
         return key, code, data
 
-    with ThreadPoolExecutor(max_workers=8) as executor:
+    with ThreadPoolExecutor(max_workers=FRAGMENT_THREADS) as executor:
         futures = [executor.submit(fetch_single_fragment, k, u, p) for k, u, p in endpoints_to_fetch]
         for f in as_completed(futures):
             key, code, data = f.result()
             manifest[key] = code
-            if code == 200 and data:
-                save_intermediate_blob(school_id, key, data, manifest)
+            if blobs is not None:
+                if code == 200 and data: blobs[BLOB_COLUMNS[key]] = data
+            elif code == 200 and data:
+                save_intermediate_blob(school_id, key, data, manifest, effective_year)
             else:
                 save_manifest_only(school_id, manifest)
 
     return effective_year, manifest
 
+# Fetched entries replace stored ones; entries absent from this fetch (replay store misses) are kept
+MERGE_MANIFEST = "COALESCE(enrichment_manifest, '{}'::jsonb) || %s::jsonb"
+
+def stored_manifest(manifest):
+    return json.dumps({k: v for k, v in manifest.items() if v != NOT_IN_STORE})
+
+def has_replay_gaps(manifest):
+    """True when replay lacked some fragment, so the school's status cannot be judged from this run."""
+    return NOT_IN_STORE in manifest.values()
+
 def save_manifest_only(school_id, manifest):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
         # Year-Agnostic update: Primary identity is school_id
-        cursor.execute("UPDATE schools_udise_data SET enrichment_manifest = %s WHERE school_id = %s", (json.dumps(manifest), school_id))
+        cursor.execute(f"UPDATE schools_udise_data SET enrichment_manifest = {MERGE_MANIFEST} WHERE school_id = %s", (stored_manifest(manifest), school_id))
         conn.commit()
     finally:
         cursor.close() ; put_db_connection(conn)
 
-def save_intermediate_blob(school_id, key, blob, manifest):
-    column_map = {
-        "basic_info": "basic_info", "report_card": "report_card", "facility_data": "facility_data", "profile_data": "profile_data",
-        "social_1": "enrollment_social", "social_2": "enrollment_religion", "social_3": "enrollment_mainstreamed", "social_4": "enrollment_ews", "social_5": "enrollment_rte"
-    }
-    col = column_map.get(key)
+# Raw blobs live in the per-fragment table, keyed by the year they were fetched for
+UPSERT_FRAGMENTS_SQL = """
+    INSERT INTO school_fragments (school_id, year_id, fragment, payload) VALUES %s
+    ON CONFLICT (school_id, year_id, fragment) DO UPDATE SET
+        payload = EXCLUDED.payload,
+        fetched_at = CURRENT_TIMESTAMP
+"""
+UPSERT_FRAGMENTS_TEMPLATE = "(%s::INTEGER, %s::INTEGER, %s, %s::JSONB)"
+
+def save_intermediate_blob(school_id, key, blob, manifest, year_id):
+    col = BLOB_COLUMNS.get(key)
     if not col: return
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute(f"UPDATE schools_udise_data SET {col} = %s, enrichment_manifest = %s, last_modified = CURRENT_TIMESTAMP WHERE school_id = %s", (json.dumps(blob), json.dumps(manifest), school_id))
+        execute_values(cursor, UPSERT_FRAGMENTS_SQL, [(school_id, year_id, col, json.dumps(blob))], template=UPSERT_FRAGMENTS_TEMPLATE)
+        cursor.execute(f"UPDATE schools_udise_data SET enrichment_manifest = {MERGE_MANIFEST}, last_modified = CURRENT_TIMESTAMP WHERE school_id = %s", (stored_manifest(manifest), school_id))
         conn.commit()
     finally:
         cursor.close() ; put_db_connection(conn)
@@ -241,9 +286,99 @@ def extract_summary(data):
         })
     return summary
 
-def process_school(school_id, udise_code):
+# Single-Write Persistence
+# -------------------------------------------------------------------------
+# One VALUES row per school (plus its fetched fragments, upserted in the same transaction).
+# Blobs missing from this scrape keep their stored value; summary columns
+# (column, SQL type, extract_summary key) only apply when has_summary is set.
+SUMMARY_COLUMNS = [
+    ("total_students", "INTEGER", "total_students"), ("total_boys", "INTEGER", "total_boys"),
+    ("total_girls", "INTEGER", "total_girls"), ("total_teachers", "INTEGER", "total_teachers"),
+    ("has_internet", "BOOLEAN", "has_internet"), ("has_library", "BOOLEAN", "has_library"),
+    ("has_playground", "BOOLEAN", "has_playground"), ("has_electricity", "BOOLEAN", "has_electricity"),
+    ("lgd_urban_local_body_id", "VARCHAR", "lgd_urban_body_id"), ("lgd_urban_local_body_name", "VARCHAR", "lgd_urban_body_name"),
+    ("lgd_ward_id", "VARCHAR", "lgd_ward_id"), ("lgd_ward_name", "VARCHAR", "lgd_ward_name"),
+]
+SINGLE_WRITE_COLUMNS = (
+    [("school_id", "INTEGER"), ("effective_year", "INTEGER"), ("has_summary", "BOOLEAN"),
+     ("scrape_status", "VARCHAR"), ("enrichment_manifest", "JSONB")]
+    + [(col, sql_type) for col, sql_type, _ in SUMMARY_COLUMNS]
+)
+SINGLE_WRITE_SQL = """
+    UPDATE schools_udise_data s SET
+        effective_year = COALESCE(v.effective_year, s.effective_year),
+        year_id = CASE WHEN v.has_summary THEN v.effective_year ELSE s.year_id END,
+        enrichment_manifest = COALESCE(s.enrichment_manifest, '{{}}'::jsonb) || COALESCE(v.enrichment_manifest, '{{}}'::jsonb),
+        {summary_sets},
+        scrape_status = COALESCE(v.scrape_status, s.scrape_status),
+        last_modified = CASE WHEN v.has_summary THEN CURRENT_TIMESTAMP ELSE s.last_modified END,
+        last_scraped_at = CURRENT_TIMESTAMP
+    FROM (VALUES %s) AS v ({columns})
+    WHERE s.school_id = v.school_id
+""".format(
+    summary_sets=",\n        ".join(f"{c} = CASE WHEN v.has_summary THEN v.{c} ELSE s.{c} END" for c, _, _ in SUMMARY_COLUMNS),
+    columns=", ".join(c for c, _ in SINGLE_WRITE_COLUMNS),
+)
+SINGLE_WRITE_TEMPLATE = "(" + ", ".join(f"%s::{t}" for _, t in SINGLE_WRITE_COLUMNS) + ")"
+
+def collect_school(school_id, udise_code):
+    """Fetches every fragment into memory and returns a single-write result row (summary from the in-memory blobs)."""
+    blobs = {}
+    effective_year, manifest = fetch_9_blobs(school_id, udise_code, blobs)
+    if manifest.get(NOT_IN_STORE):
+        return None # Nothing replayable; leave the school as it is
+    row = dict.fromkeys(c for c, _ in SINGLE_WRITE_COLUMNS)
+    row.update({"school_id": school_id, "blobs": {}})
+
+    if manifest.get("is_missing_on_server"):
+        row.update({"has_summary": False, "scrape_status": "missing_on_server"})
+        return row
+
+    row.update({"effective_year": effective_year, "enrichment_manifest": stored_manifest(manifest), "blobs": blobs})
+    if has_replay_gaps(manifest):
+        # Save what was replayed; an in-memory summary would clobber the stored one with -1s
+        row.update({"has_summary": False, "scrape_status": None})
+        return row
+
+    summary = extract_summary(blobs)
+    row.update({
+        "has_summary": True,
+        "scrape_status": "success" if manifest.get("profile_data") == 200 and manifest.get("report_card") == 200 else "partial",
+    })
+    for col, _, key in SUMMARY_COLUMNS:
+        row[col] = summary[key]
+    return row
+
+def persist_school_results(results):
+    """Writes a batch of collect_school rows (fragments + one UPDATE statement) in one transaction."""
+    if not results: return
+    fragments = [(r["school_id"], r["effective_year"], col, json.dumps(blob))
+                 for r in results for col, blob in r["blobs"].items()]
+    conn = get_db_connection() ; cursor = conn.cursor()
+    try:
+        if fragments:
+            execute_values(cursor, UPSERT_FRAGMENTS_SQL, fragments, template=UPSERT_FRAGMENTS_TEMPLATE, page_size=len(fragments))
+        execute_values(cursor, SINGLE_WRITE_SQL,
+                       [tuple(r[c] for c, _ in SINGLE_WRITE_COLUMNS) for r in results],
+                       template=SINGLE_WRITE_TEMPLATE, page_size=len(results))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close() ; put_db_connection(conn)
+
+def process_school(school_id, udise_code, single_write=False):
+    if single_write:
+        row = collect_school(school_id, udise_code)
+        if row is None: return 'skipped'
+        persist_school_results([row])
+        return 'missing' if row["scrape_status"] == "missing_on_server" else 'done'
+
     effective_year, manifest = fetch_9_blobs(school_id, udise_code)
-    
+    if manifest.get(NOT_IN_STORE):
+        return 'skipped'
+
     # Check for terminal "Missing on Server" state
     if manifest.get("is_missing_on_server"):
         conn = get_db_connection() ; cursor = conn.cursor()
@@ -256,18 +391,16 @@ def process_school(school_id, udise_code):
 
     conn = get_db_connection()
     cursor = conn.cursor()
-    # Query by school_id only (found row)
-    cursor.execute("SELECT report_card, facility_data, profile_data, enrollment_social FROM schools_udise_data WHERE school_id = %s", (school_id,))
-    row = cursor.fetchone()
+    # Fragments saved above for this school's effective year
+    cursor.execute("""
+        SELECT fragment, payload FROM school_fragments
+        WHERE school_id = %s AND year_id = %s AND fragment IN ('report_card', 'facility_data', 'profile_data', 'enrollment_social')
+    """, (school_id, effective_year))
+    row = dict(cursor.fetchall())
     cursor.close() ; put_db_connection(conn)
     
     if row:
-        summary = extract_summary({
-            "report_card": row[0], 
-            "facility_data": row[1], 
-            "profile_data": row[2],
-            "enrollment_social": row[3]
-        })
+        summary = extract_summary(row)
         conn = get_db_connection() ; cursor = conn.cursor()
         try:
             cursor.execute("""
@@ -276,7 +409,7 @@ def process_school(school_id, udise_code):
                     total_students = %s, total_boys = %s, total_girls = %s, total_teachers = %s,
                     has_internet = %s, has_library = %s, has_playground = %s, has_electricity = %s,
                     lgd_urban_local_body_id = %s, lgd_urban_local_body_name = %s, lgd_ward_id = %s, lgd_ward_name = %s,
-                    scrape_status = CASE WHEN %s = 200 AND %s = 200 THEN 'success' ELSE 'partial' END,
+                    scrape_status = CASE WHEN %s THEN scrape_status WHEN %s = 200 AND %s = 200 THEN 'success' ELSE 'partial' END,
                     last_scraped_at = CURRENT_TIMESTAMP
                 WHERE school_id = %s
             """, (
@@ -284,37 +417,305 @@ def process_school(school_id, udise_code):
                 summary["total_students"], summary["total_boys"], summary["total_girls"], summary["total_teachers"],
                 summary["has_internet"], summary["has_library"], summary["has_playground"], summary["has_electricity"],
                 summary["lgd_urban_body_id"], summary["lgd_urban_body_name"], summary["lgd_ward_id"], summary["lgd_ward_name"],
-                manifest.get("profile_data"), manifest.get("report_card"), school_id
+                has_replay_gaps(manifest), manifest.get("profile_data"), manifest.get("report_card"), school_id
             ))
             conn.commit()
         finally:
             cursor.close() ; put_db_connection(conn)
     return 'done'
 
-def mine_state(state_name, mode='normal', limit=None):
-    logger.info(f"--- STARTING MISSION: {state_name} (Mode: {mode}) ---")
+# Target Selection per Mode: (WHERE clause, ORDER BY)
+TARGET_QUERIES = {
+    # Full Re-derivation (e.g. --replay): every school still open in the registry
+    "all": ("state_name = %s AND scrape_status <> 'closed_registry'", "udise_code ASC"),
+    # Broad Recovery Query: Target all non-closed schools where recovery hasn't run yet
+    "recovery": ("state_name = %s AND scrape_status IN ('pending', 'partial', 'success') AND effective_year IS NULL", "scrape_status ASC, udise_code ASC"),
+    "normal": ("state_name = %s AND (scrape_status = 'pending' OR scrape_status = 'partial')", "scrape_status DESC, udise_code ASC"),
+}
+
+def mine_state(state_name, mode='normal', limit=None, workers=DEFAULT_WORKERS, rps=DEFAULT_RPS,
+               single_write=False, write_batch=1, max_rps=DEFAULT_MAX_RPS):
+    """
+    Cross-School Worker Pool:
+    Keeps `workers` schools in flight at once. All API calls (across schools and
+    their fragment threads) are paced by one shared AIMD controller that starts
+    at `rps` and adapts between back-off and `max_rps`.
+    With `single_write`, each school is persisted in one statement; results are
+    buffered and flushed `write_batch` schools per transaction.
+    """
+    workers = max(1, min(workers, DB_POOL_MAX - 1))
+    write_batch = max(1, write_batch)
+    api_session.configure_rate(UDISE_BASE, rps, max_rps)
+    api_session.configure(workers * FRAGMENT_THREADS)
+    logger.info(f"--- STARTING MISSION: {state_name} (Mode: {mode}, Workers: {workers}, RPS: {rps}, Single-Write: {single_write}) ---")
     conn = get_db_connection() ; cursor = conn.cursor()
     
-    if mode == 'recovery':
-        # Broad Recovery Query: Target all non-closed schools where recovery hasn't run yet
-        query = "SELECT school_id, udise_code FROM schools_udise_data WHERE state_name = %s AND scrape_status IN ('pending', 'partial', 'success') AND effective_year IS NULL ORDER BY scrape_status ASC, udise_code ASC"
-    else:
-        query = "SELECT school_id, udise_code FROM schools_udise_data WHERE state_name = %s AND (scrape_status = 'pending' OR scrape_status = 'partial') ORDER BY scrape_status DESC, udise_code ASC"
+    where, order = TARGET_QUERIES.get(mode, TARGET_QUERIES["normal"])
+    query = f"SELECT school_id, udise_code FROM schools_udise_data WHERE {where} ORDER BY {order}"
     
     if limit: query += f" LIMIT {limit}"
     cursor.execute(query, (state_name,))
     schools = cursor.fetchall()
     cursor.close() ; put_db_connection(conn)
     total = len(schools)
-    for i, s in enumerate(schools, 1):
+    progress = {"done": 0, "errors": 0}
+    progress_lock = threading.Lock()
+    pending_writes = []
+
+    def work(s):
+        result = None
         try:
-            process_school(s[0], s[1])
-            if i % 10 == 0: logger.info(f"  [{state_name}] Progress: {i}/{total}")
-            time.sleep(random.uniform(1.0, 3.0)) # Optimized Speed (saves ~34h)
+            if single_write and write_batch > 1:
+                result = collect_school(s[0], s[1])
+            else:
+                process_school(s[0], s[1], single_write)
         except Exception as e:
             logger.error(f"  ! Fatal {s[1]}: {e}\n{traceback.format_exc()}")
-            time.sleep(10)
-    logger.info(f"--- COMPLETED: {state_name} ---")
+            with progress_lock: progress["errors"] += 1
+            time.sleep(10) # Back off this worker only
+        with progress_lock:
+            progress["done"] += 1
+            done = progress["done"]
+        if done % 10 == 0: logger.info(f"  [{state_name}] Progress: {done}/{total} (Errors: {progress['errors']})")
+        return result
+
+    def flush_writes():
+        try:
+            persist_school_results(pending_writes)
+        except Exception as e:
+            logger.error(f"  ! Batch write of {len(pending_writes)} schools failed: {e}")
+            with progress_lock: progress["errors"] += len(pending_writes)
+        pending_writes.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for f in as_completed([executor.submit(work, s) for s in schools]):
+            result = f.result()
+            if result:
+                pending_writes.append(result)
+                if len(pending_writes) >= write_batch: flush_writes()
+    flush_writes()
+    logger.info(f"--- COMPLETED: {state_name} (Processed: {progress['done']}, Errors: {progress['errors']}) ---")
+
+# DB-Backed Work Queue (enrichment_queue)
+# -------------------------------------------------------------------------
+# Workers on any machine claim leased batches with FOR UPDATE SKIP LOCKED.
+# Leases are heartbeated while a worker is alive; an expired lease (crashed
+# worker) is reclaimed by others, and completions from a lost lease are ignored.
+DEFAULT_LEASE_MINUTES = 15
+DEFAULT_CLAIM_BATCH = 20
+DEFAULT_MAX_ATTEMPTS = 5
+
+def enqueue_state(state_name, mode='normal', priority=100, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Loads a state's targets into enrichment_queue. Finished entries are re-queued; live leases are left alone."""
+    where, _ = TARGET_QUERIES.get(mode, TARGET_QUERIES["normal"])
+    conn = get_db_connection() ; cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            INSERT INTO enrichment_queue (school_id, udise_code, state_name, priority, max_attempts)
+            SELECT DISTINCT ON (school_id) school_id, udise_code, state_name, %s, %s
+            FROM schools_udise_data WHERE {where}
+            ORDER BY school_id, year_id DESC
+            ON CONFLICT (school_id) DO UPDATE SET
+                status = 'queued', attempts = 0, last_error = NULL,
+                priority = EXCLUDED.priority, max_attempts = EXCLUDED.max_attempts,
+                lease_owner = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE enrichment_queue.status <> 'leased' OR enrichment_queue.lease_expires_at < CURRENT_TIMESTAMP
+        """, (priority, max_attempts, state_name))
+        queued = cursor.rowcount
+        conn.commit()
+    finally:
+        cursor.close() ; put_db_connection(conn)
+    logger.info(f"--- ENQUEUED: {state_name} (Mode: {mode}, Priority: {priority}): {queued} schools ---")
+    return queued
+
+def claim_batch(owner, size, lease_minutes, state_name=None):
+    """Leases up to `size` claimable schools (queued, or leased with an expired lease), highest priority first."""
+    conn = get_db_connection() ; cursor = conn.cursor()
+    try:
+        # Expired leases that have used up their attempts are terminal
+        cursor.execute("""
+            UPDATE enrichment_queue SET status = 'failed', lease_owner = NULL,
+                last_error = COALESCE(last_error, 'lease expired'), updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'leased' AND lease_expires_at < CURRENT_TIMESTAMP AND attempts >= max_attempts
+        """)
+        cursor.execute("""
+            UPDATE enrichment_queue q SET
+                status = 'leased', lease_owner = %s,
+                lease_expires_at = CURRENT_TIMESTAMP + make_interval(mins => %s),
+                attempts = q.attempts + 1, updated_at = CURRENT_TIMESTAMP
+            FROM (
+                SELECT school_id FROM enrichment_queue
+                WHERE (status = 'queued' OR (status = 'leased' AND lease_expires_at < CURRENT_TIMESTAMP))
+                  AND attempts < max_attempts
+                  AND (%s::VARCHAR IS NULL OR state_name = %s)
+                ORDER BY priority DESC, enqueued_at, school_id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) c
+            WHERE q.school_id = c.school_id
+            RETURNING q.school_id, q.udise_code
+        """, (owner, lease_minutes, state_name, state_name, size))
+        rows = cursor.fetchall()
+        conn.commit()
+        return rows
+    finally:
+        cursor.close() ; put_db_connection(conn)
+
+def complete_job(owner, school_id, error=None):
+    """Marks a leased job done (or re-queues/fails it). Returns False if the lease was lost to another worker."""
+    conn = get_db_connection() ; cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE enrichment_queue SET
+                status = CASE WHEN %s IS NULL THEN 'done' WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                last_error = %s, lease_owner = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE school_id = %s AND lease_owner = %s AND status = 'leased'
+        """, (error, error, school_id, owner))
+        conn.commit()
+        return cursor.rowcount == 1
+    finally:
+        cursor.close() ; put_db_connection(conn)
+
+def extend_leases(owner, lease_minutes):
+    conn = get_db_connection() ; cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE enrichment_queue SET lease_expires_at = CURRENT_TIMESTAMP + make_interval(mins => %s)
+            WHERE lease_owner = %s AND status = 'leased'
+        """, (lease_minutes, owner))
+        conn.commit()
+    finally:
+        cursor.close() ; put_db_connection(conn)
+
+def run_queue_worker(state_name=None, workers=DEFAULT_WORKERS, rps=DEFAULT_RPS, max_rps=DEFAULT_MAX_RPS,
+                     single_write=False, claim_size=DEFAULT_CLAIM_BATCH, lease_minutes=DEFAULT_LEASE_MINUTES,
+                     follow=False, poll_s=30):
+    """Drains enrichment_queue until empty (or forever with `follow`). Safe to run many copies on many machines."""
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    workers = max(1, min(workers, DB_POOL_MAX - 2))
+    api_session.configure_rate(UDISE_BASE, rps, max_rps)
+    api_session.configure(workers * FRAGMENT_THREADS)
+    logger.info(f"--- QUEUE WORKER {owner} STARTED (State: {state_name or 'ANY'}, Workers: {workers}) ---")
+
+    stop = threading.Event()
+    def heartbeat():
+        while not stop.wait(lease_minutes * 60 / 3):
+            try:
+                extend_leases(owner, lease_minutes)
+            except Exception as e:
+                logger.warning(f"  ! Lease heartbeat failed: {e}")
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    progress = {"done": 0, "errors": 0}
+    def work(job):
+        school_id, udise_code = job
+        error = None
+        try:
+            process_school(school_id, udise_code, single_write)
+        except Exception as e:
+            logger.error(f"  ! Fatal {udise_code}: {e}\n{traceback.format_exc()}")
+            error = str(e)[:1000]
+        if not complete_job(owner, school_id, error):
+            logger.warning(f"  ! Lease lost for {udise_code}; result left to the current lease holder")
+        return error is None
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                jobs = claim_batch(owner, claim_size, lease_minutes, state_name)
+                if not jobs:
+                    if not follow: break
+                    time.sleep(poll_s)
+                    continue
+                for f in as_completed([executor.submit(work, j) for j in jobs]):
+                    progress["done" if f.result() else "errors"] += 1
+                logger.info(f"  [{owner}] Progress: {progress['done']} done, {progress['errors']} errors")
+    finally:
+        stop.set()
+    logger.info(f"--- QUEUE WORKER {owner} FINISHED (Done: {progress['done']}, Errors: {progress['errors']}) ---")
+
+# Offline Summary Rebuild
+# -------------------------------------------------------------------------
+REBUILD_SQL = """
+    UPDATE schools_udise_data s SET
+        {summary_sets}
+    FROM (VALUES %s) AS v ({columns})
+    WHERE s.school_id = v.school_id AND s.year_id = v.year_id
+""".format(
+    summary_sets=",\n        ".join(f"{c} = v.{c}" for c, _, _ in SUMMARY_COLUMNS),
+    columns=", ".join(["school_id", "year_id"] + [c for c, _, _ in SUMMARY_COLUMNS]),
+)
+REBUILD_TEMPLATE = "(" + ", ".join(["%s::INTEGER", "%s::INTEGER"] + [f"%s::{t}" for _, t, _ in SUMMARY_COLUMNS]) + ")"
+REBUILD_BATCH_SIZE = 2000
+
+def rebuild_summary_range(state_name=None, id_from=None, id_to=None, batch_size=REBUILD_BATCH_SIZE):
+    """
+    Streams stored JSONB through a server-side cursor and rewrites the summary
+    columns with extract_summary, one bulk UPDATE per batch. No network access.
+    Returns the number of rows rewritten.
+    """
+    filters = ["(enrollment_social IS NOT NULL OR report_card IS NOT NULL OR facility_data IS NOT NULL OR profile_data IS NOT NULL)"]
+    params = []
+    if state_name: filters.append("state_name = %s") ; params.append(state_name)
+    if id_from is not None: filters.append("school_id >= %s") ; params.append(id_from)
+    if id_to is not None: filters.append("school_id < %s") ; params.append(id_to)
+
+    read_conn = get_db_connection() ; write_conn = get_db_connection()
+    # Named cursor = server-side: rows arrive batch_size at a time, never fetchall()
+    reader = read_conn.cursor(name=f"rebuild_{threading.get_ident()}")
+    reader.itersize = batch_size
+    writer = write_conn.cursor()
+    rebuilt = 0
+    try:
+        reader.execute(f"""
+            SELECT school_id, year_id, enrollment_social, report_card, facility_data, profile_data
+            FROM schools_udise_data_full WHERE {" AND ".join(filters)}
+            ORDER BY school_id
+        """, params)
+        while True:
+            rows = reader.fetchmany(batch_size)
+            if not rows: break
+            values = []
+            for school_id, year_id, social, rc, fd, pd in rows:
+                summary = extract_summary({"enrollment_social": social, "report_card": rc, "facility_data": fd, "profile_data": pd})
+                values.append((school_id, year_id) + tuple(summary[key] for _, _, key in SUMMARY_COLUMNS))
+            execute_values(writer, REBUILD_SQL, values, template=REBUILD_TEMPLATE, page_size=batch_size)
+            write_conn.commit()
+            rebuilt += len(values)
+            logger.info(f"  [Rebuild {state_name or 'ALL'} {id_from}:{id_to}] {rebuilt} summaries rewritten")
+    except Exception:
+        write_conn.rollback()
+        raise
+    finally:
+        reader.close() ; read_conn.rollback() ; put_db_connection(read_conn)
+        writer.close() ; put_db_connection(write_conn)
+    return rebuilt
+
+def rebuild_summaries(state_name=None, id_from=None, id_to=None, partitions=1, batch_size=REBUILD_BATCH_SIZE):
+    """Rebuilds summaries for a state and/or school_id range, split into `partitions` parallel id slices."""
+    partitions = max(1, min(partitions, DB_POOL_MAX // 2))
+    logger.info(f"--- REBUILDING SUMMARIES: {state_name or 'ALL STATES'} (IDs: {id_from}:{id_to}, Partitions: {partitions}) ---")
+    if partitions > 1 and (id_from is None or id_to is None):
+        conn = get_db_connection() ; cursor = conn.cursor()
+        cursor.execute("SELECT MIN(school_id), MAX(school_id) FROM schools_udise_data WHERE (%s IS NULL OR state_name = %s)", (state_name, state_name))
+        lo, hi = cursor.fetchone()
+        cursor.close() ; put_db_connection(conn)
+        if lo is None:
+            logger.info("--- NOTHING TO REBUILD ---")
+            return 0
+        id_from = lo if id_from is None else id_from
+        id_to = hi + 1 if id_to is None else id_to
+
+    if partitions == 1:
+        total = rebuild_summary_range(state_name, id_from, id_to, batch_size)
+    else:
+        step = max(1, -(-(id_to - id_from) // partitions))
+        slices = [(lo, min(lo + step, id_to)) for lo in range(id_from, id_to, step)]
+        with ThreadPoolExecutor(max_workers=partitions) as executor:
+            futures = [executor.submit(rebuild_summary_range, state_name, lo, hi, batch_size) for lo, hi in slices]
+            total = sum(f.result() for f in as_completed(futures))
+    logger.info(f"--- COMPLETED SUMMARY REBUILD: {total} rows ---")
+    return total
 
 if __name__ == "__main__":
     import argparse
@@ -322,20 +723,50 @@ if __name__ == "__main__":
     p.add_argument("--state", default=None)
     p.add_argument("--limit", type=int, default=None)
     p.add_argument("--udise", default=None)
-    p.add_argument("--mode", default="normal", choices=["normal", "recovery"])
+    p.add_argument("--mode", default="normal", choices=["normal", "recovery", "all"])
+    p.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Schools processed in parallel")
+    p.add_argument("--rps", type=float, default=DEFAULT_RPS, help="Starting global API requests/sec across all workers")
+    p.add_argument("--max-rps", type=float, default=DEFAULT_MAX_RPS, help="Ceiling for the adaptive request rate")
+    p.add_argument("--single-write", action="store_true", help="Persist each school in one UPDATE/transaction")
+    p.add_argument("--write-batch", type=int, default=1, help="Schools per single-write transaction (--single-write)")
+    p.add_argument("--replay", action="store_true", help="Rebuild from the local raw-response store (no network)")
+    p.add_argument("--replay-as-of", default=None, help="Replay responses fetched on/before this date (YYYY-MM-DD)")
+    p.add_argument("--no-store", action="store_true", help="Do not record raw responses")
+    p.add_argument("--rebuild-summaries", action="store_true", help="Recompute summary columns from stored JSONB (no network)")
+    p.add_argument("--id-from", type=int, default=None, help="Rebuild: first school_id (inclusive)")
+    p.add_argument("--id-to", type=int, default=None, help="Rebuild: last school_id (exclusive)")
+    p.add_argument("--partitions", type=int, default=1, help="Rebuild: parallel school_id slices")
+    p.add_argument("--enqueue", action="store_true", help="Load --state targets (per --mode) into enrichment_queue")
+    p.add_argument("--priority", type=int, default=100, help="Queue priority for --enqueue (higher runs first)")
+    p.add_argument("--worker", action="store_true", help="Drain enrichment_queue (optionally only --state)")
+    p.add_argument("--claim-batch", type=int, default=DEFAULT_CLAIM_BATCH, help="Worker: schools leased per claim")
+    p.add_argument("--lease-minutes", type=int, default=DEFAULT_LEASE_MINUTES, help="Worker: lease length before reclaim")
+    p.add_argument("--follow", action="store_true", help="Worker: keep polling when the queue is empty")
     args = p.parse_args()
     
-    if args.udise:
+    if args.replay:
+        api_session.set_store_mode("replay", args.replay_as_of)
+    elif not args.no_store:
+        api_session.set_store_mode("record")
+    
+    if args.rebuild_summaries:
+        rebuild_summaries(args.state, args.id_from, args.id_to, args.partitions)
+    elif args.enqueue and args.state:
+        enqueue_state(args.state, args.mode, args.priority)
+    elif args.worker:
+        run_queue_worker(args.state, args.workers, args.rps, args.max_rps, args.single_write,
+                         args.claim_batch, args.lease_minutes, args.follow)
+    elif args.udise:
         conn = get_db_connection() ; cursor = conn.cursor()
         cursor.execute("SELECT school_id FROM schools_udise_data WHERE udise_code = %s", (args.udise,))
         row = cursor.fetchone()
         cursor.close() ; put_db_connection(conn)
         if row:
             logger.info(f"Targeted Scan for UDISE {args.udise} (ID: {row[0]})")
-            process_school(row[0], args.udise)
+            process_school(row[0], args.udise, args.single_write)
         else:
             logger.error(f"UDISE {args.udise} not found in DB.")
     elif args.state:
-        mine_state(args.state, args.mode, args.limit)
+        mine_state(args.state, args.mode, args.limit, args.workers, args.rps, args.single_write, args.write_batch, args.max_rps)
     else:
-        logger.error("Usage: --state [NAME] or --udise [CODE]")
+        logger.error("Usage: --state [NAME], --udise [CODE], --enqueue --state [NAME], --worker or --rebuild-summaries [--state NAME]")
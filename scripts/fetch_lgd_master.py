@@ -1,7 +1,11 @@
+import io
 import os
+import csv
 import requests
 import psycopg2
-from psycopg2.extras import execute_batch
+import api_session
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import time
 from datetime import datetime
@@ -15,22 +19,227 @@ RESOURCE_ID = "f17a1608-5f10-4610-bb50-a63c80d83974"
 BASE_URL = "https://api.data.gov.in/resource/f17a1608-5f10-4610-bb50-a63c80d83974"
 DB_URL = os.getenv("DATABASE_URL")
 
+PAGE_SIZE = 1000
+DEFAULT_PREFETCH = 4 # Pages fetched ahead of the DB writer
+
+LGD_COLUMNS = (
+    "village_code", "village_name",
+    "subdistrict_code", "subdistrict_name",
+    "district_code", "district_name",
+    "state_code", "state_name",
+    "pincode"
+)
+
+# Session-local staging table; rows vanish at each commit
+STAGE_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS lgd_master_stage (
+        village_code VARCHAR(50),
+        village_name TEXT,
+        subdistrict_code TEXT,
+        subdistrict_name TEXT,
+        district_code TEXT,
+        district_name TEXT,
+        state_code TEXT,
+        state_name TEXT,
+        pincode TEXT
+    ) ON COMMIT DELETE ROWS;
+"""
+
+# Full sync writes the same fingerprint, so a later incremental run diffs against it
+MERGE_SQL = f"""
+    INSERT INTO lgd_master ({", ".join(LGD_COLUMNS)}, record_hash, removed_at)
+    SELECT DISTINCT ON (village_code) {", ".join(LGD_COLUMNS)},
+           md5(json_build_array({", ".join(LGD_COLUMNS)})::text), NULL::TIMESTAMP
+    FROM lgd_master_stage
+    WHERE village_code IS NOT NULL
+    ORDER BY village_code
+    ON CONFLICT (village_code) DO UPDATE SET
+        village_name = EXCLUDED.village_name,
+        subdistrict_code = EXCLUDED.subdistrict_code,
+        subdistrict_name = EXCLUDED.subdistrict_name,
+        district_code = EXCLUDED.district_code,
+        district_name = EXCLUDED.district_name,
+        state_code = EXCLUDED.state_code,
+        state_name = EXCLUDED.state_name,
+        pincode = EXCLUDED.pincode,
+        record_hash = EXCLUDED.record_hash,
+        removed_at = NULL,
+        last_updated = CURRENT_TIMESTAMP;
+"""
+
+# Incremental Mode: fingerprint each record, write only inserted/changed villages and log them
+INCREMENTAL_JOB = "lgd_master_incremental"
+REMOVAL_GUARD = 0.9 # Skip removal detection if a run saw < 90% of active villages (likely a truncated feed)
+
+INCREMENTAL_MERGE_SQL = f"""
+    WITH src AS (
+        SELECT DISTINCT ON (village_code) {", ".join(LGD_COLUMNS)},
+               md5(json_build_array({", ".join(LGD_COLUMNS)})::text) AS record_hash
+        FROM lgd_master_stage
+        WHERE village_code IS NOT NULL
+        ORDER BY village_code
+    ), written AS (
+        INSERT INTO lgd_master ({", ".join(LGD_COLUMNS)}, record_hash)
+        SELECT {", ".join(LGD_COLUMNS)}, record_hash FROM src
+        ON CONFLICT (village_code) DO UPDATE SET
+            village_name = EXCLUDED.village_name,
+            subdistrict_code = EXCLUDED.subdistrict_code,
+            subdistrict_name = EXCLUDED.subdistrict_name,
+            district_code = EXCLUDED.district_code,
+            district_name = EXCLUDED.district_name,
+            state_code = EXCLUDED.state_code,
+            state_name = EXCLUDED.state_name,
+            pincode = EXCLUDED.pincode,
+            record_hash = EXCLUDED.record_hash,
+            removed_at = NULL,
+            last_updated = CURRENT_TIMESTAMP
+        WHERE lgd_master.record_hash IS DISTINCT FROM EXCLUDED.record_hash
+           OR lgd_master.removed_at IS NOT NULL
+        RETURNING village_code, district_code, state_code, (xmax = 0) AS is_insert
+    )
+    INSERT INTO lgd_master_changes (run_id, village_code, district_code, state_code, change_type)
+    SELECT %(run_id)s, village_code, district_code, state_code,
+           CASE WHEN is_insert THEN 'inserted' ELSE 'updated' END
+    FROM written;
+
+    INSERT INTO lgd_sync_seen (run_id, village_code)
+    SELECT DISTINCT %(run_id)s, village_code FROM lgd_master_stage WHERE village_code IS NOT NULL
+    ON CONFLICT DO NOTHING;
+"""
+
 if not API_KEY:
     print("Error: DATA_GOV_IN_API_KEY not found in .env")
     exit(1)
 
-def run_sync_cycle():
-    """Returns True if sync is complete, False if it should restart."""
+def fetch_page(offset, limit=PAGE_SIZE):
+    """Fetches one page with retries. Returns its records, or None if the page could not be fetched."""
+    params = {
+        "api-key": API_KEY,
+        "format": "json",
+        "offset": offset,
+        "limit": limit
+    }
+
+    response = None
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            response = api_session.get(BASE_URL, params=params)
+            if response.status_code == 200:
+                break
+            print(f"Offset {offset}: attempt {attempt+1}/{max_retries} failed: Status {response.status_code}. Waiting...")
+            time.sleep(2 * (attempt + 1))
+        except requests.RequestException as e:
+            print(f"Offset {offset}: attempt {attempt+1}/{max_retries} Exception: {e}")
+            time.sleep(2 * (attempt + 1))
+
+    if not response or response.status_code != 200:
+        print(f"Failed to fetch offset {offset} after retries. Last status: {response.status_code if response else 'None'}")
+        return None
+    return response.json().get("records", [])
+
+def load_page(cursor, records, run_id=None):
+    """COPYs one page into the staging table and merges it into lgd_master (change-detecting if run_id is set)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for r in records:
+        writer.writerow((
+            r.get("villageCode"),
+            r.get("villageNameEnglish"),
+            r.get("subdistrictCode"),
+            r.get("subdistrictNameEnglish"),
+            r.get("districtCode"),
+            r.get("districtNameEnglish"),
+            r.get("stateCode"),
+            r.get("stateNameEnglish"),
+            str(r.get("pincode")) if r.get("pincode") else None
+        ))
+    buf.seek(0)
+    cursor.copy_expert(f"COPY lgd_master_stage ({', '.join(LGD_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf)
+    if run_id is None:
+        cursor.execute(MERGE_SQL)
+    else:
+        cursor.execute(INCREMENTAL_MERGE_SQL, {"run_id": run_id})
+
+def start_or_resume_run(cursor):
+    """Returns the open incremental run, or opens a new one starting from offset 0."""
+    cursor.execute("SELECT id FROM lgd_sync_runs WHERE status = 'running' ORDER BY id DESC LIMIT 1")
+    row = cursor.fetchone()
+    if row:
+        print(f"Resuming incremental run #{row[0]}")
+        return row[0]
+    cursor.execute("INSERT INTO lgd_sync_runs DEFAULT VALUES RETURNING id")
+    run_id = cursor.fetchone()[0]
+    cursor.execute("""
+        INSERT INTO sync_status (job_name, last_offset, last_updated)
+        VALUES (%s, 0, CURRENT_TIMESTAMP)
+        ON CONFLICT (job_name) DO UPDATE SET last_offset = 0, last_updated = CURRENT_TIMESTAMP;
+    """, (INCREMENTAL_JOB,))
+    print(f"Started incremental run #{run_id}")
+    return run_id
+
+def finish_run(cursor, run_id):
+    """Flags villages this complete pass never saw as removed, then closes the run with its change counts."""
+    cursor.execute("SELECT COUNT(*) FROM lgd_sync_seen WHERE run_id = %s", (run_id,))
+    seen = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM lgd_master WHERE removed_at IS NULL")
+    active = cursor.fetchone()[0]
+
+    if seen >= REMOVAL_GUARD * active:
+        cursor.execute("""
+            WITH removed AS (
+                UPDATE lgd_master lm SET removed_at = CURRENT_TIMESTAMP, last_updated = CURRENT_TIMESTAMP
+                WHERE lm.removed_at IS NULL
+                  AND NOT EXISTS (SELECT 1 FROM lgd_sync_seen s WHERE s.run_id = %(run_id)s AND s.village_code = lm.village_code)
+                RETURNING village_code, district_code, state_code
+            )
+            INSERT INTO lgd_master_changes (run_id, village_code, district_code, state_code, change_type)
+            SELECT %(run_id)s, village_code, district_code, state_code, 'removed' FROM removed;
+        """, {"run_id": run_id})
+    else:
+        print(f"Removal detection skipped: run saw {seen} of {active} active villages.")
+
+    cursor.execute("DELETE FROM lgd_sync_seen WHERE run_id = %s", (run_id,))
+    cursor.execute("""
+        UPDATE lgd_sync_runs r SET
+            status = 'completed', completed_at = CURRENT_TIMESTAMP,
+            inserted_count = c.inserted, updated_count = c.updated, removed_count = c.removed
+        FROM (
+            SELECT COUNT(*) FILTER (WHERE change_type = 'inserted') AS inserted,
+                   COUNT(*) FILTER (WHERE change_type = 'updated') AS updated,
+                   COUNT(*) FILTER (WHERE change_type = 'removed') AS removed,
+                   COUNT(DISTINCT district_code) AS districts
+            FROM lgd_master_changes WHERE run_id = %s
+        ) c
+        WHERE r.id = %s
+        RETURNING c.inserted, c.updated, c.removed, c.districts
+    """, (run_id, run_id))
+    inserted, updated, removed, districts = cursor.fetchone()
+    print(f"Run #{run_id} complete: {inserted} inserted, {updated} updated, {removed} removed across {districts} districts.")
+
+def run_sync_cycle(prefetch=DEFAULT_PREFETCH, incremental=False):
+    """
+    Pipelined sync: up to `prefetch` pages are fetched in parallel while the
+    previous page is COPYed and merged. Pages are committed strictly in offset
+    order, so sync_status.last_offset only ever covers contiguous committed pages.
+    With `incremental`, pages are fingerprinted and only changes are written and logged.
+    Returns True if sync is complete, False if it should restart.
+    """
     conn = psycopg2.connect(DB_URL)
     cursor = conn.cursor()
-    
+
     # Get starting offset
-    job_name = "lgd_master"
+    job_name = INCREMENTAL_JOB if incremental else "lgd_master"
+    run_id = None
     try:
+        if incremental:
+            run_id = start_or_resume_run(cursor)
+            conn.commit()
+
         # Try finding persisted offset first
         cursor.execute("SELECT last_offset FROM sync_status WHERE job_name = %s", (job_name,))
         row = cursor.fetchone()
-        
+
         if row:
             start_offset = row[0]
             print(f"Found persisted offset: {start_offset}")
@@ -38,96 +247,69 @@ def run_sync_cycle():
             # Fallback to COUNT(*)
             cursor.execute("SELECT COUNT(*) FROM lgd_master")
             count = cursor.fetchone()[0]
-            start_offset = (count // 1000) * 1000
+            start_offset = (count // PAGE_SIZE) * PAGE_SIZE
             print(f"No persisted offset. Fallback to DB count: {count} -> {start_offset}")
-            
-        offset = start_offset
     except Exception as e:
         print(f"Error checking offset: {e}. Starting from 0.")
-        offset = 0
+        start_offset = 0
         conn.rollback()
+        if incremental:
+            cursor.close()
+            conn.close()
+            return False # Cannot track a run without its bookkeeping tables
+
+    offset = start_offset
+    print(f"[{datetime.now()}] Resuming LGD Master sync from offset: {offset} (Prefetch: {prefetch})")
+
+    api_session.configure(prefetch)
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    inflight = deque()
+    next_fetch = offset
+
+    def complete():
+        if incremental:
+            finish_run(cursor, run_id)
+            conn.commit()
+        # Re-resolve crosswalk rows that were unmatched or pointed at villages that are now gone.
+        # The page sync is already committed; a failed refresh must not restart the cycle.
+        try:
+            cursor.execute("SELECT refresh_lgd_crosswalk()")
+            print(f"LGD crosswalk refreshed: {cursor.fetchone()[0]} source rows resolved.")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Warning: LGD crosswalk refresh failed: {e}")
+        return True
+
+    def top_up():
+        nonlocal next_fetch
+        while len(inflight) < prefetch:
+            inflight.append((next_fetch, executor.submit(fetch_page, next_fetch)))
+            next_fetch += PAGE_SIZE
 
-    limit = 1000
-    total_records = start_offset
-    
-    print(f"[{datetime.now()}] Resuming LGD Master sync from offset: {offset}")
-    
     try:
+        cursor.execute(STAGE_DDL)
+        conn.commit()
+        top_up()
         while True:
-            params = {
-                "api-key": API_KEY,
-                "format": "json",
-                "offset": offset,
-                "limit": limit
-            }
-            
-            response = None
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    response = requests.get(BASE_URL, params=params, timeout=30)
-                    if response.status_code == 200:
-                        break
-                    print(f"Attempt {attempt+1}/{max_retries} failed: Status {response.status_code}. Waiting...")
-                    time.sleep(2 * (attempt + 1))
-                except requests.RequestException as e:
-                    print(f"Attempt {attempt+1}/{max_retries} Exception: {e}")
-                    time.sleep(2 * (attempt + 1))
-            
-            if not response or response.status_code != 200:
-                print(f"Failed to fetch data after retries. Last status: {response.status_code if response else 'None'}")
-                return False # Signal restart needed
-                
-            data = response.json()
-            records = data.get("records", [])
-            
+            page_offset, future = inflight.popleft()
+            records = future.result()
+
+            if records is None:
+                return False # Signal restart needed; last_offset still marks the last contiguous page
+
             if not records:
-                # Double check total validity? 
-                # Ideally check 'total' in response but data.gov.in 'total' field is sometimes static.
-                # If records is empty, we are likely done.
+                # data.gov.in 'total' field is sometimes static; an empty page means we are done.
                 print("No more records found in API response.")
-                return True # Signal complete
-                
-            # Prepare batch insert
-            insert_query = """
-                INSERT INTO lgd_master (
-                    village_code, village_name, 
-                    subdistrict_code, subdistrict_name, 
-                    district_code, district_name, 
-                    state_code, state_name, 
-                    pincode
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (village_code) DO UPDATE SET
-                    village_name = EXCLUDED.village_name,
-                    subdistrict_name = EXCLUDED.subdistrict_name,
-                    district_name = EXCLUDED.district_name,
-                    state_name = EXCLUDED.state_name,
-                    pincode = EXCLUDED.pincode,
-                    last_updated = CURRENT_TIMESTAMP;
-            """
-            
-            values = []
-            for r in records:
-                values.append((
-                    r.get("villageCode"),
-                    r.get("villageNameEnglish"),
-                    r.get("subdistrictCode"),
-                    r.get("subdistrictNameEnglish"),
-                    r.get("districtCode"),
-                    r.get("districtNameEnglish"),
-                    r.get("stateCode"),
-                    r.get("stateNameEnglish"),
-                    str(r.get("pincode")) if r.get("pincode") else None
-                ))
-            
-            execute_batch(cursor, insert_query, values)
-            
-            # Update Offset
+                return complete() # Signal complete
+
+            load_page(cursor, records, run_id)
+
+            # Update Offset (pages arrive in order, so this stays contiguous)
             count = len(records)
-            offset += count
-            total_records += count
-            
-            # Persist Progress
+            offset = page_offset + count
+
+            # Persist Progress in the same transaction as the page
             cursor.execute("""
                 INSERT INTO sync_status (job_name, last_offset, last_updated)
                 VALUES (%s, %s, CURRENT_TIMESTAMP)
@@ -135,43 +317,54 @@ def run_sync_cycle():
                     last_offset = EXCLUDED.last_offset,
                     last_updated = CURRENT_TIMESTAMP;
             """, (job_name, offset))
-            
+
             conn.commit()
-            
+
             print(f"Inserted {count} records. Current Offset: {offset}")
-            
-            if count < limit:
+
+            if count < PAGE_SIZE:
                 print("Reached end of data stream (count < limit).")
-                return True
-                
-            time.sleep(0.5) # Rate limiting
-            
+                return complete()
+
+            top_up()
+
     except Exception as e:
         print(f"Critical Error in Sync Cycle: {e}")
         conn.rollback()
         return False # Signal restart needed
     finally:
+        executor.shutdown(wait=False, cancel_futures=True)
         cursor.close()
         conn.close()
 
-def main_loop():
-    restart_delay = 300 # 5 minutes
-    
+def main_loop(prefetch=DEFAULT_PREFETCH, incremental=False):
+    # Restart delay backs off 30s -> 5 minutes on consecutive failures
+    min_delay, max_delay = 30, 300
+    restart_delay = min_delay
+
     while True:
         try:
-            is_complete = run_sync_cycle()
+            is_complete = run_sync_cycle(prefetch, incremental)
             if is_complete:
                 print("Sync Completed Successfully. Exiting.")
                 break
             else:
                 print(f"Sync interrupted or failed. Restarting in {restart_delay} seconds...")
                 time.sleep(restart_delay)
+                restart_delay = min(max_delay, restart_delay * 2)
         except KeyboardInterrupt:
             print("Sync manually stopped.")
             break
         except Exception as e:
             print(f"Unexpected Loop Error: {e}")
             time.sleep(restart_delay)
+            restart_delay = min(max_delay, restart_delay * 2)
 
 if __name__ == "__main__":
-    main_loop()
+    import argparse
+    parser = argparse.ArgumentParser(description="Sync LGD village master from data.gov.in")
+    parser.add_argument("--prefetch", type=int, default=DEFAULT_PREFETCH, help="Pages fetched in parallel ahead of the DB writer")
+    parser.add_argument("--incremental", action="store_true", help="Write only new/changed/removed villages and log them to lgd_master_changes")
+    args = parser.parse_args()
+
+    main_loop(max(1, args.prefetch), args.incremental)
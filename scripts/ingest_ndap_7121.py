@@ -0,0 +1,242 @@
+import io
+import os
+import re
+import sys
+import csv
+import time
+import argparse
+from decimal import Decimal, ROUND_HALF_UP
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+from psycopg2 import pool
+from dotenv import load_dotenv
+
+# Setup paths relative to script location
+BASE_DIR = os.path.join(os.path.dirname(__file__), '..')
+env_path = os.path.join(BASE_DIR, '.env')
+load_dotenv(env_path)
+
+DB_URL = os.getenv("DATABASE_URL")
+
+DEFAULT_FILE = os.path.join(BASE_DIR, 'source_data_files', 'NDAP_DS_7121', 'data_7121.csv')
+CHUNK_ROWS = 20000 # Rows per COPY
+DEFAULT_WORKERS = 4 # Parallel COPY connections
+
+# Same pattern as safe_numeric() in init.sql
+NUMERIC_RE = re.compile(r'^\s*[-+]?[0-9]*\.?[0-9]+\s*$')
+
+KEY_COLUMNS = ('state', 'district', 'sub_district', 'ulb_rlb_village')
+# Raw columns that feed numeric columns of village_amenities
+NUMERIC_COLUMNS = (
+    'total_geographical_area_covered_by_village',
+    'number_of_village_households',
+    'rural_population',
+    'scheduled_castes_rural_population',
+    'scheduled_tribes_rural_population',
+    'distance_between_village_and_nearest_statutory_town',
+    'distance_between_the_village_and_district_head_quarter',
+    'distance_between_village_and_sub_district_head_quarter',
+)
+# Of those, the ones typed as INTEGER (out-of-range values become NULL, like safe_integer())
+INTEGER_COLUMNS = (
+    'number_of_village_households',
+    'rural_population',
+    'scheduled_castes_rural_population',
+    'scheduled_tribes_rural_population',
+)
+INT_RANGE = (-2**31, 2**31 - 1)
+
+# Parallel COPYs land in a per-run unlogged stage; raw and typed tables are swapped only after every chunk succeeded
+STAGE_TABLE = "village_amenities_raw_stage"
+
+# Typed rebuild; rows missing any key part are left out, unparseable or out-of-range numbers become NULL
+BUILD_TYPED_SQL = """
+    TRUNCATE village_amenities;
+    INSERT INTO village_amenities (
+        composite_key, year, state, district, sub_district, village,
+        area_ha, households, rural_population, sc_rural_population, st_rural_population,
+        nearest_town_name, distance_to_nearest_town_km,
+        district_hq_name, distance_to_district_hq_km,
+        taluk_hq_name, distance_to_taluk_hq_km
+    )
+    SELECT DISTINCT ON (composite_key, year) *
+    FROM (
+        SELECT
+            (state || '-' || district || '-' || sub_district || '-' || ulb_rlb_village) AS composite_key,
+            COALESCE(year, '') AS year,
+            state, district, sub_district, ulb_rlb_village,
+            safe_numeric(total_geographical_area_covered_by_village),
+            safe_integer(number_of_village_households),
+            safe_integer(rural_population),
+            safe_integer(scheduled_castes_rural_population),
+            safe_integer(scheduled_tribes_rural_population),
+            name_of_the_nearest_statutory_town,
+            safe_numeric(distance_between_village_and_nearest_statutory_town),
+            name_of_the_district_head_quarter_of_village,
+            safe_numeric(distance_between_the_village_and_district_head_quarter),
+            name_of_the_subdistrict_head_quarter_of_village,
+            safe_numeric(distance_between_village_and_sub_district_head_quarter)
+        FROM village_amenities_raw
+        WHERE state IS NOT NULL AND district IS NOT NULL
+          AND sub_district IS NOT NULL AND ulb_rlb_village IS NOT NULL
+    ) typed
+    ORDER BY composite_key, year;
+"""
+
+def get_db_connection():
+    if not DB_URL:
+        print("Error: DATABASE_URL not found in .env")
+        sys.exit(1)
+    return psycopg2.connect(DB_URL)
+
+def raw_columns(cur):
+    """village_amenities_raw columns in table order (the CSV is positional)."""
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'village_amenities_raw' AND table_schema = current_schema()
+        ORDER BY ordinal_position
+    """)
+    return [r[0] for r in cur.fetchall()]
+
+def out_of_int_range(value):
+    """True for a numeric value that rounds outside INTEGER (safe_integer() turns it into NULL)."""
+    n = Decimal(value.strip()).to_integral_value(rounding=ROUND_HALF_UP)
+    return not INT_RANGE[0] <= n <= INT_RANGE[1]
+
+def check_row(row, width, key_idx, numeric_idx, integer_idx):
+    """Returns (loadable, reason). Short/long rows can't be COPYed; the rest load raw but may be flagged."""
+    if len(row) != width:
+        return False, f"expected {width} fields, got {len(row)}"
+    problems = [f"missing {name}" for name, i in key_idx if not row[i].strip()]
+    problems += [f"non-numeric {name}" for name, i in numeric_idx if row[i].strip() and not NUMERIC_RE.match(row[i])]
+    problems += [f"out-of-range {name}" for name, i in integer_idx
+                 if row[i].strip() and NUMERIC_RE.match(row[i]) and out_of_int_range(row[i])]
+    return True, "; ".join(problems)
+
+def copy_chunk(db_pool, buf):
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(f"COPY {STAGE_TABLE} FROM STDIN WITH (FORMAT csv)", buf)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_pool.putconn(conn)
+
+def ingest_village_amenities(file_path, workers=DEFAULT_WORKERS, chunk_rows=CHUNK_ROWS, append=False, rejects_path=None):
+    print(f"Starting ingestion of Village Amenities (NDAP 7121) from: {file_path}")
+    rejects_path = rejects_path or f"{os.path.splitext(file_path)[0]}_rejects.csv"
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    columns = raw_columns(cur)
+    if not columns:
+        print("Error: village_amenities_raw does not exist. Run init.sql first.")
+        return
+    key_idx = [(c, columns.index(c)) for c in KEY_COLUMNS]
+    numeric_idx = [(c, columns.index(c)) for c in NUMERIC_COLUMNS]
+    integer_idx = [(c, columns.index(c)) for c in INTEGER_COLUMNS]
+    # Committed so the COPY connections see it; the live raw table is untouched until the swap
+    cur.execute(f"DROP TABLE IF EXISTS {STAGE_TABLE}")
+    cur.execute(f"CREATE UNLOGGED TABLE {STAGE_TABLE} (LIKE village_amenities_raw INCLUDING DEFAULTS)")
+    conn.commit()
+
+    db_pool = pool.ThreadedConnectionPool(1, workers, DB_URL)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    inflight = deque()
+    loaded = rejected = flagged = 0
+    started = time.monotonic()
+
+    def drain(limit):
+        nonlocal loaded
+        while len(inflight) > limit:
+            count, future = inflight.popleft()
+            future.result() # Re-raises a failed COPY
+            loaded += count
+            print(f"  Loaded {loaded} rows ({loaded / (time.monotonic() - started):.0f} rows/s), rejected {rejected}, flagged {flagged}")
+
+    try:
+        with open(file_path, newline='', encoding='utf-8') as f, open(rejects_path, 'w', newline='') as rej:
+            reader = csv.reader(f)
+            next(reader, None) # Header
+            rej_writer = csv.writer(rej)
+            rej_writer.writerow(['line', 'loaded', 'reason', 'raw'])
+
+            buf, count = io.StringIO(), 0
+            writer = csv.writer(buf)
+            for row in reader:
+                ok, reason = check_row(row, len(columns), key_idx, numeric_idx, integer_idx)
+                if reason:
+                    rej_writer.writerow([reader.line_num, ok, reason, ",".join(row)])
+                    if ok: flagged += 1
+                    else: rejected += 1
+                if not ok:
+                    continue
+                writer.writerow(row)
+                count += 1
+                if count >= chunk_rows:
+                    buf.seek(0)
+                    inflight.append((count, executor.submit(copy_chunk, db_pool, buf)))
+                    buf, count = io.StringIO(), 0
+                    writer = csv.writer(buf)
+                    drain(workers * 2) # Bound buffered chunks in memory
+            if count:
+                buf.seek(0)
+                inflight.append((count, executor.submit(copy_chunk, db_pool, buf)))
+            drain(0)
+
+        # Every chunk is staged: swap raw and rebuild typed in one transaction
+        print("Raw load complete. Swapping in staged rows and building typed village_amenities...")
+        if not append:
+            cur.execute("TRUNCATE village_amenities_raw")
+        cur.execute(f"INSERT INTO village_amenities_raw SELECT * FROM {STAGE_TABLE}")
+        cur.execute(BUILD_TYPED_SQL)
+        typed = cur.rowcount
+        conn.commit()
+
+        # Own transaction: a failed crosswalk refresh must not roll back the committed load
+        try:
+            cur.execute("SELECT refresh_lgd_crosswalk('village_amenities')")
+            print(f"LGD crosswalk: {cur.fetchone()[0]} amenity villages resolved.")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Warning: LGD crosswalk refresh failed (re-run refresh_lgd_crosswalk('village_amenities')): {e}")
+    except Exception as e:
+        print(f"Ingestion failed after {loaded} rows, existing data kept: {e}")
+        conn.rollback()
+        return
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        db_pool.closeall()
+        try:
+            cur.execute(f"DROP TABLE IF EXISTS {STAGE_TABLE}")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Warning: could not drop {STAGE_TABLE}: {e}")
+        cur.close()
+        conn.close()
+
+    print(f"Ingestion Complete. {loaded} raw rows in {time.monotonic() - started:.0f}s, {typed} typed villages.")
+    if rejected or flagged:
+        print(f"{rejected} rows rejected, {flagged} loaded with issues -> {rejects_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Ingest NDAP 7121 Village Amenities')
+    parser.add_argument('--file', default=DEFAULT_FILE, help='Path to data_7121.csv')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Parallel COPY connections')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='Rows per COPY chunk')
+    parser.add_argument('--append', action='store_true', help='Keep existing raw rows instead of truncating first')
+    parser.add_argument('--rejects', help='Reject report path (default: <file>_rejects.csv)')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        print(f"Error: File not found: {args.file}")
+        sys.exit(1)
+
+    ingest_village_amenities(args.file, max(1, args.workers), args.chunk_rows, args.append, args.rejects)
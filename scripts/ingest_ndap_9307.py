@@ -1,7 +1,9 @@
+import io
 import os
 import sys
 import argparse
 import zipfile
+from contextlib import contextmanager
 import pandas as pd
 import psycopg2
 from dotenv import load_dotenv
@@ -13,97 +15,172 @@ load_dotenv(env_path)
 
 DB_URL = os.getenv("DATABASE_URL")
 
+SOURCE_FILE = 'NDAP_9307_source_data.csv'
+CHUNK_SIZE = 50000 # Rows per read_csv chunk; keeps memory flat on large NDAP extracts
+
+KEY_COLUMNS = {
+    'srcStateName': 'state_name',
+    'srcDistrictName': 'district_name',
+    'srcYear': 'year_code',
+}
+POPULATION_COLUMNS = {
+    'Number of SC population': 'sc_population',
+    'Number of ST population': 'st_population',
+    'Number of general population': 'general_population',
+}
+TARGET_COLUMNS = ('state_name', 'district_name', 'year_code', 'total_population',
+                  'sc_population', 'st_population', 'general_population')
+
+# Session-local staging table; every chunk is COPYed here, then merged once
+STAGE_DDL = """
+    CREATE TEMP TABLE district_demographics_stage (
+        row_num BIGINT,
+        state_name TEXT,
+        district_name TEXT,
+        year_code TEXT,
+        total_population INTEGER,
+        sc_population INTEGER,
+        st_population INTEGER,
+        general_population INTEGER
+    ) ON COMMIT DROP;
+"""
+
+# Last occurrence of a (state, district, year) wins, as with the old row-by-row upsert
+MERGE_SQL = f"""
+    INSERT INTO district_demographics ({", ".join(TARGET_COLUMNS)}, source_file)
+    SELECT DISTINCT ON (state_name, district_name, year_code) {", ".join(TARGET_COLUMNS)}, %s
+    FROM district_demographics_stage
+    ORDER BY state_name, district_name, year_code, row_num DESC
+    ON CONFLICT (state_name, district_name, year_code)
+    DO UPDATE SET
+        total_population = EXCLUDED.total_population,
+        sc_population = EXCLUDED.sc_population,
+        st_population = EXCLUDED.st_population,
+        general_population = EXCLUDED.general_population,
+        created_at = NOW();
+"""
+
 def get_db_connection():
     if not DB_URL:
         print("Error: DATABASE_URL not found in .env")
         sys.exit(1)
     return psycopg2.connect(DB_URL)
 
-def ingest_district_demographics(file_path):
-    print(f"Starting ingestion of District Demographics (NDAP 9307) from: {file_path}")
-    
-    # Check if file is a zip or csv
+@contextmanager
+def open_source(file_path):
+    """Yields a binary stream over the CSV, reading straight from the zip member when given a zip."""
     if file_path.endswith('.zip'):
         with zipfile.ZipFile(file_path, 'r') as z:
-            # Find the source data file
-            target_file = None
-            for name in z.namelist():
-                if '9307_source_data.csv' in name:
-                    target_file = name
-                    break
-            
+            target_file = next((name for name in z.namelist() if '9307_source_data.csv' in name), None)
             if not target_file:
-                print("Error: 9307_source_data.csv not found in zip!")
-                return
-
-            print(f"Reading {target_file} from zip...")
+                raise FileNotFoundError("9307_source_data.csv not found in zip!")
+            print(f"Streaming {target_file} from zip...")
             with z.open(target_file) as f:
-                df = pd.read_csv(f)
+                yield f
     else:
         print(f"Reading CSV file: {file_path}")
-        df = pd.read_csv(file_path)
-            
-    print(f"Loaded {len(df)} rows. Transforming...")
-    
+        with open(file_path, 'rb') as f:
+            yield f
+
+def transform_chunk(df):
+    """
+    Column-wise cleanup of one raw chunk.
+    Returns (rows ready for COPY, rejected rows with a reason).
+    Blank populations count as 0; non-numeric ones and rows missing a key are rejected.
+    """
+    for col in list(KEY_COLUMNS) + list(POPULATION_COLUMNS):
+        if col not in df.columns:
+            df[col] = ''
+
+    out = pd.DataFrame({'row_num': df.index})
+    out.index = df.index
+    for src, dst in KEY_COLUMNS.items():
+        out[dst] = df[src].str.strip().replace('', pd.NA)
+
+    reasons = pd.Series('', index=df.index)
+    for src, dst in POPULATION_COLUMNS.items():
+        raw = df[src].str.strip().replace('', pd.NA)
+        parsed = pd.to_numeric(raw, errors='coerce')
+        reasons[raw.notna() & parsed.isna()] += f"non-numeric {dst}; "
+        out[dst] = parsed.fillna(0).astype('int64')
+
+    for dst in KEY_COLUMNS.values():
+        reasons[out[dst].isna()] += f"missing {dst}; "
+
+    # Total logic: sum specific columns
+    out['total_population'] = out['sc_population'] + out['st_population'] + out['general_population']
+
+    bad = reasons != ''
+    rejects = df.loc[bad, list(KEY_COLUMNS) + list(POPULATION_COLUMNS)].copy()
+    rejects.insert(0, 'reason', reasons[bad].str.rstrip('; '))
+    rejects.insert(0, 'row_num', df.index[bad])
+    return out.loc[~bad, ['row_num'] + list(TARGET_COLUMNS)], rejects
+
+def copy_chunk(cur, rows):
+    buf = io.StringIO()
+    rows.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cur.copy_expert(f"COPY district_demographics_stage (row_num, {', '.join(TARGET_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+def ingest_district_demographics(file_path, rejects_path=None, chunk_size=CHUNK_SIZE):
+    print(f"Starting ingestion of District Demographics (NDAP 9307) from: {file_path}")
+    rejects_path = rejects_path or f"{os.path.splitext(file_path)[0]}_rejects.csv"
+
     conn = get_db_connection()
     cur = conn.cursor()
-    
-    inserted = 0
-    
-    for _, row in df.iterrows():
-        # Extract fields
-        state = row.get('srcStateName')
-        district = row.get('srcDistrictName')
-        year = row.get('srcYear')
-        
-        # Parse populations (handle NaNs/empty strings)
-        def clean_int(val):
-            try:
-                return int(float(val)) if pd.notnull(val) else 0
-            except:
-                return 0
-                
-        sc_pop = clean_int(row.get('Number of SC population'))
-        st_pop = clean_int(row.get('Number of ST population'))
-        gen_pop = clean_int(row.get('Number of general population'))
-        
-        # Total logic: sum specific columns
-        calc_total = sc_pop + st_pop + gen_pop
-        
+
+    read = staged = rejected = 0
+    try:
+        cur.execute(STAGE_DDL)
+        with open_source(file_path) as f, open(rejects_path, 'w', newline='') as rej:
+            for i, chunk in enumerate(pd.read_csv(f, dtype=str, chunksize=chunk_size)):
+                chunk.index += read + 2 # Source line numbers (header is line 1)
+                rows, rejects = transform_chunk(chunk)
+                if len(rows): copy_chunk(cur, rows)
+                if len(rejects): rejects.to_csv(rej, index=False, header=(rejected == 0))
+
+                read += len(chunk)
+                staged += len(rows)
+                rejected += len(rejects)
+                print(f"Chunk {i+1}: read {read} rows, staged {staged}, rejected {rejected}")
+
+        # One set-based upsert; all or nothing
+        cur.execute(MERGE_SQL, (SOURCE_FILE,))
+        merged = cur.rowcount
+        conn.commit()
+
+        # Own transaction: a failed crosswalk refresh must not roll back the committed load
         try:
-            query = """
-                INSERT INTO district_demographics 
-                (state_name, district_name, year_code, total_population, sc_population, st_population, general_population, source_file)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, 'NDAP_9307_source_data.csv')
-                ON CONFLICT (state_name, district_name, year_code) 
-                DO UPDATE SET
-                    total_population = EXCLUDED.total_population,
-                    sc_population = EXCLUDED.sc_population,
-                    st_population = EXCLUDED.st_population,
-                    general_population = EXCLUDED.general_population,
-                    created_at = NOW();
-            """
-            cur.execute(query, (state, district, year, calc_total, sc_pop, st_pop, gen_pop))
-            inserted += 1
-            
+            cur.execute("SELECT refresh_lgd_crosswalk('district_demographics')")
+            print(f"LGD crosswalk: {cur.fetchone()[0]} districts resolved.")
+            conn.commit()
         except Exception as e:
-            print(f"Error inserting {state}-{district}: {e}")
             conn.rollback()
-            continue
+            print(f"Warning: LGD crosswalk refresh failed (re-run refresh_lgd_crosswalk('district_demographics')): {e}")
+    except Exception as e:
+        print(f"Ingestion failed, nothing written: {e}")
+        conn.rollback()
+        return
+    finally:
+        cur.close()
+        conn.close()
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    print(f"Ingestion Complete. Processed {inserted} rows.")
+    if rejected:
+        print(f"{rejected} rows rejected -> {rejects_path}")
+    elif os.path.exists(rejects_path):
+        os.remove(rejects_path)
+    print(f"Ingestion Complete. Read {read} rows, upserted {merged} districts.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Ingest NDAP 9307 District Demographics')
     parser.add_argument('--file', required=True, help='Path to the 9307_all_files.zip or 9307_source_data.csv')
-    
+    parser.add_argument('--rejects', help='Reject report path (default: <file>_rejects.csv)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows read per chunk')
+
     args = parser.parse_args()
-    
+
     if not os.path.exists(args.file):
         print(f"Error: File not found: {args.file}")
         sys.exit(1)
-        
-    ingest_district_demographics(args.file)
+
+    ingest_district_demographics(args.file, args.rejects, args.chunk_size)
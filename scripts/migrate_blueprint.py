@@ -28,6 +28,17 @@ def migrate_live_db():
             "UPDATE proposal_blueprints SET sections_config = %s WHERE id = %s;",
             (Json(config), row_id)
         )
+
+        # The update trigger recompiles blueprint_topology; surface the new plan
+        cur.execute("""
+            SELECT is_valid, compile_errors, jsonb_array_length(topology_data->'waves'), topology_data->'critical_path'
+            FROM blueprint_topology WHERE id = (SELECT compile_blueprint_topology(%s));
+        """, (row_id,))
+        is_valid, errors, waves, critical_path = cur.fetchone()
+        if is_valid:
+            print(f"Blueprint {row_id}: {waves} parallel waves, critical path {' -> '.join(critical_path)}")
+        else:
+            print(f"Blueprint {row_id}: invalid section graph: {errors}")
         
     conn.commit()
     cur.close()
@@ -0,0 +1,57 @@
+-- Partitioned Activity Log Migration
+-- Converts an existing single-heap proposal_activity_logs into the monthly-partitioned
+-- layout defined in init.sql. Run once, then re-run init.sql for the maintenance function.
+
+BEGIN;
+
+-- 1. Keep the current table as a backup
+ALTER TABLE IF EXISTS proposal_activity_logs RENAME TO proposal_activity_logs_unpartitioned_bak;
+ALTER INDEX IF EXISTS idx_proposal_activity_proposal_id RENAME TO idx_proposal_activity_proposal_id_bak;
+ALTER INDEX IF EXISTS idx_proposal_activity_event_type RENAME TO idx_proposal_activity_event_type_bak;
+
+-- 2. Partitioned table (same columns; created_at becomes part of the key)
+CREATE TABLE proposal_activity_logs (LIKE proposal_activity_logs_unpartitioned_bak INCLUDING DEFAULTS)
+PARTITION BY RANGE (created_at);
+
+UPDATE proposal_activity_logs_unpartitioned_bak SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE proposal_activity_logs
+    ALTER COLUMN created_at SET NOT NULL,
+    ADD PRIMARY KEY (id, created_at),
+    ADD FOREIGN KEY (actor_id) REFERENCES users(id);
+
+-- The id sequence stays owned by the backup; hand it to the new table so ids continue
+ALTER SEQUENCE IF EXISTS proposal_activity_logs_id_seq OWNED BY proposal_activity_logs.id;
+
+-- 3. One partition per month present through three months ahead, plus a default
+-- (inline rather than via add_monthly_partition so this script never replaces init.sql's version)
+DO $$
+DECLARE
+    v_month DATE;
+BEGIN
+    FOR v_month IN
+        SELECT m::DATE FROM generate_series(
+            date_trunc('month', LEAST(CURRENT_TIMESTAMP, (SELECT MIN(created_at) FROM proposal_activity_logs_unpartitioned_bak))),
+            date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '3 months',
+            INTERVAL '1 month'
+        ) m
+    LOOP
+        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF proposal_activity_logs FOR VALUES FROM (%L) TO (%L)',
+                       'proposal_activity_logs' || to_char(v_month, '"_y"YYYY"m"MM'), v_month, (v_month + INTERVAL '1 month')::DATE);
+    END LOOP;
+END $$;
+
+CREATE TABLE proposal_activity_logs_default PARTITION OF proposal_activity_logs DEFAULT;
+
+-- 4. Copy in time order so each partition's BRIN ranges stay tight
+INSERT INTO proposal_activity_logs SELECT * FROM proposal_activity_logs_unpartitioned_bak ORDER BY created_at, id;
+
+-- 5. Indexes
+CREATE INDEX IF NOT EXISTS idx_proposal_activity_proposal_id ON proposal_activity_logs(proposal_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_proposal_activity_event_type ON proposal_activity_logs(event_type);
+CREATE INDEX IF NOT EXISTS idx_proposal_activity_created_brin ON proposal_activity_logs USING BRIN (created_at);
+
+COMMIT;
+
+ANALYZE proposal_activity_logs;
+
+-- Once verified: DROP TABLE proposal_activity_logs_unpartitioned_bak;
@@ -0,0 +1,305 @@
+-- Partitioned Registry Migration
+-- Converts an existing single-heap schools_udise_data (with inline JSONB blobs) into the
+-- year-partitioned narrow table + school_fragments layout defined in init.sql.
+-- Run once. The views, facility-fact functions and triggers that depend on the registry are
+-- recreated here (init.sql is not re-runnable: it seeds data and backfills ledgers).
+
+BEGIN;
+
+-- 1. Keep the current table as a backup (views referencing it follow the rename)
+ALTER TABLE IF EXISTS schools_udise_data RENAME TO schools_udise_data_unpartitioned_bak;
+
+-- 2. Narrow partitioned table: same columns minus the nine blobs
+CREATE TABLE schools_udise_data (LIKE schools_udise_data_unpartitioned_bak INCLUDING DEFAULTS)
+PARTITION BY LIST (year_id);
+
+ALTER TABLE schools_udise_data
+    DROP COLUMN IF EXISTS id,
+    DROP COLUMN basic_info,
+    DROP COLUMN report_card,
+    DROP COLUMN facility_data,
+    DROP COLUMN profile_data,
+    DROP COLUMN enrollment_social,
+    DROP COLUMN enrollment_religion,
+    DROP COLUMN enrollment_mainstreamed,
+    DROP COLUMN enrollment_ews,
+    DROP COLUMN enrollment_rte,
+    ADD COLUMN IF NOT EXISTS effective_year INTEGER,
+    ADD COLUMN IF NOT EXISTS enrichment_manifest JSONB,
+    ADD PRIMARY KEY (school_id, year_id),
+    ADD UNIQUE (udise_code, year_id);
+
+-- 3. One partition per year present, plus a default for unexpected years
+CREATE OR REPLACE FUNCTION add_school_year_partition(p_year_id INTEGER) RETURNS VOID AS $$
+BEGIN
+    EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF schools_udise_data FOR VALUES IN (%s)',
+                   'schools_udise_data_y' || p_year_id, p_year_id);
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT add_school_year_partition(year_id) FROM (SELECT DISTINCT year_id FROM schools_udise_data_unpartitioned_bak) y;
+CREATE TABLE schools_udise_data_default PARTITION OF schools_udise_data DEFAULT;
+
+-- 4. Copy registry + summary columns. Rows without a school_id cannot be keyed, and a
+-- duplicate (school_id, year_id) or (udise_code, year_id) keeps only its newest row (highest id);
+-- everything left out is kept in schools_udise_data_migration_rejects with its blobs.
+CREATE TEMP TABLE migration_keep ON COMMIT DROP AS
+SELECT id FROM (
+    SELECT DISTINCT ON (udise_code, year_id) id
+    FROM (
+        SELECT DISTINCT ON (school_id, year_id) id, udise_code, year_id
+        FROM schools_udise_data_unpartitioned_bak
+        WHERE school_id IS NOT NULL
+        ORDER BY school_id, year_id, id DESC
+    ) by_school
+    ORDER BY udise_code, year_id, id DESC
+) by_code;
+
+CREATE TABLE schools_udise_data_migration_rejects AS
+SELECT CASE WHEN b.school_id IS NULL THEN 'missing_school_id' ELSE 'duplicate' END AS reject_reason, b.*
+FROM schools_udise_data_unpartitioned_bak b
+WHERE NOT EXISTS (SELECT 1 FROM migration_keep k WHERE k.id = b.id);
+
+DO $$
+DECLARE
+    v_columns TEXT;
+BEGIN
+    SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO v_columns
+    FROM information_schema.columns
+    WHERE table_name = 'schools_udise_data' AND table_schema = current_schema()
+      AND column_name IN (SELECT column_name FROM information_schema.columns
+                          WHERE table_name = 'schools_udise_data_unpartitioned_bak' AND table_schema = current_schema());
+    EXECUTE format('INSERT INTO schools_udise_data (%s) SELECT %s FROM schools_udise_data_unpartitioned_bak
+                    WHERE id IN (SELECT id FROM migration_keep)', v_columns, v_columns);
+END $$;
+
+-- 5. Per-fragment blob table, filled from the inline columns
+CREATE TABLE IF NOT EXISTS school_fragments (
+    school_id INTEGER NOT NULL,
+    year_id INTEGER NOT NULL,
+    fragment VARCHAR(30) NOT NULL,
+    payload JSONB NOT NULL,
+    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (school_id, year_id, fragment)
+) PARTITION BY LIST (fragment);
+
+DO $$
+DECLARE
+    v_fragment TEXT;
+BEGIN
+    FOREACH v_fragment IN ARRAY ARRAY['basic_info', 'report_card', 'facility_data', 'profile_data',
+                                      'enrollment_social', 'enrollment_religion', 'enrollment_mainstreamed',
+                                      'enrollment_ews', 'enrollment_rte']
+    LOOP
+        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF school_fragments FOR VALUES IN (%L)',
+                       'school_fragments_' || v_fragment, v_fragment);
+        EXECUTE format('INSERT INTO school_fragments (school_id, year_id, fragment, payload, fetched_at)
+                        SELECT school_id, year_id, %L, %I, COALESCE(last_scraped_at, CURRENT_TIMESTAMP)
+                        FROM schools_udise_data_unpartitioned_bak
+                        WHERE %I IS NOT NULL AND id IN (SELECT id FROM migration_keep)
+                        ON CONFLICT DO NOTHING', v_fragment, v_fragment, v_fragment);
+    END LOOP;
+END $$;
+
+-- 6. Indexes
+CREATE INDEX IF NOT EXISTS idx_schools_udise_data_udise_code ON schools_udise_data(udise_code);
+CREATE INDEX IF NOT EXISTS idx_schools_udise_data_state_status ON schools_udise_data(state_name, scrape_status);
+CREATE INDEX IF NOT EXISTS idx_schools_udise_data_lgd_village_id ON schools_udise_data(lgd_village_id);
+CREATE INDEX IF NOT EXISTS idx_schools_udise_data_pincode ON schools_udise_data(pincode);
+CREATE INDEX IF NOT EXISTS idx_schools_udise_data_cluster_id ON schools_udise_data(cluster_id);
+
+-- 7. Views (the old ones followed the rename to the backup table)
+DROP VIEW IF EXISTS school_student_population_view, school_facility_extract, schools_udise_data_full;
+
+-- Compatibility View: the pre-partitioning wide row (registry + summary + the nine blobs).
+-- Blob columns are per-row index lookups, evaluated only when a query selects them.
+CREATE OR REPLACE VIEW schools_udise_data_full AS
+SELECT s.*,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'basic_info') AS basic_info,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'report_card') AS report_card,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'facility_data') AS facility_data,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'profile_data') AS profile_data,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'enrollment_social') AS enrollment_social,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'enrollment_religion') AS enrollment_religion,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'enrollment_mainstreamed') AS enrollment_mainstreamed,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'enrollment_ews') AS enrollment_ews,
+       (SELECT payload FROM school_fragments f WHERE f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'enrollment_rte') AS enrollment_rte
+FROM schools_udise_data s;
+
+-- Facility Facts: facility_data extracted once per write instead of on every view read.
+-- school_facility_extract is the single extraction definition; the triggers below
+-- re-extract only schools whose facility_data fragment (or name/state) changed.
+CREATE OR REPLACE VIEW school_facility_extract AS
+SELECT s.udise_code, s.year_id, s.school_name, s.state_name,
+       f.payload->'data'->>'bldStatus' as building_status,
+       safe_numeric(f.payload->'data'->>'bldBlkTot')::INTEGER as building_blocks,
+       f.payload->'data'->>'bndrywallType' as boundary_wall_type,
+       safe_numeric(f.payload->'data'->>'playgroundYn') = 1 as has_playground,
+       safe_numeric(f.payload->'data'->>'rampsYn') = 1 as has_ramps,
+       safe_numeric(f.payload->'data'->>'handrailsYn') = 1 as has_handrails,
+       safe_numeric(f.payload->'data'->>'solarpanelYn') = 1 as has_solar_power,
+       safe_numeric(f.payload->'data'->>'rainHarvestYn') = 1 as has_rain_harvesting,
+       safe_numeric(f.payload->'data'->>'clsrmsInst')::INTEGER as total_classrooms,
+       safe_numeric(f.payload->'data'->>'clsrmsGd')::INTEGER as rooms_good,
+       safe_numeric(f.payload->'data'->>'clsrmsMin')::INTEGER as rooms_minor_repair,
+       safe_numeric(f.payload->'data'->>'clsrmsMaj')::INTEGER as rooms_major_repair,
+       safe_numeric(f.payload->'data'->>'clsrmsGdPpu')::INTEGER as rooms_pucca_good,
+       safe_numeric(f.payload->'data'->>'stusHvFurnt') = 1 as has_furniture,
+       safe_numeric(f.payload->'data'->>'internetYn') = 1 as has_internet,
+       safe_numeric(f.payload->'data'->>'ictLabYn') = 1 as has_ict_lab,
+       safe_numeric(f.payload->'data'->>'laptopTot')::INTEGER as laptop_count,
+       safe_numeric(f.payload->'data'->>'desktopFun')::INTEGER as desktop_count,
+       safe_numeric(f.payload->'data'->>'projectorTot')::INTEGER as projector_count,
+       safe_numeric(f.payload->'data'->>'printerTot')::INTEGER as printer_count,
+       safe_numeric(f.payload->'data'->>'hmRoomYn') = 1 as has_principal_room,
+       safe_numeric(f.payload->'data'->>'libraryYn') = 1 as has_library,
+       safe_numeric(f.payload->'data'->>'tinkeringLabYn') = 1 as has_atal_tinkering_lab,
+       safe_numeric(f.payload->'data'->>'othrooms')::INTEGER as staff_and_store_rooms_count,
+       CURRENT_TIMESTAMP as refreshed_at
+FROM schools_udise_data s
+LEFT JOIN school_fragments f
+       ON f.school_id = s.school_id AND f.year_id = s.year_id AND f.fragment = 'facility_data';
+
+-- View: Student Population (Thin/Basic Overview)
+CREATE OR REPLACE VIEW school_student_population_view AS
+SELECT udise_code, school_name, state_name AS state, district_name AS district, 
+       block_name AS block, cluster_name AS cluster, 
+       total_students, total_boys, total_girls, year_id
+FROM schools_udise_data
+WHERE state_name IS NOT NULL;
+
+-- 8. Facility-fact functions (the pre-partitioning ones read the inline facility_data column)
+-- Upserts facts for the given schools (NULL = every school; used for backfill)
+CREATE OR REPLACE FUNCTION refresh_school_facility_facts(p_udise_codes TEXT[] DEFAULT NULL) RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    -- Facts for school-years that no longer exist (e.g. year_id moved to the effective year)
+    DELETE FROM school_facility_facts f
+    WHERE p_udise_codes IS NOT NULL AND f.udise_code = ANY(p_udise_codes)
+      AND NOT EXISTS (SELECT 1 FROM schools_udise_data s WHERE s.udise_code = f.udise_code AND s.year_id = f.year_id);
+
+    INSERT INTO school_facility_facts
+    SELECT * FROM school_facility_extract e
+    WHERE p_udise_codes IS NULL OR e.udise_code = ANY(p_udise_codes)
+    ON CONFLICT (udise_code, year_id) DO UPDATE SET
+        school_name = EXCLUDED.school_name, state_name = EXCLUDED.state_name,
+        building_status = EXCLUDED.building_status, building_blocks = EXCLUDED.building_blocks,
+        boundary_wall_type = EXCLUDED.boundary_wall_type, has_playground = EXCLUDED.has_playground,
+        has_ramps = EXCLUDED.has_ramps, has_handrails = EXCLUDED.has_handrails,
+        has_solar_power = EXCLUDED.has_solar_power, has_rain_harvesting = EXCLUDED.has_rain_harvesting,
+        total_classrooms = EXCLUDED.total_classrooms, rooms_good = EXCLUDED.rooms_good,
+        rooms_minor_repair = EXCLUDED.rooms_minor_repair, rooms_major_repair = EXCLUDED.rooms_major_repair,
+        rooms_pucca_good = EXCLUDED.rooms_pucca_good, has_furniture = EXCLUDED.has_furniture,
+        has_internet = EXCLUDED.has_internet, has_ict_lab = EXCLUDED.has_ict_lab,
+        laptop_count = EXCLUDED.laptop_count, desktop_count = EXCLUDED.desktop_count,
+        projector_count = EXCLUDED.projector_count, printer_count = EXCLUDED.printer_count,
+        has_principal_room = EXCLUDED.has_principal_room, has_library = EXCLUDED.has_library,
+        has_atal_tinkering_lab = EXCLUDED.has_atal_tinkering_lab,
+        staff_and_store_rooms_count = EXCLUDED.staff_and_store_rooms_count,
+        refreshed_at = EXCLUDED.refreshed_at;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level triggers: one set-based refresh per batch write, only for changed schools
+CREATE OR REPLACE FUNCTION school_facility_facts_on_insert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_school_facility_facts(ARRAY(SELECT DISTINCT udise_code FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION school_facility_facts_on_update() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_school_facility_facts(ARRAY(
+        SELECT DISTINCT n.udise_code
+        FROM new_rows n
+        LEFT JOIN old_rows o ON o.udise_code = n.udise_code AND o.year_id = n.year_id
+        WHERE o.udise_code IS NULL
+           OR n.school_name IS DISTINCT FROM o.school_name
+           OR n.state_name IS DISTINCT FROM o.state_name
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION school_facility_facts_on_delete() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM school_facility_facts f USING old_rows o
+    WHERE f.udise_code = o.udise_code AND f.year_id = o.year_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION school_facility_facts_on_fragment() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_school_facility_facts(ARRAY(
+        SELECT DISTINCT s.udise_code
+        FROM new_rows n
+        JOIN schools_udise_data s ON s.school_id = n.school_id AND s.year_id = n.year_id
+        WHERE n.fragment = 'facility_data'
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 9. Triggers: move whatever was attached to the old table, then (re)create the facility-fact set
+DO $$
+DECLARE
+    v_trigger RECORD;
+BEGIN
+    FOR v_trigger IN
+        SELECT tgname, pg_get_triggerdef(oid) AS def FROM pg_trigger
+        WHERE tgrelid = 'schools_udise_data_unpartitioned_bak'::regclass AND NOT tgisinternal
+    LOOP
+        EXECUTE format('DROP TRIGGER %I ON schools_udise_data_unpartitioned_bak', v_trigger.tgname);
+        EXECUTE replace(v_trigger.def, ' ON ' || 'schools_udise_data_unpartitioned_bak'::regclass::text || ' ',
+                        ' ON schools_udise_data ');
+    END LOOP;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_school_facility_facts_insert ON schools_udise_data;
+CREATE TRIGGER trg_school_facility_facts_insert
+AFTER INSERT ON schools_udise_data
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION school_facility_facts_on_insert();
+
+DROP TRIGGER IF EXISTS trg_school_facility_facts_update ON schools_udise_data;
+CREATE TRIGGER trg_school_facility_facts_update
+AFTER UPDATE ON schools_udise_data
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION school_facility_facts_on_update();
+
+DROP TRIGGER IF EXISTS trg_school_facility_facts_delete ON schools_udise_data;
+CREATE TRIGGER trg_school_facility_facts_delete
+AFTER DELETE ON schools_udise_data
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION school_facility_facts_on_delete();
+
+DROP TRIGGER IF EXISTS trg_school_facility_facts_fragment_insert ON school_fragments;
+CREATE TRIGGER trg_school_facility_facts_fragment_insert
+AFTER INSERT ON school_fragments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION school_facility_facts_on_fragment();
+
+DROP TRIGGER IF EXISTS trg_school_facility_facts_fragment_update ON school_fragments;
+CREATE TRIGGER trg_school_facility_facts_fragment_update
+AFTER UPDATE ON school_fragments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION school_facility_facts_on_fragment();
+
+-- 10. Facts for rejected rows go; the rest are re-extracted from the fragments
+DELETE FROM school_facility_facts f
+WHERE NOT EXISTS (SELECT 1 FROM schools_udise_data s WHERE s.udise_code = f.udise_code AND s.year_id = f.year_id);
+SELECT refresh_school_facility_facts();
+
+COMMIT;
+
+ANALYZE schools_udise_data;
+ANALYZE school_fragments;
+
+-- Once verified (and rejects reviewed):
+-- DROP TABLE schools_udise_data_unpartitioned_bak CASCADE;
+-- DROP TABLE schools_udise_data_migration_rejects;
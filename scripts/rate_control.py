@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Adaptive AIMD Rate Controller
+Shared request pacing for the UDISE+ and data.gov.in fetchers.
+- Additive increase: every healthy response nudges the rate up (about +`increase` req/s per second of traffic).
+- Multiplicative decrease: 503s, timeouts and slow responses cut the rate for every caller at once.
+- 503s additionally pause all callers for `pause_s` (replaces the per-thread 60s sleep).
+"""
+import time
+import logging
+import threading
+
+logger = logging.getLogger("RateControl")
+
+class AIMDController:
+    def __init__(self, name, rate, min_rate=0.2, max_rate=20.0, increase=0.5, decrease=0.5,
+                 latency_target=5.0, pause_s=60.0, decrease_interval=2.0):
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.pause_s = pause_s
+        self.decrease_interval = decrease_interval  # One burst of failures = one decrease
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.rate = 0
+        self.set_rate(rate)
+
+    def set_rate(self, rate, max_rate=None):
+        """Sets the current (and optionally max) rate; a rate of 0 disables pacing."""
+        with self.lock:
+            if max_rate is not None: self.max_rate = max_rate
+            self.rate = min(rate, self.max_rate) if rate and rate > 0 else 0
+
+    def reserve(self):
+        """Claims the next send slot and returns how long the caller must wait (seconds)."""
+        with self.lock:
+            if not self.rate: return 0.0
+            now = time.monotonic()
+            slot = max(now, self.next_slot, self.paused_until)
+            self.next_slot = slot + 1.0 / self.rate
+            return slot - now
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0: time.sleep(wait)
+
+    def record_success(self, latency):
+        if latency > self.latency_target:
+            self._decrease(f"slow response ({latency:.1f}s)")
+            return
+        with self.lock:
+            if self.rate:
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def record_overload(self):
+        """503: back off multiplicatively and pause every caller."""
+        self._decrease("503 Service Unavailable", pause=True)
+
+    def record_timeout(self):
+        self._decrease("timeout")
+
+    def _decrease(self, reason, pause=False):
+        with self.lock:
+            if not self.rate: return
+            now = time.monotonic()
+            if pause:
+                self.paused_until = max(self.paused_until, now + self.pause_s)
+            if now - self.last_decrease < self.decrease_interval:
+                return
+            self.last_decrease = now
+            old = self.rate
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+        logger.warning(f"  ! [{self.name}] {reason}: rate {old:.2f} -> {self.rate:.2f} req/s" + (f", pausing all callers {self.pause_s:.0f}s" if pause else ""))
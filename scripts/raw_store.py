@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Local Raw-Response Store
+Compressed, content-addressed archive of API responses keyed by
+(endpoint, params, fetch date). Lets enrichment/discovery be re-derived
+offline (--replay) without touching the live API.
+
+Layout: <RAW_STORE_DIR>/<key[:2]>/<key>/<YYYY-MM-DD>.json.gz
+where key = sha256(endpoint + canonical params).
+"""
+import os
+import json
+import gzip
+import hashlib
+import tempfile
+from datetime import date
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORE_DIR = os.getenv("RAW_STORE_DIR", os.path.join(BASE_DIR, "raw_store"))
+
+class StoredResponse:
+    """Minimal stand-in for requests.Response when replaying from the store."""
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+
+    def json(self):
+        return json.loads(self.text)
+
+def request_key(url, params=None):
+    canonical = json.dumps([url, {str(k): str(v) for k, v in (params or {}).items()}], sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _key_dir(key):
+    return os.path.join(STORE_DIR, key[:2], key)
+
+def save(url, params, status_code, text, fetch_date=None):
+    """Writes one response atomically; a same-day refetch replaces the earlier copy."""
+    key = request_key(url, params)
+    key_dir = _key_dir(key)
+    os.makedirs(key_dir, exist_ok=True)
+    fetch_date = (fetch_date or date.today()).isoformat()
+    record = {"url": url, "params": params or {}, "status": status_code, "fetch_date": fetch_date, "body": text}
+
+    fd, tmp_path = tempfile.mkstemp(dir=key_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            gz.write(json.dumps(record).encode("utf-8"))
+        os.replace(tmp_path, os.path.join(key_dir, f"{fetch_date}.json.gz"))
+    except Exception:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+    return key
+
+def load(url, params=None, as_of=None):
+    """Returns the newest stored record on or before `as_of` (ISO date), or None."""
+    key_dir = _key_dir(request_key(url, params))
+    if not os.path.isdir(key_dir):
+        return None
+    dates = sorted(f[:-len(".json.gz")] for f in os.listdir(key_dir) if f.endswith(".json.gz"))
+    if as_of:
+        dates = [d for d in dates if d <= as_of]
+    if not dates:
+        return None
+    with gzip.open(os.path.join(key_dir, f"{dates[-1]}.json.gz"), "rb") as gz:
+        return json.loads(gz.read().decode("utf-8"))
+
+def replay(url, params=None, as_of=None):
+    """Serves a stored response; misses come back as 404 so callers treat them as absent data."""
+    record = load(url, params, as_of)
+    if not record:
+        return StoredResponse(404)
+    return StoredResponse(record["status"], record["body"])
@@ -1,11 +1,14 @@
 #!/bin/bash
 # sequence_orchestrator.sh
-# Automates the sequential deep mining transition across multiple states.
+# Queues every state into enrichment_queue and drains them in parallel with N workers.
+# Workers claim leased batches (FOR UPDATE SKIP LOCKED); more can be started on other machines with:
+#   python3 enrich_registry.py --worker
 
 VENV_PYTHON="/projects/git/builds/prakalpa_proposal/backend/venv/bin/python3"
 SCRIPT="enrich_registry.py"
 LOG_DIR="../logs/udise_scraper"
 GOA_PID_FILE="enrichment_goa.pid"
+WORKER_PROCS=${WORKER_PROCS:-4}
 
 # State Queue in Order of Priority (Note: GOA 100% recovered)
 STATES=("KARNATAKA" "KERALA" "ANDHRA PRADESH" "TELANGANA" "TAMILNADU")
@@ -24,23 +27,23 @@ if [ -f "$GOA_PID_FILE" ]; then
     fi
 fi
 
-# 2. Iterate through the State Queue
+# 2. Enqueue every state (earlier in STATES = higher priority)
+PRIORITY=${#STATES[@]}
 for STATE in "${STATES[@]}"; do
-    STATE_FILE_NAME=$(echo "$STATE" | tr ' ' '_' | tr '[:upper:]' '[:lower:]')
-    echo "$(date): Launching $STATE State Push..." >> $LOG_DIR/orchestrator.log
-    
-    nohup $VENV_PYTHON $SCRIPT --state "$STATE" --mode recovery > $LOG_DIR/enrich_$STATE_FILE_NAME.log 2>&1 &
-    CURRENT_PID=$!
-    echo $CURRENT_PID > "enrichment_${STATE_FILE_NAME}.pid"
-    
-    echo "$(date): $STATE started with PID: $CURRENT_PID. Waiting for completion..." >> $LOG_DIR/orchestrator.log
-    
-    while ps -p $CURRENT_PID > /dev/null; do
-        sleep 300 # Check every 5 minutes
-    done
-    
-    echo "$(date): $STATE enrichment completed. Proceeding to next state..." >> $LOG_DIR/orchestrator.log
-    sleep 30
+    echo "$(date): Enqueuing $STATE (Priority: $PRIORITY)..." >> $LOG_DIR/orchestrator.log
+    $VENV_PYTHON $SCRIPT --enqueue --state "$STATE" --mode recovery --priority $PRIORITY >> $LOG_DIR/orchestrator.log 2>&1
+    PRIORITY=$((PRIORITY - 1))
 done
 
+# 3. Launch parallel queue workers and wait for the queue to drain
+PIDS=()
+for i in $(seq 1 $WORKER_PROCS); do
+    nohup $VENV_PYTHON $SCRIPT --worker > $LOG_DIR/enrich_worker_$i.log 2>&1 &
+    PIDS+=($!)
+    echo $! > "enrichment_worker_$i.pid"
+    echo "$(date): Worker $i started with PID: $!" >> $LOG_DIR/orchestrator.log
+done
+
+wait "${PIDS[@]}"
+
 echo "$(date): --- ALL PLANNED STATES COMPLETED ---" >> $LOG_DIR/orchestrator.log
@@ -26,6 +26,7 @@ function show_help {
     echo "  --lgd              Sync LGD Master (Full Geography from API)"
     echo "  --ndap-stats       Ingest District Demographics (NDAP 9307)"
     echo "  --ndap-amenities   Ingest Village Amenities (NDAP 7121 - Massive CSV)"
+    echo "  --pincodes         Resolve village_pincode_mapping into the LGD crosswalk (after a pincode load)"
     echo "  --file [PATH]      Specify path to source file (used with --ndap-stats)"
     echo "  --help             Show this help message"
 }
@@ -55,15 +56,19 @@ function ingest_7121 {
     local csv_file="$BASE_DIR/source_data_files/NDAP_DS_7121/data_7121.csv"
     
     if [ -f "$csv_file" ]; then
-        echo ">>> Ingesting Village Amenities (7121) via COPY from $csv_file..."
-        # Note: Using docker exec assuming DB is running in container named prakalpa_proposal-db-1
-        cat "$csv_file" | docker exec -i prakalpa_proposal-db-1 psql -U "$DB_USER" -d "$DB_NAME" -c "COPY village_amenities_raw FROM STDIN WITH (FORMAT csv, HEADER true);"
+        echo ">>> Ingesting Village Amenities (7121) via parallel COPY from $csv_file..."
+        python3 "$SCRIPT_DIR/ingest_ndap_7121.py" --file "$csv_file"
         echo ">>> Amenities ingestion complete."
     else
         echo "Error: Source file $csv_file not found. Skipping NDAP 7121."
     fi
 }
 
+function refresh_pincode_crosswalk {
+    echo ">>> Resolving village pincodes against LGD..."
+    psql -U "$DB_USER" -d "$DB_NAME" -c "SELECT refresh_lgd_crosswalk('village_pincode')"
+}
+
 # --- Argument Parsing ---
 
 if [ $# -eq 0 ]; then
@@ -75,6 +80,7 @@ SOURCE_PATH=""
 RUN_LGD=false
 RUN_9307=false
 RUN_7121=false
+RUN_PINCODES=false
 
 while [[ $# -gt 0 ]]; do
     case "$1" in
@@ -82,6 +88,7 @@ while [[ $# -gt 0 ]]; do
             RUN_LGD=true
             RUN_9307=true
             RUN_7121=true
+            RUN_PINCODES=true
             shift
             ;;
         --lgd)
@@ -96,6 +103,10 @@ while [[ $# -gt 0 ]]; do
             RUN_7121=true
             shift
             ;;
+        --pincodes)
+            RUN_PINCODES=true
+            shift
+            ;;
         --file)
             SOURCE_PATH="$2"
             shift 2
@@ -117,5 +128,6 @@ done
 if [ "$RUN_LGD" = true ]; then ingest_lgd; fi
 if [ "$RUN_9307" = true ]; then ingest_9307 "$SOURCE_PATH"; fi
 if [ "$RUN_7121" = true ]; then ingest_7121; fi
+if [ "$RUN_PINCODES" = true ]; then refresh_pincode_crosswalk; fi
 
 echo "Done."